@@ -0,0 +1,262 @@
+# benchmarks/bench_media_pipeline.py
+"""
+End-to-end benchmark of the media path: fake Bot API -> pipeline -> S3 stand-in.
+
+Drives handlers.common.handle_media_upload (a bouquet of --photos photos) and
+storage.upload_video_to_storage at several sizes / concurrency levels and reports
+p50/p95 latency, throughput, peak RSS (main process + image pool) and where the
+time goes per stage (metrics media.stage.*). Both stand-ins run in this process,
+so the main RSS includes the test files of the current scenario.
+
+    python -m benchmarks.bench_media_pipeline
+    python -m benchmarks.bench_media_pipeline --photo-edges 1280 4000 --concurrency 1 4 8 --rounds 3
+    python -m benchmarks.bench_media_pipeline --skip-video --s3-client aiohttp --tg-latency 0.05
+
+Every photo is unique, so the media index never short-circuits an upload.
+Without a reachable REDIS_URL the index falls back to the DB (a temp SQLite file).
+"""
+import argparse
+import asyncio
+import io
+import os
+import resource
+import statistics
+import tempfile
+import time
+import uuid
+
+from benchmarks.bot_api_stub import BotAPIStub, make_bot
+from benchmarks.s3_standin import S3Standin
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+# ---------- память ----------
+
+def _pool_pids() -> list[int]:
+    from media_workers import _pool
+    return list(getattr(_pool, "_processes", None) or {}) if _pool else []
+
+
+def _reset_peak_rss(pids: list[int]) -> None:
+    """Linux: '5' в clear_refs сбрасывает VmHWM, чтобы пик считался по сценарию."""
+    for pid in ["self", *pids]:
+        try:
+            with open(f"/proc/{pid}/clear_refs", "w") as f:
+                f.write("5")
+        except OSError:
+            pass
+
+
+def _peak_rss_mb(pid="self") -> float:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if pid == "self":
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return 0.0
+
+
+def _peak_report() -> str:
+    pool = [_peak_rss_mb(pid) for pid in _pool_pids()]
+    text = f"main {_peak_rss_mb():.0f} MB"
+    if pool:
+        text += f", pool {sum(pool):.0f} MB ({len(pool)} proc, max {max(pool):.0f})"
+    return text
+
+
+# ---------- тестовые файлы ----------
+
+def _noise_jpeg(edge: int) -> bytes:
+    """Шумная картинка — худший случай для JPEG, размер близок к фото с телефона."""
+    from PIL import Image
+
+    size = (edge, edge * 3 // 4)
+    image = Image.frombytes("RGB", size, os.urandom(size[0] * size[1] * 3))
+    buf = io.BytesIO()
+    image.save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
+def _unique(data: bytes) -> bytes:
+    # хвост после EOI не мешает декодеру, но меняет sha256
+    return data + uuid.uuid4().bytes
+
+
+def _drop_payloads(stub: BotAPIStub, s3: S3Standin) -> None:
+    """Стенды живут в этом же процессе: их данные не должны копиться в пике RSS."""
+    stub.files.clear()
+    for bucket in s3.buckets.values():
+        bucket.clear()
+
+
+# ---------- сценарии ----------
+
+def _stage_delta(before: dict, after: dict) -> str:
+    parts = []
+    for key in sorted(after):
+        if not (key.startswith("media.stage.") and key.endswith(".seconds")):
+            continue
+        stage = key[len("media.stage."):-len(".seconds")]
+        count = after.get(f"media.stage.{stage}.count", 0) - before.get(f"media.stage.{stage}.count", 0)
+        seconds = after[key] - before.get(key, 0)
+        if count:
+            parts.append(f"{stage}={seconds / count * 1000:.0f}ms")
+    return " ".join(parts)
+
+
+async def bench_photos(bot, stub: BotAPIStub, s3: S3Standin, args) -> None:
+    import config
+    import metrics
+    from handlers.common import handle_media_upload
+
+    print(f"\nphotos: {args.photos} per bouquet, {args.rounds} rounds, {args.parallel} bouquets at once")
+    print(f"{'edge':>5} {'KB/photo':>9} {'conc':>5} {'p50 s':>7} {'p95 s':>7} {'photos/s':>9} {'MB/s':>6} {'fail':>5}  peak RSS")
+    for edge in args.photo_edges:
+        base = _noise_jpeg(edge)
+        for concurrency in args.concurrency:
+            config.MEDIA_UPLOAD_CONCURRENCY = concurrency
+            bouquets = [
+                [stub.add_file(_unique(base), ".jpg") for _ in range(args.photos)]
+                for _ in range(args.rounds)
+            ]
+            latencies: list[float] = []
+            failures = 0
+            slots = asyncio.Semaphore(args.parallel)
+
+            async def _one(file_ids: list[str]):
+                nonlocal failures
+                async with slots:
+                    started = time.perf_counter()
+                    result = await handle_media_upload(bot, file_ids, f"bench-{uuid.uuid4().hex[:8]}")
+                    latencies.append(time.perf_counter() - started)
+                    failures += sum(1 for item in result if not item.get("url"))
+
+            _reset_peak_rss(_pool_pids())
+            before = metrics.snapshot()
+            started = time.perf_counter()
+            await asyncio.gather(*(_one(ids) for ids in bouquets))
+            elapsed = time.perf_counter() - started
+
+            photos = args.photos * args.rounds
+            print(
+                f"{edge:>5} {len(base) / 1024:>9.0f} {concurrency:>5} {statistics.median(latencies):>7.2f} "
+                f"{_percentile(latencies, 95):>7.2f} {photos / elapsed:>9.1f} "
+                f"{photos * len(base) / elapsed / 1024 ** 2:>6.1f} {failures:>5}  {_peak_report()}"
+            )
+            print(f"      stages: {_stage_delta(before, metrics.snapshot())}")
+            _drop_payloads(stub, s3)
+
+
+async def bench_videos(bot, stub: BotAPIStub, s3: S3Standin, args) -> None:
+    import metrics
+    from storage import upload_video_to_storage
+
+    print(f"\nvideos: {args.rounds} uploads per level")
+    print(f"{'MB':>5} {'conc':>5} {'p50 s':>7} {'p95 s':>7} {'MB/s':>7} {'fail':>5}  peak RSS")
+    for size_mb in args.video_mb:
+        payload = os.urandom(int(size_mb * 1024 ** 2))
+        for concurrency in args.video_concurrency:
+            file_ids = [stub.add_file(_unique(payload), ".mp4") for _ in range(args.rounds)]
+            latencies: list[float] = []
+            failures = 0
+            slots = asyncio.Semaphore(concurrency)
+
+            async def _one(file_id: str):
+                nonlocal failures
+                async with slots:
+                    started = time.perf_counter()
+                    url = await upload_video_to_storage(bot, file_id, "bench-video")
+                    latencies.append(time.perf_counter() - started)
+                    failures += 0 if url else 1
+
+            _reset_peak_rss([])
+            before = metrics.snapshot()
+            started = time.perf_counter()
+            await asyncio.gather(*(_one(fid) for fid in file_ids))
+            elapsed = time.perf_counter() - started
+            print(
+                f"{size_mb:>5g} {concurrency:>5} {statistics.median(latencies):>7.2f} "
+                f"{_percentile(latencies, 95):>7.2f} {len(file_ids) * size_mb / elapsed:>7.1f} "
+                f"{failures:>5}  {_peak_report()}"
+            )
+            print(f"      stages: {_stage_delta(before, metrics.snapshot())}")
+            _drop_payloads(stub, s3)
+        del payload
+
+
+async def main(args) -> None:
+    s3 = S3Standin(latency=args.s3_latency)
+    stub = BotAPIStub(latency=args.tg_latency)
+    s3_endpoint, stop_s3 = s3.start_in_thread()
+    tg_endpoint, stop_tg = stub.start_in_thread()
+    workdir = tempfile.mkdtemp(prefix="bench-media-")
+
+    # настройки читаются при импорте модулей бота — выставляем до импорта
+    os.environ.update({
+        "YC_ACCESS_KEY_ID": "bench",
+        "YC_SECRET_ACCESS_KEY": "bench",
+        "YC_BUCKET_NAME": "bench",
+        "YC_ENDPOINT_URL": s3_endpoint,
+        "STORAGE_S3_CLIENT": args.s3_client,
+        "STORAGE_BACKEND": args.storage,
+        "LOCAL_STORAGE_DIR": os.path.join(workdir, "media"),
+        "LOCAL_STORAGE_SERVE": "0",
+        "DATABASE_URL": f"sqlite+aiosqlite:///{os.path.join(workdir, 'bench.db')}",
+    })
+    if args.normalize:
+        os.environ["MEDIA_NORMALIZE"] = "1"
+    if args.no_derivatives:
+        os.environ["MEDIA_DERIVATIVES"] = "0"
+
+    from database import init_db, engine
+    from storage import media_storage
+    from cache import close_redis
+    from media_workers import shutdown_image_pool
+
+    engine.sync_engine.echo = False  # SQL-лог исказил бы замеры
+    await init_db()
+    await media_storage.ensure_ready()
+    bot = make_bot(tg_endpoint)
+    print(f"storage={media_storage.name} s3={s3_endpoint} bot_api={tg_endpoint} "
+          f"tg_latency={args.tg_latency}s s3_latency={args.s3_latency}s")
+    try:
+        if not args.skip_photos:
+            await bench_photos(bot, stub, s3, args)
+        if not args.skip_video:
+            await bench_videos(bot, stub, s3, args)
+    finally:
+        await bot.session.close()
+        await media_storage.close()
+        await close_redis()
+        await engine.dispose()
+        shutdown_image_pool()
+        stop_tg()
+        stop_s3()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--photos", type=int, default=10, help="фото в букете")
+    parser.add_argument("--photo-edges", type=int, nargs="+", default=[1280, 2560], help="длинная сторона, px")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8], help="MEDIA_UPLOAD_CONCURRENCY")
+    parser.add_argument("--parallel", type=int, default=1, help="сколько букетов сохраняется одновременно")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--video-mb", type=float, nargs="+", default=[5, 20])
+    parser.add_argument("--video-concurrency", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--tg-latency", type=float, default=0.02, help="задержка Bot API на запрос, сек")
+    parser.add_argument("--s3-latency", type=float, default=0.005, help="задержка S3 на запрос, сек")
+    parser.add_argument("--s3-client", choices=["boto3", "aiohttp"], default="boto3")
+    parser.add_argument("--storage", choices=["s3", "local"], default="s3")
+    parser.add_argument("--normalize", action="store_true", help="включить MEDIA_NORMALIZE")
+    parser.add_argument("--no-derivatives", action="store_true", help="выключить MEDIA_DERIVATIVES")
+    parser.add_argument("--skip-photos", action="store_true")
+    parser.add_argument("--skip-video", action="store_true")
+    asyncio.run(main(parser.parse_args()))
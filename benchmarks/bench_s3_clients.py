@@ -0,0 +1,93 @@
+# benchmarks/bench_s3_clients.py
+"""
+boto3 (executor) vs aiohttp (native asyncio) S3 clients against a local S3 stand-in.
+
+    python -m benchmarks.bench_s3_clients --objects 200 --size 262144 --concurrency 1 8 32
+    python -m benchmarks.bench_s3_clients --endpoint http://127.0.0.1:9000   # внешний стенд (minio и т.п.)
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+from benchmarks.s3_standin import S3Standin
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def _run(storage, objects: int, size: int, concurrency: int) -> dict:
+    payload = os.urandom(size)
+    slots = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+    failures = 0
+
+    async def _one(i: int):
+        nonlocal failures
+        async with slots:
+            started = time.perf_counter()
+            url = await storage.upload_from_memory(payload, f"bouquets/bench/{i}.bin", "application/octet-stream")
+            latencies.append(time.perf_counter() - started)
+            if not url:
+                failures += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(_one(i) for i in range(objects)))
+    elapsed = time.perf_counter() - started
+
+    await storage.delete_bouquet_files("bench")
+    return {
+        "ops_s": objects / elapsed,
+        "mb_s": objects * size / elapsed / 1024 ** 2,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": _percentile(latencies, 95) * 1000,
+        "failures": failures,
+    }
+
+
+async def main(args):
+    stop = None
+    endpoint = args.endpoint
+    if not endpoint:
+        endpoint, stop = S3Standin(latency=args.latency).start_in_thread()
+
+    os.environ.update({
+        "YC_ACCESS_KEY_ID": os.getenv("YC_ACCESS_KEY_ID") or "bench",
+        "YC_SECRET_ACCESS_KEY": os.getenv("YC_SECRET_ACCESS_KEY") or "bench",
+        "YC_BUCKET_NAME": args.bucket,
+        "YC_ENDPOINT_URL": endpoint,
+    })
+    from storage import YandexObjectStorage
+    from s3_async import AsyncS3Storage
+
+    print(f"endpoint={endpoint} objects={args.objects} size={args.size}B")
+    print(f"{'client':<8} {'conc':>5} {'ops/s':>9} {'MB/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'fail':>5}")
+    try:
+        for concurrency in args.concurrency:
+            for name, factory in (("boto3", YandexObjectStorage), ("aiohttp", AsyncS3Storage)):
+                storage = factory()
+                try:
+                    res = await _run(storage, args.objects, args.size, concurrency)
+                finally:
+                    await storage.close()
+                print(
+                    f"{name:<8} {concurrency:>5} {res['ops_s']:>9.1f} {res['mb_s']:>8.1f} "
+                    f"{res['p50_ms']:>8.1f} {res['p95_ms']:>8.1f} {res['failures']:>5}"
+                )
+    finally:
+        if stop:
+            stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoint", help="S3 endpoint; по умолчанию поднимается встроенный стенд")
+    parser.add_argument("--bucket", default="bench")
+    parser.add_argument("--objects", type=int, default=200)
+    parser.add_argument("--size", type=int, default=256 * 1024)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--latency", type=float, default=0.005, help="задержка стенда на запрос, сек")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,113 @@
+# benchmarks/bot_api_stub.py
+"""
+Minimal stand-in for the Telegram Bot API, enough for the media path:
+getFile and file downloads (/file/bot<token>/<path>).
+
+Files are registered up front with add_file(); aiogram talks to the stub through
+a custom API server (TelegramAPIServer.from_base), see make_bot().
+"""
+import asyncio
+import threading
+import uuid
+
+from aiohttp import web
+
+# aiogram проверяет формат токена
+STUB_TOKEN = "123456789:AAbenchmarkbenchmarkbenchmarkbenchm"
+
+
+class BotAPIStub:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency  # искусственная задержка на запрос, сек
+        self.files: dict[str, dict] = {}
+        self.requests = 0
+
+    def add_file(self, data: bytes, ext: str) -> str:
+        """Register a file, return its file_id."""
+        file_id = "BQ" + uuid.uuid4().hex
+        self.files[file_id] = {
+            "data": data,
+            "file_unique_id": "AQ" + uuid.uuid4().hex[:16],
+            "file_path": f"documents/{file_id}{ext}",
+        }
+        return file_id
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self.handle_method)
+        app.router.add_get("/file/bot{token}/{path:.+}", self.handle_file)
+        return app
+
+    async def _tick(self):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def handle_method(self, request: web.Request) -> web.Response:
+        await self._tick()
+        method = request.match_info["method"].lower()
+        params = dict(request.query)
+        if request.can_read_body:
+            params.update(await request.post())
+        if method != "getfile":
+            return web.json_response({"ok": False, "error_code": 404, "description": "Not Found: method not stubbed"})
+
+        file = self.files.get(str(params.get("file_id")))
+        if not file:
+            return web.json_response({"ok": False, "error_code": 400, "description": "Bad Request: invalid file_id"})
+        return web.json_response({"ok": True, "result": {
+            "file_id": params["file_id"],
+            "file_unique_id": file["file_unique_id"],
+            "file_size": len(file["data"]),
+            "file_path": file["file_path"],
+        }})
+
+    async def handle_file(self, request: web.Request) -> web.StreamResponse:
+        await self._tick()
+        file_id = request.match_info["path"].rsplit("/", 1)[-1].split(".", 1)[0]
+        file = self.files.get(file_id)
+        if not file:
+            return web.Response(status=404)
+        return web.Response(body=file["data"], content_type="application/octet-stream")
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> tuple[web.AppRunner, str]:
+        runner = web.AppRunner(self.app())
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        real_port = site._server.sockets[0].getsockname()[1]
+        return runner, f"http://{host}:{real_port}"
+
+    def start_in_thread(self, host: str = "127.0.0.1") -> tuple[str, callable]:
+        """Serve from a separate thread with its own event loop. Returns (base_url, stop)."""
+        loop = asyncio.new_event_loop()
+        ready = threading.Event()
+        state = {}
+
+        def _serve():
+            asyncio.set_event_loop(loop)
+            state["runner"], state["endpoint"] = loop.run_until_complete(self.start(host))
+            ready.set()
+            loop.run_forever()
+            loop.run_until_complete(state["runner"].cleanup())
+            loop.close()
+
+        thread = threading.Thread(target=_serve, name="bot-api-stub", daemon=True)
+        thread.start()
+        ready.wait()
+
+        def _stop():
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+
+        return state["endpoint"], _stop
+
+
+def make_bot(base_url: str):
+    """aiogram Bot pointed at the stub."""
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+
+    session = AiohttpSession(api=TelegramAPIServer.from_base(base_url))
+    return Bot(token=STUB_TOKEN, session=session)
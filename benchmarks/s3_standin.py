@@ -0,0 +1,173 @@
+# benchmarks/s3_standin.py
+"""
+Minimal in-memory S3-compatible server for local benchmarks.
+
+Path-style only, signatures are not verified. Supports what the bot uses:
+HEAD bucket, PUT/DELETE object, ListObjectsV2, DeleteObjects and multipart uploads.
+
+    python -m benchmarks.s3_standin --port 9000
+"""
+import argparse
+import asyncio
+import hashlib
+import threading
+import uuid
+from datetime import datetime, timezone
+from xml.etree import ElementTree
+
+from aiohttp import web
+
+S3_NS = "http://s3.amazonaws.com/doc/2006-03-01/"
+
+
+class S3Standin:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency  # искусственная задержка на запрос, сек
+        self.buckets: dict[str, dict[str, dict]] = {}
+        self.multipart: dict[str, dict[int, bytes]] = {}
+        self.requests = 0
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=1024 ** 3)
+        app.router.add_route("*", "/{bucket}", self.handle_bucket)
+        app.router.add_route("*", "/{bucket}/{key:.+}", self.handle_object)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> tuple[web.AppRunner, str]:
+        runner = web.AppRunner(self.app())
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        real_port = site._server.sockets[0].getsockname()[1]
+        return runner, f"http://{host}:{real_port}"
+
+    def start_in_thread(self, host: str = "127.0.0.1") -> tuple[str, callable]:
+        """
+        Serve from a separate thread with its own event loop, so blocking clients
+        (boto3) in the benchmark loop cannot stall the server. Returns (endpoint, stop).
+        """
+        loop = asyncio.new_event_loop()
+        ready = threading.Event()
+        state = {}
+
+        def _serve():
+            asyncio.set_event_loop(loop)
+            state["runner"], state["endpoint"] = loop.run_until_complete(self.start(host))
+            ready.set()
+            loop.run_forever()
+            loop.run_until_complete(state["runner"].cleanup())
+            loop.close()
+
+        thread = threading.Thread(target=_serve, name="s3-standin", daemon=True)
+        thread.start()
+        ready.wait()
+
+        def _stop():
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+
+        return state["endpoint"], _stop
+
+    def _bucket(self, name: str) -> dict:
+        return self.buckets.setdefault(name, {})
+
+    async def _tick(self):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def handle_bucket(self, request: web.Request) -> web.Response:
+        await self._tick()
+        bucket = self._bucket(request.match_info["bucket"])
+        if request.method == "HEAD":
+            return web.Response()
+        if request.method == "GET":
+            return self._list(bucket, request.query)
+        if request.method == "POST" and "delete" in request.query:
+            root = ElementTree.fromstring(await request.read())
+            for key in root.iter():
+                if key.tag.endswith("Key") and key.text:
+                    bucket.pop(key.text, None)
+            return web.Response(text=f'<DeleteResult xmlns="{S3_NS}"/>', content_type="application/xml")
+        return web.Response(status=405)
+
+    def _list(self, bucket: dict, query) -> web.Response:
+        prefix = query.get("prefix", "")
+        max_keys = int(query.get("max-keys", 1000))
+        start_after = query.get("continuation-token") or query.get("start-after") or ""
+        keys = sorted(k for k in bucket if k.startswith(prefix) and k > start_after)
+        page, truncated = keys[:max_keys], len(keys) > max_keys
+
+        parts = [f'<ListBucketResult xmlns="{S3_NS}"><Prefix>{prefix}</Prefix><KeyCount>{len(page)}</KeyCount>']
+        for key in page:
+            obj = bucket[key]
+            parts.append(
+                f"<Contents><Key>{key}</Key><Size>{len(obj['body'])}</Size>"
+                f"<LastModified>{obj['modified']}</LastModified><ETag>\"{obj['etag']}\"</ETag></Contents>"
+            )
+        parts.append(f"<IsTruncated>{'true' if truncated else 'false'}</IsTruncated>")
+        if truncated:
+            parts.append(f"<NextContinuationToken>{page[-1]}</NextContinuationToken>")
+        parts.append("</ListBucketResult>")
+        return web.Response(text="".join(parts), content_type="application/xml")
+
+    def _store(self, bucket: dict, key: str, body: bytes, content_type: str) -> str:
+        etag = hashlib.md5(body).hexdigest()
+        bucket[key] = {
+            "body": body,
+            "etag": etag,
+            "content_type": content_type,
+            "modified": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+        }
+        return etag
+
+    async def handle_object(self, request: web.Request) -> web.Response:
+        await self._tick()
+        bucket = self._bucket(request.match_info["bucket"])
+        key = request.match_info["key"]
+        query = request.query
+
+        if request.method == "PUT" and "uploadId" in query:
+            body = await request.read()
+            self.multipart[query["uploadId"]][int(query["partNumber"])] = body
+            return web.Response(headers={"ETag": f'"{hashlib.md5(body).hexdigest()}"'})
+        if request.method == "PUT":
+            etag = self._store(bucket, key, await request.read(), request.content_type)
+            return web.Response(headers={"ETag": f'"{etag}"'})
+        if request.method == "POST" and "uploads" in query:
+            upload_id = uuid.uuid4().hex
+            self.multipart[upload_id] = {}
+            return web.Response(
+                text=f'<InitiateMultipartUploadResult xmlns="{S3_NS}"><Key>{key}</Key>'
+                     f"<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>",
+                content_type="application/xml",
+            )
+        if request.method == "POST" and "uploadId" in query:
+            parts = self.multipart.pop(query["uploadId"])
+            etag = self._store(bucket, key, b"".join(parts[n] for n in sorted(parts)), "application/octet-stream")
+            return web.Response(
+                text=f'<CompleteMultipartUploadResult xmlns="{S3_NS}"><ETag>"{etag}"</ETag>'
+                     "</CompleteMultipartUploadResult>",
+                content_type="application/xml",
+            )
+        if request.method == "DELETE" and "uploadId" in query:
+            self.multipart.pop(query["uploadId"], None)
+            return web.Response(status=204)
+        if request.method == "DELETE":
+            bucket.pop(key, None)
+            return web.Response(status=204)
+        if request.method in ("GET", "HEAD"):
+            obj = bucket.get(key)
+            if not obj:
+                return web.Response(status=404)
+            return web.Response(body=obj["body"], content_type=obj["content_type"])
+        return web.Response(status=405)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="In-memory S3 stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", type=float, default=0.0, help="artificial per-request latency, seconds")
+    args = parser.parse_args()
+    web.run_app(S3Standin(args.latency).app(), host=args.host, port=args.port)
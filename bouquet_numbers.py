@@ -0,0 +1,172 @@
+# bouquet_numbers.py
+"""
+Выдача номеров букетов (bouquet_id "0201", "0202", ...).
+
+Номер берётся одним атомарным UPDATE ... RETURNING счётчика id_counters, поэтому двое,
+начавших букет одновременно, никогда не получат один номер. Выданный номер записан в
+bouquet_number_reservations до сохранения букета. Номер брошенного черновика
+возвращается в оборот: сразу, когда тот же пользователь начинает новый букет
+(release), или через BOUQUET_NUMBER_RESERVATION_HOURS.
+"""
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import select, update, delete, exists
+
+import config
+from database import get_db_session, Bouquet, IdCounter, BouquetNumberReservation
+
+COUNTER = "bouquet"
+# reserved_at освобождённого номера — раньше любого порога
+_RELEASED_AT = datetime(1970, 1, 1)
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def format_number(number: int) -> str:
+    return f"{number:04d}"
+
+
+def _parse(bouquet_id: Optional[str]) -> Optional[int]:
+    return int(bouquet_id) if bouquet_id and bouquet_id.isdigit() else None
+
+
+async def _reclaim(session, user_id: int, now: datetime) -> Optional[int]:
+    """Забрать самый старый просроченный/освобождённый номер."""
+    cutoff = now - timedelta(hours=config.BOUQUET_NUMBER_RESERVATION_HOURS)
+    stale = BouquetNumberReservation.reserved_at < cutoff
+    oldest = (
+        select(BouquetNumberReservation.number)
+        .where(stale)
+        .order_by(BouquetNumberReservation.reserved_at)
+        .limit(1)
+        .scalar_subquery()
+    )
+    # повторная проверка stale: из двух одновременных захватов строку получит один
+    res = await session.execute(
+        update(BouquetNumberReservation)
+        .where(BouquetNumberReservation.number == oldest, stale)
+        .values(user_id=user_id, reserved_at=now)
+        .returning(BouquetNumberReservation.number)
+    )
+    return res.scalar_one_or_none()
+
+
+async def allocate(user_id: int) -> str:
+    """Выдать номер для нового черновика."""
+    now = _utcnow()
+    session = await get_db_session()
+    try:
+        while True:
+            number = await _reclaim(session, user_id, now)
+            if number is None:
+                break
+            # букет мог сохраниться, а бронь остаться (сбой между записями)
+            taken = await session.scalar(select(exists().where(Bouquet.bouquet_id == format_number(number))))
+            if not taken:
+                await session.commit()
+                return format_number(number)
+            await session.execute(
+                delete(BouquetNumberReservation).where(BouquetNumberReservation.number == number)
+            )
+
+        number = (await session.execute(
+            update(IdCounter)
+            .where(IdCounter.name == COUNTER)
+            .values(value=IdCounter.value + 1)
+            .returning(IdCounter.value)
+        )).scalar_one()
+        session.add(BouquetNumberReservation(number=number, user_id=user_id, reserved_at=now))
+        await session.commit()
+        return format_number(number)
+    except Exception:
+        await session.rollback()
+        raise
+    finally:
+        await session.close()
+
+
+async def keep(bouquet_id: str, user_id: int) -> str:
+    """
+    Перед сохранением: продлить бронь номера черновика. Если черновик пролежал дольше
+    BOUQUET_NUMBER_RESERVATION_HOURS и номер ушёл другому — выдать новый.
+    """
+    number = _parse(bouquet_id)
+    if number is not None:
+        session = await get_db_session()
+        try:
+            res = await session.execute(
+                update(BouquetNumberReservation)
+                .where(BouquetNumberReservation.number == number, BouquetNumberReservation.user_id == user_id)
+                .values(reserved_at=_utcnow())
+            )
+            await session.commit()
+            if res.rowcount:
+                return bouquet_id
+        finally:
+            await session.close()
+    new_id = await allocate(user_id)
+    logging.warning(f"bouquet_numbers: бронь {bouquet_id} потеряна, выдан {new_id}")
+    return new_id
+
+
+async def confirm(bouquet_id: str) -> None:
+    """Букет сохранён — бронь больше не нужна."""
+    number = _parse(bouquet_id)
+    if number is None:
+        return
+    session = await get_db_session()
+    try:
+        await session.execute(
+            delete(BouquetNumberReservation).where(BouquetNumberReservation.number == number)
+        )
+        await session.commit()
+    except Exception as e:
+        await session.rollback()
+        logging.error(f"bouquet_numbers.confirm error: {e}", exc_info=True)
+    finally:
+        await session.close()
+
+
+async def open_ids() -> list[str]:
+    """Номера, выданные ещё не сохранённым черновикам (кроме освобождённых)."""
+    session = await get_db_session()
+    try:
+        numbers = (await session.execute(
+            select(BouquetNumberReservation.number).where(BouquetNumberReservation.reserved_at > _RELEASED_AT)
+        )).scalars().all()
+    finally:
+        await session.close()
+    return [format_number(number) for number in numbers]
+
+
+async def release(bouquet_id: Optional[str], user_id: int) -> bool:
+    """
+    Черновик брошен — номер можно сразу выдать снова. False, если брони нет или
+    букет с этим номером уже сохранён (сбой между сохранением и confirm), либо номер забрали.
+    """
+    number = _parse(bouquet_id)
+    if number is None:
+        return False
+    session = await get_db_session()
+    try:
+        result = await session.execute(
+            update(BouquetNumberReservation)
+            .where(
+                BouquetNumberReservation.number == number,
+                BouquetNumberReservation.user_id == user_id,
+                ~exists().where(Bouquet.bouquet_id == format_number(number)),
+            )
+            .values(reserved_at=_RELEASED_AT)
+        )
+        await session.commit()
+        return bool(result.rowcount)
+    except Exception as e:
+        await session.rollback()
+        logging.error(f"bouquet_numbers.release error: {e}", exc_info=True)
+        return False
+    finally:
+        await session.close()
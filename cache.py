@@ -0,0 +1,27 @@
+# cache.py
+import logging
+from typing import Optional
+
+import redis.asyncio as aioredis
+
+import config
+
+_client: Optional[aioredis.Redis] = None
+
+
+def get_redis() -> aioredis.Redis:
+    """Общий асинхронный клиент Redis (кэши поверх БД). Ошибки Redis вызывающий код считает промахом."""
+    global _client
+    if _client is None:
+        _client = aioredis.from_url(config.REDIS_URL, decode_responses=True)
+    return _client
+
+
+async def close_redis() -> None:
+    global _client
+    if _client is not None:
+        try:
+            await _client.aclose()
+        except Exception as e:
+            logging.warning(f"close_redis: {e}")
+        _client = None
@@ -0,0 +1,184 @@
+# config.py
+import os
+import logging
+
+from dotenv import load_dotenv
+
+# Загружаем .env до того, как модули прочитают настройки
+load_dotenv()
+
+
+def env_int(name: str, default: int, minimum: int | None = None) -> int:
+    """Целое из окружения; пустое/битое значение -> default."""
+    raw = (os.getenv(name) or "").strip()
+    if not raw:
+        return default
+    try:
+        value = int(raw)
+    except ValueError:
+        logging.warning(f"{name}={raw!r} is not an integer, using {default}")
+        return default
+    if minimum is not None and value < minimum:
+        return minimum
+    return value
+
+
+def env_float(name: str, default: float) -> float:
+    raw = (os.getenv(name) or "").strip()
+    if not raw:
+        return default
+    try:
+        return float(raw)
+    except ValueError:
+        logging.warning(f"{name}={raw!r} is not a number, using {default}")
+        return default
+
+
+def env_bool(name: str, default: bool = False) -> bool:
+    raw = (os.getenv(name) or "").strip().lower()
+    if not raw:
+        return default
+    return raw in ("1", "true", "yes", "on")
+
+
+# ---------- Загрузка медиа ----------
+
+# Сколько файлов одновременно качаем из Telegram / грузим в облако
+MEDIA_UPLOAD_CONCURRENCY = env_int("MEDIA_UPLOAD_CONCURRENCY", 4, minimum=1)
+# Сколько повторов на файл (помимо первой попытки)
+MEDIA_UPLOAD_RETRIES = env_int("MEDIA_UPLOAD_RETRIES", 2, minimum=0)
+# Базовая задержка экспоненциального backoff, сек
+MEDIA_UPLOAD_BACKOFF = env_float("MEDIA_UPLOAD_BACKOFF", 0.5)
+
+# S3 требует, чтобы все части multipart, кроме последней, были не меньше 5 МБ
+MIN_MULTIPART_PART_SIZE = 5 * 1024 * 1024
+# Размер части при потоковой загрузке видео
+MEDIA_STREAM_CHUNK_SIZE = env_int("MEDIA_STREAM_CHUNK_SIZE", 8 * 1024 * 1024, minimum=MIN_MULTIPART_PART_SIZE)
+# Таймаут скачивания файла из Telegram, сек
+MEDIA_DOWNLOAD_TIMEOUT = env_int("MEDIA_DOWNLOAD_TIMEOUT", 120, minimum=1)
+
+# Альбом отдаётся обработчику, когда новых элементов нет MEDIA_GROUP_QUIET сек
+# (или набрано, сколько влезает в лимит), но не позже MEDIA_GROUP_MAX_WAIT после первого
+MEDIA_GROUP_QUIET = env_float("MEDIA_GROUP_QUIET", 0.4)
+MEDIA_GROUP_MAX_WAIT = env_float("MEDIA_GROUP_MAX_WAIT", 3.0)
+# Где копить альбомы: local — в памяти процесса, redis — общий буфер для нескольких процессов бота
+MEDIA_GROUP_BACKEND = (os.getenv("MEDIA_GROUP_BACKEND") or "local").strip().lower()
+
+# Сколько ждать незавершённые загрузки фото при сохранении букета, сек;
+# остальное догружает upload_worker из очереди
+UPLOAD_SAVE_WAIT = env_float("UPLOAD_SAVE_WAIT", 3.0)
+# Очередь загрузки: попыток на задачу, базовая/максимальная задержка повтора, сек
+UPLOAD_JOB_MAX_ATTEMPTS = env_int("UPLOAD_JOB_MAX_ATTEMPTS", 8, minimum=1)
+UPLOAD_JOB_BACKOFF = env_float("UPLOAD_JOB_BACKOFF", 30.0)
+UPLOAD_JOB_BACKOFF_MAX = env_float("UPLOAD_JOB_BACKOFF_MAX", 3600.0)
+# Через сколько секунд задача, взятая упавшим воркером, возвращается в очередь
+UPLOAD_JOB_LEASE = env_int("UPLOAD_JOB_LEASE", 600, minimum=30)
+# Воркер: букетов за один захват и пауза между опросами пустой очереди, сек
+UPLOAD_WORKER_BATCH = env_int("UPLOAD_WORKER_BATCH", 16, minimum=1)
+UPLOAD_WORKER_POLL = env_float("UPLOAD_WORKER_POLL", 5.0)
+
+# ---------- Обработка изображений ----------
+
+# Размер пула процессов для конвертации изображений
+IMAGE_WORKERS = env_int("IMAGE_WORKERS", max(1, min(4, (os.cpu_count() or 2) - 1)), minimum=1)
+# Максимум задач в очереди пула (ожидающих + выполняемых)
+IMAGE_QUEUE_LIMIT = env_int("IMAGE_QUEUE_LIMIT", 32, minimum=1)
+
+# Нормализация фото перед загрузкой: поворот по EXIF, удаление метаданных,
+# ограничение длинной стороны, прогрессивный JPEG
+MEDIA_NORMALIZE = env_bool("MEDIA_NORMALIZE", False)
+# Длинная сторона после нормализации, px
+MEDIA_MAX_EDGE = env_int("MEDIA_MAX_EDGE", 2560, minimum=320)
+MEDIA_JPEG_QUALITY = env_int("MEDIA_JPEG_QUALITY", 85, minimum=1)
+
+# Генерировать ли превью и WebP-вариант при загрузке фото
+MEDIA_DERIVATIVES = env_bool("MEDIA_DERIVATIVES", True)
+# Длинная сторона превью, px
+THUMB_MAX_EDGE = env_int("THUMB_MAX_EDGE", 320, minimum=32)
+# Длинная сторона WebP-варианта, px
+WEBP_MAX_EDGE = env_int("WEBP_MAX_EDGE", 1600, minimum=64)
+WEBP_QUALITY = env_int("WEBP_QUALITY", 80, minimum=1)
+
+# ---------- Объектное хранилище ----------
+
+# После неудачной инициализации хранилища следующая попытка не раньше чем через
+# STORAGE_INIT_BACKOFF сек (удваивается до STORAGE_INIT_BACKOFF_MAX)
+STORAGE_INIT_BACKOFF = env_float("STORAGE_INIT_BACKOFF", 5.0)
+STORAGE_INIT_BACKOFF_MAX = env_float("STORAGE_INIT_BACKOFF_MAX", 300.0)
+# Период фоновой проверки доступности хранилища, сек
+STORAGE_HEALTH_INTERVAL = env_float("STORAGE_HEALTH_INTERVAL", 30.0)
+
+# Бэкенд хранения медиа: s3 (Yandex Object Storage) или local (диск + встроенный HTTP-сервер)
+STORAGE_BACKEND = (os.getenv("STORAGE_BACKEND") or "s3").strip().lower()
+
+# Клиент S3: boto3 (потоки executor'а) или aiohttp (нативный asyncio, пул keep-alive соединений)
+STORAGE_S3_CLIENT = (os.getenv("STORAGE_S3_CLIENT") or "boto3").strip().lower()
+# Регион для подписи SigV4
+YC_REGION = (os.getenv("YC_REGION") or "ru-central1").strip()
+# Размер пула соединений aiohttp-клиента
+S3_POOL_SIZE = env_int("S3_POOL_SIZE", 32, minimum=1)
+# Сколько держать простаивающее keep-alive соединение, сек
+S3_KEEPALIVE_TIMEOUT = env_float("S3_KEEPALIVE_TIMEOUT", 30.0)
+# DeleteObjects принимает не больше 1000 ключей за запрос
+S3_DELETE_BATCH_SIZE = 1000
+# Сколько пакетов DeleteObjects отправлять одновременно
+S3_DELETE_CONCURRENCY = env_int("S3_DELETE_CONCURRENCY", 4, minimum=1)
+# Локальный бэкенд: каталог с файлами и адрес, по которому они раздаются
+LOCAL_STORAGE_DIR = os.getenv("LOCAL_STORAGE_DIR") or "./media_store"
+LOCAL_STORAGE_HOST = (os.getenv("LOCAL_STORAGE_HOST") or "127.0.0.1").strip()
+LOCAL_STORAGE_PORT = env_int("LOCAL_STORAGE_PORT", 8081, minimum=1)
+LOCAL_STORAGE_ROUTE = "/" + (os.getenv("LOCAL_STORAGE_ROUTE") or "media").strip().strip("/")
+LOCAL_STORAGE_BASE_URL = (
+    os.getenv("LOCAL_STORAGE_BASE_URL") or f"http://{LOCAL_STORAGE_HOST}:{LOCAL_STORAGE_PORT}{LOCAL_STORAGE_ROUTE}"
+)
+# Поднимать ли в процессе бота встроенный static-сервер (выключить, если файлы раздает nginx);
+# upload_worker, storage_gc и бенчмарки его не запускают
+LOCAL_STORAGE_SERVE = env_bool("LOCAL_STORAGE_SERVE", True)
+
+# Сборщик мусора хранилища не трогает объекты моложе этого возраста, часов
+STORAGE_GC_GRACE_HOURS = env_float("STORAGE_GC_GRACE_HOURS", 24.0)
+# Как часто upload_worker запускает сборщик мусора, часов (0 — не запускать; тогда
+# storage_gc.py нужно запускать по cron: фото удалённых букетов в media/ освобождает только он)
+STORAGE_GC_INTERVAL_HOURS = env_float("STORAGE_GC_INTERVAL_HOURS", 24.0)
+
+# ---------- Redis ----------
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# TTL зеркала индекса медиа в Redis, сек (источник истины — БД)
+MEDIA_INDEX_CACHE_TTL = env_int("MEDIA_INDEX_CACHE_TTL", 30 * 24 * 3600, minimum=60)
+# TTL Redis-хэша Telegram file_id фото букета, сек (продлевается при каждой записи)
+TG_FILE_ID_CACHE_TTL = env_int("TG_FILE_ID_CACHE_TTL", 7 * 24 * 3600, minimum=60)
+# TTL списка фото черновика букета в Redis, сек (продлевается при каждом добавлении)
+DRAFT_MEDIA_TTL = env_int("DRAFT_MEDIA_TTL", 7 * 24 * 3600, minimum=60)
+
+# ---------- Номера букетов ----------
+
+# Через сколько часов номер брошенного черновика можно выдать заново
+BOUQUET_NUMBER_RESERVATION_HOURS = env_float("BOUQUET_NUMBER_RESERVATION_HOURS", 168.0)
+
+# ---------- Кэш пользователей ----------
+
+# TTL записи пользователя в Redis, сек
+USER_CACHE_TTL = env_int("USER_CACHE_TTL", 24 * 3600, minimum=60)
+# TTL записи в LRU процесса, сек — столько другой процесс может видеть старые настройки
+USER_CACHE_LOCAL_TTL = env_float("USER_CACHE_LOCAL_TTL", 30.0)
+# Размер LRU процесса, записей
+USER_CACHE_SIZE = env_int("USER_CACHE_SIZE", 10000, minimum=1)
+
+# ---------- База данных ----------
+
+# Логировать каждый SQL-запрос (только для отладки — в проде это шум в INFO)
+DB_ECHO = env_bool("DB_ECHO", False)
+# Пул соединений PostgreSQL (postgresql+asyncpg://...)
+DB_POOL_SIZE = env_int("DB_POOL_SIZE", 10, minimum=1)
+DB_MAX_OVERFLOW = env_int("DB_MAX_OVERFLOW", 20, minimum=0)
+# Пересоздавать соединение старше N сек (раньше, чем его закроет сервер/pgbouncer)
+DB_POOL_RECYCLE = env_int("DB_POOL_RECYCLE", 1800, minimum=-1)
+# Сколько ждать свободного соединения из пула, сек
+DB_POOL_TIMEOUT = env_float("DB_POOL_TIMEOUT", 30.0)
+# Проверять соединение перед выдачей из пула
+DB_POOL_PRE_PING = env_bool("DB_POOL_PRE_PING", True)
+# SQLite: WAL + synchronous=NORMAL (читатели не ждут писателя, fsync только на checkpoint)
+SQLITE_WAL = env_bool("SQLITE_WAL", True)
+# SQLite: сколько ждать снятия блокировки вместо ошибки "database is locked", мс
+SQLITE_BUSY_TIMEOUT_MS = env_int("SQLITE_BUSY_TIMEOUT_MS", 5000, minimum=0)
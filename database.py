@@ -1,8 +1,12 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base, relationship
-from sqlalchemy import Column, Integer, String, DateTime, JSON, Boolean, ForeignKey, select, func, Text
+from sqlalchemy import Column, Integer, String, DateTime, JSON, Boolean, ForeignKey, Index, inspect, select, update, func, Text, tuple_, event
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.engine import make_url
 import os
 
+import config
+
 Base = declarative_base()
 
 
@@ -38,6 +42,20 @@ class Product(Base):
 
     category = relationship("Category", backref="products")
 
+    __table_args__ = (
+        # товары категории по алфавиту (show_product_page)
+        Index("ix_products_category_name", "category_id", "name"),
+    )
+
+
+# SQLite пишет CURRENT_TIMESTAMP как 'YYYY-MM-DD HH:MM:SS', а параметры DateTime
+# по умолчанию уходят с микросекундами — равные моменты сравнивались бы как разные
+# строки. Для колонок, по которым идёт keyset-пагинация, формат выровнен.
+_Timestamp = DateTime().with_variant(
+    sqlite.DATETIME(storage_format="%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d"),
+    "sqlite",
+)
+
 
 class Bouquet(Base):
     __tablename__ = "bouquets"
@@ -48,32 +66,174 @@ class Bouquet(Base):
     short_title = Column(String(40), nullable=False)
     title_display = Column(String, nullable=False)
     photos = Column(JSON, nullable=False)
+    # растёт при каждой записи photos — см. merge_bouquet_photos
+    photos_version = Column(Integer, nullable=False, default=0, server_default="0")
     video_path = Column(String, nullable=True)
     description = Column(String(800), nullable=False)
     composition = Column(JSON, nullable=True)
     price_minor = Column(Integer, nullable=False)
     currency = Column(String, default="RUB")
-    created_at = Column(DateTime, default=func.now())
+    created_at = Column(_Timestamp, default=func.now())
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
 
     user = relationship("User", backref="bouquets")
 
+    __table_args__ = (
+        # список букетов пользователя: фильтр по user_id, keyset по (created_at, id)
+        Index("ix_bouquets_user_created", "user_id", "created_at", "id"),
+    )
+
+
+class MediaObject(Base):
+    """Загруженный в облако файл, адресуемый по содержимому (sha256)."""
+    __tablename__ = "media_objects"
+
+    sha256 = Column(String(64), primary_key=True)
+    object_key = Column(String, nullable=False)
+    url = Column(String, nullable=False)
+    thumb_url = Column(String, nullable=True)
+    webp_url = Column(String, nullable=True)
+    size = Column(Integer, nullable=True)
+    content_type = Column(String, nullable=True)
+    created_at = Column(DateTime, default=func.now())
+    # последняя выдача объекта дедупликацией (UTC) — по ней storage_gc отсчитывает grace
+    last_used_at = Column(DateTime, nullable=True)
+
+
+class MediaAlias(Base):
+    """Telegram file_unique_id -> sha256 содержимого."""
+    __tablename__ = "media_aliases"
+
+    file_unique_id = Column(String, primary_key=True)
+    sha256 = Column(String(64), ForeignKey("media_objects.sha256"), nullable=False)
+    created_at = Column(DateTime, default=func.now())
+
+
+class UploadJob(Base):
+    """Отложенная загрузка медиа букета в облако (очередь для upload_worker)."""
+    __tablename__ = "upload_jobs"
+
+    id = Column(Integer, primary_key=True)
+    bouquet_id = Column(String, nullable=False, index=True)
+    kind = Column(String(16), nullable=False)  # photo | video
+    file_id = Column(String, nullable=False)
+    status = Column(String(16), nullable=False, default="pending", index=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+    next_attempt_at = Column(DateTime, default=func.now())
+    locked_at = Column(DateTime, nullable=True)
+    locked_by = Column(String(32), nullable=True)
+    created_at = Column(DateTime, default=func.now())
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+
+class IdCounter(Base):
+    """Счётчик для выдачи номеров (name="bouquet" — номера букетов)."""
+    __tablename__ = "id_counters"
+
+    name = Column(String(32), primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+
+
+class BouquetNumberReservation(Base):
+    """Номер, выданный черновику букета; удаляется при сохранении букета."""
+    __tablename__ = "bouquet_number_reservations"
+
+    number = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    reserved_at = Column(DateTime, nullable=False, index=True)
+
 
 # Настройка подключения к БД
-DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./bouquets.db")
-engine = create_async_engine(DATABASE_URL, echo=True)
+def normalize_url(url: str) -> str:
+    """postgres:// и postgresql:// (как их выдают хостинги) -> async-драйвер asyncpg."""
+    parsed = make_url(url)
+    if parsed.drivername in ("postgres", "postgresql"):
+        parsed = parsed.set(drivername="postgresql+asyncpg")
+    return parsed.render_as_string(hide_password=False)
+
+
+def _is_file_sqlite(url) -> bool:
+    return url.get_backend_name() == "sqlite" and url.database not in (None, "", ":memory:")
+
+
+def _sqlite_on_connect(wal: bool, busy_timeout_ms: int):
+    def _pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute(f"PRAGMA busy_timeout = {int(busy_timeout_ms)}")
+            if wal:
+                # режим журнала хранится в файле БД, synchronous — на каждое соединение
+                cursor.execute("PRAGMA journal_mode = WAL")
+                cursor.execute("PRAGMA synchronous = NORMAL")
+        finally:
+            cursor.close()
+    return _pragmas
+
+
+def make_engine(url: str, *, echo: bool | None = None, sqlite_wal: bool | None = None,
+                sqlite_busy_timeout_ms: int | None = None, **pool_options):
+    """
+    Async-движок по профилю из config. PostgreSQL (asyncpg): пул DB_POOL_SIZE +
+    DB_MAX_OVERFLOW, recycle/timeout/pre_ping. SQLite: на каждое новое соединение —
+    busy_timeout и (SQLITE_WAL) journal_mode=WAL, synchronous=NORMAL.
+    Аргументы перекрывают config (бенчмарк сравнивает профили в одном процессе).
+    """
+    parsed = make_url(normalize_url(url))
+    options = {"echo": config.DB_ECHO if echo is None else echo}
+    if parsed.get_backend_name() != "sqlite":
+        options.update(
+            pool_size=config.DB_POOL_SIZE,
+            max_overflow=config.DB_MAX_OVERFLOW,
+            pool_recycle=config.DB_POOL_RECYCLE,
+            pool_timeout=config.DB_POOL_TIMEOUT,
+            pool_pre_ping=config.DB_POOL_PRE_PING,
+        )
+    options.update(pool_options)
+    async_engine = create_async_engine(parsed, **options)
+
+    if parsed.get_backend_name() == "sqlite":
+        wal = config.SQLITE_WAL if sqlite_wal is None else sqlite_wal
+        busy = config.SQLITE_BUSY_TIMEOUT_MS if sqlite_busy_timeout_ms is None else sqlite_busy_timeout_ms
+        event.listen(async_engine.sync_engine, "connect", _sqlite_on_connect(wal and _is_file_sqlite(parsed), busy))
+    return async_engine
+
+
+DATABASE_URL = normalize_url(os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./bouquets.db"))
+engine = make_engine(DATABASE_URL)
 AsyncSessionLocal = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 
+_ALEMBIC_INI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "alembic.ini")
+
+
+def _upgrade_schema(connection) -> None:
+    from alembic import command
+    from alembic.config import Config
+
+    cfg = Config(_ALEMBIC_INI)
+    cfg.attributes["connection"] = connection
+    tables = set(inspect(connection).get_table_names())
+    if "alembic_version" not in tables and "users" in tables:
+        # база создана ещё через create_all — отмечаем уже существующую часть схемы
+        command.stamp(cfg, "0002" if "upload_jobs" in tables else "0001")
+    command.upgrade(cfg, "head")
+
+
 async def init_db():
+    """Довести схему БД до последней миграции Alembic (migrations/versions)."""
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_upgrade_schema)
 
 
 async def get_db_session() -> AsyncSession:
     return AsyncSessionLocal()
 
 
+# Хелперы ниже не коммитят: транзакцией владеет вызывающий — в обработчиках это
+# DbSessionMiddleware (одна сессия и один commit на апдейт). flush выдаёт id, а
+# expire_on_commit=False оставляет атрибуты доступными без refresh.
+
 async def get_or_create_user(session, telegram_id):
     result = await session.execute(
         select(User).where(User.telegram_id == telegram_id)
@@ -83,8 +243,7 @@ async def get_or_create_user(session, telegram_id):
     if not user:
         user = User(telegram_id=telegram_id)
         session.add(user)
-        await session.commit()
-        await session.refresh(user)
+        await session.flush()
 
     return user
 
@@ -92,8 +251,7 @@ async def get_or_create_user(session, telegram_id):
 async def create_bouquet(session, bouquet_data):
     bouquet = Bouquet(**bouquet_data)
     session.add(bouquet)
-    await session.commit()
-    await session.refresh(bouquet)
+    await session.flush()
     return bouquet
 
 
@@ -121,8 +279,7 @@ async def update_bouquet(session, bouquet_id, update_data):
     if bouquet:
         for key, value in update_data.items():
             setattr(bouquet, key, value)
-        await session.commit()
-        await session.refresh(bouquet)
+        await session.flush()
     return bouquet
 
 
@@ -130,11 +287,88 @@ async def delete_bouquet(session, bouquet_id):
     bouquet = await get_bouquet_by_id(session, bouquet_id)
     if bouquet:
         await session.delete(bouquet)
-        await session.commit()
+        await session.flush()
         return True
     return False
 
 
+# Сколько раз merge_bouquet_photos перечитывает строку, если её успели изменить
+PHOTOS_MERGE_ATTEMPTS = 5
+
+
+async def merge_bouquet_photos(bouquet_id, merge):
+    """
+    Изменить bouquets.photos без потери чужих записей (бот дописывает tg_file_id,
+    upload_worker — URL). merge(photos) получает свежий список и возвращает новый или
+    None, если менять нечего. Строка читается под FOR UPDATE (PostgreSQL), а запись —
+    условный UPDATE по photos_version: если версию успели сменить (SQLite, где FOR
+    UPDATE нет), merge повторяется на перечитанных данных.
+    Возвращает None — букета нет, False — нечего менять, True — записано.
+    """
+    for _ in range(PHOTOS_MERGE_ATTEMPTS):
+        session = await get_db_session()
+        try:
+            row = (await session.execute(
+                select(Bouquet.photos, Bouquet.photos_version)
+                .where(Bouquet.bouquet_id == bouquet_id)
+                .with_for_update()
+            )).one_or_none()
+            if row is None:
+                return None
+            if not isinstance(row.photos, list):
+                return False
+            photos = merge(list(row.photos))
+            if photos is None:
+                return False
+            res = await session.execute(
+                update(Bouquet)
+                .where(Bouquet.bouquet_id == bouquet_id, Bouquet.photos_version == row.photos_version)
+                .values(photos=photos, photos_version=Bouquet.photos_version + 1)
+            )
+            await session.commit()
+            if res.rowcount:
+                return True
+        except Exception:
+            await session.rollback()
+            raise
+        finally:
+            await session.close()
+    raise RuntimeError(f"bouquets.photos {bouquet_id}: не удалось записать за {PHOTOS_MERGE_ATTEMPTS} попыток")
+
+
+# Колонки, нужные списку букетов: без photos / composition / description
+_BOUQUET_LIST_COLUMNS = (Bouquet.created_at, Bouquet.id, Bouquet.bouquet_id, Bouquet.short_title, Bouquet.title_display)
+
+
+async def get_user_bouquet_page(session, user_id, anchor=None, per_page=10):
+    """
+    Страница списка по ключу (created_at, id), новые сверху: per_page строк начиная
+    с anchor включительно (None — с начала) плюс одна лишняя — она показывает, есть
+    ли следующая страница, и служит её anchor. Без OFFSET: стоимость не зависит от номера страницы.
+    """
+    query = select(*_BOUQUET_LIST_COLUMNS).where(Bouquet.user_id == user_id)
+    if anchor is not None:
+        query = query.where(tuple_(Bouquet.created_at, Bouquet.id) <= tuple(anchor))
+    result = await session.execute(
+        query.order_by(Bouquet.created_at.desc(), Bouquet.id.desc()).limit(per_page + 1)
+    )
+    return result.all()
+
+
+async def get_prev_page_anchor(session, user_id, first_key, per_page=10):
+    """anchor предыдущей страницы: per_page-я строка над first_key; None — это первая страница."""
+    result = await session.execute(
+        select(Bouquet.created_at, Bouquet.id)
+        .where(Bouquet.user_id == user_id, tuple_(Bouquet.created_at, Bouquet.id) > tuple(first_key))
+        .order_by(Bouquet.created_at.asc(), Bouquet.id.asc())
+        .limit(per_page)
+    )
+    rows = result.all()
+    if len(rows) < per_page:
+        return None
+    return tuple(rows[-1])
+
+
 async def count_user_bouquets(session, user_id):
     result = await session.execute(
         select(func.count(Bouquet.id)).where(Bouquet.user_id == user_id)
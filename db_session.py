@@ -0,0 +1,39 @@
+# db_session.py
+"""
+Одна сессия БД на апдейт.
+
+DbSessionMiddleware (outer, на dp.update) открывает AsyncSession и передаёт её
+обработчику как session. Обработчик и хелперы database.py только читают и делают
+flush; транзакция фиксируется один раз — после обработчика (commit), а при
+исключении откатывается. Сессия ленивая: апдейты без запросов к БД соединение не берут.
+
+Обработчик, у которого после записи есть внешние последствия (ответ «сохранено»,
+фоновая задача, сброс кэша, запись другой сессией), сам делает session.commit()
+перед ними — middleware тогда коммитить уже нечего. При ошибке, пойманной внутри
+обработчика, он вызывает session.rollback(), иначе middleware зафиксирует
+частичные изменения.
+"""
+import logging
+
+from aiogram.dispatcher.middlewares.base import BaseMiddleware
+
+from database import AsyncSessionLocal
+
+
+class DbSessionMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        async with AsyncSessionLocal() as session:
+            data["session"] = session
+            try:
+                result = await handler(event, data)
+            except Exception:
+                await session.rollback()
+                raise
+            if session.in_transaction():
+                try:
+                    await session.commit()
+                except Exception as e:
+                    logging.error(f"DbSessionMiddleware: commit не удался: {e}", exc_info=True)
+                    await session.rollback()
+                    raise
+            return result
@@ -0,0 +1,104 @@
+# draft_media.py
+"""
+Фото черновика букета — отдельный список в Redis, а не поле media в данных FSM.
+
+Раньше каждое фото перечитывало и перезаписывало весь черновик (название, описание,
+состав, media), а одновременные записи альбома и одиночного фото затирали друг
+друга. Здесь добавление — один Lua-скрипт: дописать file_id, пока длина списка не
+достигла media_limit, и вернуть (добавлено, всего). Ключ — чат и пользователь из
+FSMContext, как у самого состояния.
+
+URL уже загруженных в облако фото черновика (draft_uploads) лежат в наборе
+draft:uploads:<номер букета> — по нему storage_gc видит, что объект ещё нужен,
+хотя ни один букет на него пока не ссылается.
+"""
+import logging
+from typing import Optional
+
+from aiogram.fsm.context import FSMContext
+
+import config
+from cache import get_redis
+
+# KEYS: список; ARGV: limit, ttl, file_id... Возвращает {добавлено, длина списка}.
+_APPEND_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local n = redis.call('LLEN', KEYS[1])
+local added = 0
+for i = 3, #ARGV do
+  if n >= limit then break end
+  n = redis.call('RPUSH', KEYS[1], ARGV[i])
+  added = added + 1
+end
+if n > 0 then redis.call('EXPIRE', KEYS[1], ARGV[2]) end
+return {added, n}
+"""
+
+_append_script = None
+_UPLOADS_KEY = "draft:uploads:{}"
+
+
+def _key(state: FSMContext) -> str:
+    key = state.key
+    return f"draft:media:{key.bot_id}:{key.chat_id}:{key.user_id}"
+
+
+async def append(state: FSMContext, file_ids: list[str], limit: int) -> tuple[int, int]:
+    """Добавить file_id, сколько влезает в limit. Возвращает (добавлено, всего)."""
+    global _append_script
+    if _append_script is None:
+        _append_script = get_redis().register_script(_APPEND_SCRIPT)
+    added, total = await _append_script(
+        keys=[_key(state)], args=[limit, config.DRAFT_MEDIA_TTL, *file_ids]
+    )
+    return int(added), int(total)
+
+
+async def items(state: FSMContext) -> list[str]:
+    return await get_redis().lrange(_key(state), 0, -1)
+
+
+async def count(state: FSMContext) -> int:
+    return await get_redis().llen(_key(state))
+
+
+async def clear(state: FSMContext) -> None:
+    await get_redis().delete(_key(state))
+
+
+async def remember_uploaded(bouquet_id: str, url: Optional[str]) -> None:
+    """Запомнить URL фото, загруженного для черновика (живёт DRAFT_MEDIA_TTL)."""
+    if not url:
+        return
+    key = _UPLOADS_KEY.format(bouquet_id)
+    try:
+        redis = get_redis()
+        await redis.sadd(key, url)
+        await redis.expire(key, config.DRAFT_MEDIA_TTL)
+    except Exception as e:
+        logging.warning(f"draft_media: не удалось запомнить загрузку {bouquet_id}: {e}")
+
+
+async def forget_uploaded(bouquet_id: Optional[str]) -> None:
+    """Черновик сохранён или брошен — его загрузки больше не держат объекты."""
+    if not bouquet_id:
+        return
+    try:
+        await get_redis().delete(_UPLOADS_KEY.format(bouquet_id))
+    except Exception as e:
+        logging.warning(f"draft_media: не удалось сбросить загрузки {bouquet_id}: {e}")
+
+
+async def open_draft_urls() -> set[str]:
+    """
+    URL, на которые ссылаются открытые черновики: загрузки draft_uploads и элементы
+    списков фото, уже ставшие URL. Ошибки Redis пробрасываются — сборщику мусора
+    нельзя считать, что черновиков нет.
+    """
+    redis = get_redis()
+    urls: set[str] = set()
+    async for key in redis.scan_iter(match=_UPLOADS_KEY.format("*"), count=500):
+        urls.update(await redis.smembers(key))
+    async for key in redis.scan_iter(match="draft:media:*", count=500):
+        urls.update(item for item in await redis.lrange(key, 0, -1) if item.startswith("http"))
+    return urls
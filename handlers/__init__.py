@@ -23,7 +23,7 @@ from .media_processing import (
 
 # Управление букетами
 from .bouquet_management import (
-    list_bouquets, show_bouquet_details, handle_bouquet_pagination,
+    list_bouquets, show_bouquet_details, show_bouquet_album, handle_bouquet_pagination,
     start_edit_bouquet, handle_edit_field, handle_delete_bouquet,
     handle_back_to_list
 )
@@ -63,12 +63,13 @@ def setup_handlers(dp: Dispatcher):
     dp.callback_query.register(handle_actions, F.data.startswith("action:"))
     dp.callback_query.register(handle_bouquet_pagination, F.data.startswith("bouquet_list:page:"))
     dp.callback_query.register(show_bouquet_details, F.data.startswith("bouquet_detail:"))
+    dp.callback_query.register(show_bouquet_album, F.data.startswith("bouquet_album:"))
     dp.callback_query.register(start_edit_bouquet, F.data.startswith("edit_bouquet:"))
     dp.callback_query.register(handle_edit_field, F.data.startswith("edit_field:"))
     dp.callback_query.register(handle_delete_bouquet, F.data.startswith("delete_bouquet:"))
     dp.callback_query.register(handle_settings, F.data.startswith("settings:"))
     dp.callback_query.register(handle_back_to_menu, F.data == "back_to_menu")
-    dp.callback_query.register(handle_back_to_list, F.data == "back_to_list")
+    dp.callback_query.register(handle_back_to_list, F.data.startswith("back_to_list"))
     dp.callback_query.register(handle_back_to_media, F.data == "back_to_media")
     dp.callback_query.register(handle_media_done, F.data == "media_done")
     dp.callback_query.register(handle_add_video, F.data == "add_video")
@@ -4,6 +4,7 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 import logging
 from states import BouquetStates
 from ai_service import deepseek_service
+from .common import abandon_draft
 
 
 async def start_ai_generation(message: types.Message, state: FSMContext):
@@ -42,7 +43,7 @@ async def process_ai_keywords(message: types.Message, state: FSMContext):
             "Не удалось сгенерировать варианты. Попробуйте другие ключевые слова или "
             "создайте букет вручную через меню '➕ Добавить букет'."
         )
-        await state.clear()
+        await abandon_draft(state)
         return
 
     # Показываем первый вариант
@@ -1,37 +1,33 @@
 from aiogram import types
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 import logging
+from typing import Optional
 
 from states import BouquetStates
-from database import get_db_session, get_or_create_user, create_bouquet, Bouquet
+from database import create_bouquet
 from utils import parse_composition, format_price
-from .common import handle_media_upload
-from storage import upload_video_to_storage
+from .common import handle_media_upload, abandon_draft
+from media_pipeline import draft_uploads
+from upload_queue import enqueue_missing
+import draft_media
+import bouquet_numbers
+from user_cache import CachedUser, resolve as resolve_user
 
 # ---------- Старт ----------
 
-async def start_new_bouquet(message: types.Message, state: FSMContext):
-    await state.clear()
-    session = await get_db_session()
+async def start_new_bouquet(message: types.Message, state: FSMContext, user: Optional[CachedUser] = None):
     try:
-        user = await get_or_create_user(session, message.from_user.id)
+        # номер брошенного черновика возвращаем в оборот, новый берём атомарно
+        await abandon_draft(state)
+        user = user or await resolve_user(message.from_user.id)
         await state.update_data(chat_id=message.chat.id)
-
-        # генерим следующий номер
-        res = await session.execute(select(Bouquet).order_by(Bouquet.id.desc()).limit(1))
-        last = res.scalar_one_or_none()
-        try:
-            last_num = int(last.bouquet_id) if last and last.bouquet_id.isdigit() else 200
-        except Exception:
-            last_num = 200
-        bouquet_id = f"{last_num + 1:04d}"
+        bouquet_id = await bouquet_numbers.allocate(user.id)
 
         await state.update_data(
             current_id=bouquet_id,
             user_id=user.id,
-            media=[],
             media_limit=user.media_limit,
             composition=[],
             video=None,
@@ -41,8 +37,6 @@ async def start_new_bouquet(message: types.Message, state: FSMContext):
     except Exception as e:
         logging.error(f"start_new_bouquet error: {e}", exc_info=True)
         await message.answer("Ошибка при создании букета. Попробуйте ещё раз.")
-    finally:
-        await session.close()
 
 # ---------- Название ----------
 
@@ -142,7 +136,7 @@ async def process_price(message: types.Message, state: FSMContext):
 
 # ---------- Переходы / сохранение ----------
 
-async def handle_actions(callback: types.CallbackQuery, state: FSMContext):
+async def handle_actions(callback: types.CallbackQuery, state: FSMContext, session: AsyncSession):
     try:
         action = (callback.data or "").split(":")[1]
 
@@ -197,41 +191,50 @@ async def handle_actions(callback: types.CallbackQuery, state: FSMContext):
         elif action == "add_composition":
             # старт интерактивного выбора из каталога
             from .composition_picker import show_category_page
-            await show_category_page(callback.message.chat.id, state, callback.bot, page=1)
+            await show_category_page(callback.message.chat.id, state, callback.bot, session, page=1)
             await state.set_state(BouquetStates.choosing_category)
             await callback.answer()
             return
 
         elif action == "save_bouquet":
             data = await state.get_data()
-            session = await get_db_session()
             try:
-                media = data.get("media", [])
+                media = await draft_media.items(state)
                 if media and isinstance(media[0], str) and not media[0].startswith("http"):
-                    media = await handle_media_upload(callback.bot, media, data["current_id"])
+                    media = await handle_media_upload(callback.bot, media, data["current_id"], defer=True)
 
+                # видео, не загруженное при приёме, остаётся file_id (Telegram отправит и его),
+                # URL допишет upload_worker
                 video_url = data.get("video")
-                if video_url and not str(video_url).startswith("http"):
-                    video_url = await upload_video_to_storage(callback.bot, video_url, data["current_id"])
 
+                # черновик мог пролежать дольше брони — тогда номер будет новый
+                bouquet_id = await bouquet_numbers.keep(data["current_id"], data["user_id"])
                 bouquet = await create_bouquet(session, {
-                    "bouquet_id": data["current_id"],
+                    "bouquet_id": bouquet_id,
                     "user_id": data["user_id"],
                     "short_title": data.get("title"),
-                    "title_display": f"{data.get('title')} №{data.get('current_id')}",
+                    "title_display": f"{data.get('title')} №{bouquet_id}",
                     "photos": media,
                     "video_path": video_url,
                     "description": data.get("description", ""),
                     "composition": data.get("composition", []),
                     "price_minor": (data.get("price", 0) or 0) * 100,
                 })
+                # фиксируем до ответа и до записей других сессий (бронь, очередь загрузок)
+                await session.commit()
+                await bouquet_numbers.confirm(bouquet.bouquet_id)
+                await enqueue_missing(bouquet.bouquet_id, media, video_url)
                 await callback.message.answer(f"Букет «{bouquet.title_display}» сохранён!")
+                # незавершённые загрузки доработают в фоне и попадут в индекс медиа,
+                # тогда задача воркера обойдётся без повторной загрузки
+                draft_uploads.discard(data["current_id"], cancel=False)
+                await draft_media.forget_uploaded(data["current_id"])
+                await draft_media.clear(state)
                 await state.clear()
             except Exception as e:
+                await session.rollback()
                 logging.error(f"save_bouquet error: {e}", exc_info=True)
                 await callback.message.answer("Ошибка при сохранении букета. Попробуйте ещё раз.")
-            finally:
-                await session.close()
             await callback.answer()
             return
 
@@ -1,49 +1,35 @@
 import math
 import logging
+from datetime import datetime, timedelta
+from typing import Optional
 from aiogram import types
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from states import BouquetStates
-from database import get_db_session, get_or_create_user, Bouquet
+from database import (
+    Bouquet,
+    get_user_bouquet_page, get_prev_page_anchor, count_user_bouquets,
+)
 from utils import format_price
+from storage import schedule_bouquet_cleanup
+from media_delivery import send_bouquet_photo, send_bouquet_album, forget_bouquet
+from user_cache import CachedUser, resolve as resolve_user
 
 
 PAGE_SIZE = 5
+# Telegram принимает callback_data не длиннее 64 байт
+CALLBACK_DATA_LIMIT = 64
+_EPOCH = datetime(1970, 1, 1)
 
 
-# ===== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ МЕДИА =====
-
-def _extract_media_ref(item) -> str | None:
-    """
-    Привести элемент photos к строке для aiogram:
-      - если dict: сначала берём file_id, затем url
-      - если str: возвращаем как есть (подходит и file_id, и https://)
-    """
-    if item is None:
-        return None
-    if isinstance(item, dict):
-        v = item.get("file_id") or item.get("tg_file_id") or item.get("telegram_file_id") or item.get("url")
-        if isinstance(v, str) and v.strip():
-            return v.strip()
-        return None
-    if isinstance(item, str) and item.strip():
-        return item.strip()
-    return None
-
-
-def _first_media(bouquet: Bouquet) -> str | None:
-    photos = getattr(bouquet, "photos", None)
+def _photo_count(bouquet: Bouquet) -> int:
+    photos = bouquet.photos
     if not photos:
-        return None
-    if isinstance(photos, list):
-        for it in photos:
-            ref = _extract_media_ref(it)
-            if ref:
-                return ref
-        return None
-    return _extract_media_ref(photos)
+        return 0
+    return len(photos) if isinstance(photos, list) else 1
 
 
 def _composition_text(comp) -> str:
@@ -84,99 +70,133 @@ def _details_caption(b: Bouquet) -> str:
     )
 
 
-def _detail_keyboard(bouquet_id: str, page: int | None = None) -> types.InlineKeyboardMarkup:
+def _anchor_token(anchor) -> str:
+    """(created_at, id) -> "микросекунды.id" для callback_data."""
+    if not anchor:
+        return ""
+    created_at, row_id = anchor
+    return f"{(created_at.replace(tzinfo=None) - _EPOCH) // timedelta(microseconds=1)}.{row_id}"
+
+
+def _parse_anchor(token: str):
+    try:
+        micros, row_id = token.split(".")
+        return _EPOCH + timedelta(microseconds=int(micros)), int(row_id)
+    except (ValueError, AttributeError):
+        return None
+
+
+def _list_callback(prefix: str, page: int, anchor) -> str:
+    """prefix:page:anchor; callback_data ограничен 64 байтами — без якоря список откроется с начала."""
+    data = f"{prefix}:{page}:{_anchor_token(anchor)}"
+    if len(data.encode()) > CALLBACK_DATA_LIMIT:
+        logging.warning(f"callback_data длиннее {CALLBACK_DATA_LIMIT} байт: {data}")
+        return f"{prefix}:1"
+    return data
+
+
+def _parse_list_callback(data: str, skip: int) -> tuple[int, tuple | None]:
+    """(страница, якорь) из prefix...:page:anchor; skip — сколько полей до номера страницы."""
+    parts = (data or "").split(":")[skip:]
+    try:
+        page = max(1, int(parts[0]))
+    except (ValueError, IndexError):
+        return 1, None
+    anchor = _parse_anchor(parts[1]) if len(parts) > 1 and parts[1] else None
+    # старые кнопки без якоря: открываем первую страницу
+    return (page, anchor) if anchor or page == 1 else (1, None)
+
+
+def _detail_keyboard(bouquet_id: str, page: int | None = None, photo_count: int = 0,
+                     anchor=None) -> types.InlineKeyboardMarkup:
     kb = InlineKeyboardBuilder()
+    if photo_count > 1:
+        kb.add(types.InlineKeyboardButton(text=f"📷 Все фото ({photo_count})", callback_data=f"bouquet_album:{bouquet_id}"))
     kb.add(types.InlineKeyboardButton(text="✏️ Редактировать", callback_data=f"edit_bouquet:{bouquet_id}"))
     kb.add(types.InlineKeyboardButton(text="🗑 Удалить", callback_data=f"delete_bouquet:{bouquet_id}"))
     if page is not None:
-        kb.add(types.InlineKeyboardButton(text="◀️ Назад к списку", callback_data=f"back_to_list:{page}"))
+        kb.add(types.InlineKeyboardButton(text="◀️ Назад к списку", callback_data=_list_callback("back_to_list", page, anchor)))
     else:
         kb.add(types.InlineKeyboardButton(text="◀️ Назад к списку", callback_data="back_to_list"))
     kb.adjust(2)
     return kb.as_markup()
 
 
-def _list_keyboard(items, page: int, total_pages: int) -> types.InlineKeyboardMarkup:
+def _list_keyboard(items, page: int, total_pages: int, anchor, prev_anchor, next_anchor) -> types.InlineKeyboardMarkup:
     kb = InlineKeyboardBuilder()
     for b in items:
         kb.add(types.InlineKeyboardButton(
             text=f"#{b.bouquet_id} {b.short_title or b.title_display}",
-            callback_data=f"bouquet_detail:{b.bouquet_id}:{page}"
+            callback_data=_list_callback(f"bouquet_detail:{b.bouquet_id}", page, anchor)
         ))
     # навигация
     nav = InlineKeyboardBuilder()
     if page > 1:
-        nav.add(types.InlineKeyboardButton(text="⬅️", callback_data=f"bouquet_list:page:{page-1}"))
-    if page < total_pages:
-        nav.add(types.InlineKeyboardButton(text="➡️", callback_data=f"bouquet_list:page:{page+1}"))
+        nav.add(types.InlineKeyboardButton(text="⬅️", callback_data=_list_callback("bouquet_list:page", page - 1, prev_anchor)))
+    if next_anchor is not None:
+        nav.add(types.InlineKeyboardButton(text="➡️", callback_data=_list_callback("bouquet_list:page", page + 1, next_anchor)))
     nav.adjust(2)
     kb.attach(nav)
     return kb.as_markup()
 
 
+async def _bouquet_list_view(session: AsyncSession, user_id: int, page: int = 1, anchor=None):
+    """
+    Текст и клавиатура страницы списка. Страница задаётся якорем — ключом (created_at, id)
+    её первого букета, поэтому запрос не зависит от номера страницы (без OFFSET).
+    None — букетов нет.
+    """
+    total = await count_user_bouquets(session, user_id)
+    if not total:
+        return None
+
+    rows = await get_user_bouquet_page(session, user_id, anchor, PAGE_SIZE)
+    if not rows and anchor is not None:
+        # страницу удалили целиком — начинаем сначала
+        page, anchor = 1, None
+        rows = await get_user_bouquet_page(session, user_id, None, PAGE_SIZE)
+    items = rows[:PAGE_SIZE]
+    next_anchor = tuple(rows[PAGE_SIZE][:2]) if len(rows) > PAGE_SIZE else None
+    prev_anchor = None
+    if page > 1 and items:
+        prev_anchor = await get_prev_page_anchor(session, user_id, tuple(items[0][:2]), PAGE_SIZE)
+
+    total_pages = max(1, math.ceil(total / PAGE_SIZE))
+    page = min(page, total_pages)
+    text = f"📚 Ваши букеты ({total}): страница {page}/{total_pages}"
+    return text, _list_keyboard(items, page, total_pages, anchor, prev_anchor, next_anchor)
+
+
 # ===== СПИСОК БУКЕТОВ =====
 
-async def list_bouquets(message: types.Message):
+async def list_bouquets(message: types.Message, session: AsyncSession, user: Optional[CachedUser] = None):
     """Показать список букетов текущего пользователя (постранично)."""
-    session = await get_db_session()
     try:
-        user = await get_or_create_user(session, message.from_user.id)
-
-        # Подтягиваем только свои букеты
-        res = await session.execute(
-            select(Bouquet)
-            .where(Bouquet.user_id == user.id)
-            .order_by(Bouquet.created_at.desc())
-        )
-        all_bouquets = res.scalars().all()
-        if not all_bouquets:
+        user = user or await resolve_user(message.from_user.id)
+        view = await _bouquet_list_view(session, user.id)
+        if view is None:
             await message.answer("У вас пока нет букетов. Нажмите «➕ Добавить букет».")
             return
-
-        total = len(all_bouquets)
-        total_pages = max(1, math.ceil(total / PAGE_SIZE))
-        page = 1
-        start = (page - 1) * PAGE_SIZE
-        items = all_bouquets[start:start + PAGE_SIZE]
-
-        text = f"📚 Ваши букеты ({total}): страница {page}/{total_pages}"
-        await message.answer(text, reply_markup=_list_keyboard(items, page, total_pages))
+        text, markup = view
+        await message.answer(text, reply_markup=markup)
     except Exception as e:
         logging.error(f"list_bouquets error: {e}", exc_info=True)
         await message.answer("Не удалось загрузить список букетов.")
-    finally:
-        await session.close()
 
 
-async def handle_bouquet_pagination(callback: types.CallbackQuery):
-    """Переключение страниц списка."""
-    try:
-        page = int(callback.data.split(":")[2])
-    except Exception:
-        page = 1
-
-    session = await get_db_session()
+async def handle_bouquet_pagination(callback: types.CallbackQuery, session: AsyncSession,
+                                    user: Optional[CachedUser] = None):
+    """Переключение страниц списка: bouquet_list:page:<страница>:<якорь>."""
+    page, anchor = _parse_list_callback(callback.data, skip=2)
     try:
-        user = await get_or_create_user(session, callback.from_user.id)
-        res = await session.execute(
-            select(Bouquet)
-            .where(Bouquet.user_id == user.id)
-            .order_by(Bouquet.created_at.desc())
-        )
-        all_bouquets = res.scalars().all()
-        if not all_bouquets:
+        user = user or await resolve_user(callback.from_user.id)
+        view = await _bouquet_list_view(session, user.id, page, anchor)
+        if view is None:
             await callback.message.edit_text("Букетов пока нет.")
             await callback.answer()
             return
-
-        total = len(all_bouquets)
-        total_pages = max(1, math.ceil(total / PAGE_SIZE))
-        page = max(1, min(page, total_pages))
-        start = (page - 1) * PAGE_SIZE
-        items = all_bouquets[start:start + PAGE_SIZE]
-
-        text = f"📚 Ваши букеты ({total}): страница {page}/{total_pages}"
-        await callback.message.edit_text(text, reply_markup=_list_keyboard(items, page, total_pages))
+        text, markup = view
+        await callback.message.edit_text(text, reply_markup=markup)
         await callback.answer()
     except Exception as e:
         logging.error(f"handle_bouquet_pagination error: {e}", exc_info=True)
@@ -184,23 +204,17 @@ async def handle_bouquet_pagination(callback: types.CallbackQuery):
             await callback.answer("Ошибка пагинации.")
         except Exception:
             pass
-    finally:
-        await session.close()
 
 
 # ===== ДЕТАЛИ БУКЕТА =====
 
-async def show_bouquet_details(callback: types.CallbackQuery):
+async def show_bouquet_details(callback: types.CallbackQuery, session: AsyncSession):
     """Показать детальную карточку букета с фото (если есть)."""
-    try:
-        parts = (callback.data or "").split(":")
-        bouquet_id = parts[1] if len(parts) > 1 else ""
-        page = int(parts[2]) if len(parts) > 2 else None
-    except Exception:
-        bouquet_id = ""
-        page = None
+    # bouquet_detail:<id>[:<страница>:<якорь страницы>]
+    parts = (callback.data or "").split(":")
+    bouquet_id = parts[1] if len(parts) > 1 else ""
+    page, anchor = _parse_list_callback(callback.data, skip=2) if len(parts) > 2 else (None, None)
 
-    session = await get_db_session()
     try:
         res = await session.execute(select(Bouquet).where(Bouquet.bouquet_id == bouquet_id))
         b = res.scalar_one_or_none()
@@ -210,20 +224,18 @@ async def show_bouquet_details(callback: types.CallbackQuery):
             return
 
         caption = _details_caption(b)
-        media_ref = _first_media(b)
-
-        if media_ref:
-            await callback.message.answer_photo(
-                photo=media_ref,  # <-- здесь теперь СТРОКА (file_id или URL), не dict
-                caption=caption,
-                parse_mode="HTML",
-                reply_markup=_detail_keyboard(b.bouquet_id, page)
-            )
-        else:
+        # file_id, выданный Telegram после отправки по URL, сохраняется — повторно из бакета не качаем
+        sent = await send_bouquet_photo(
+            callback.message, b.bouquet_id, b.photos,
+            caption=caption,
+            parse_mode="HTML",
+            reply_markup=_detail_keyboard(b.bouquet_id, page, _photo_count(b), anchor)
+        )
+        if sent is None:
             await callback.message.answer(
                 caption,
                 parse_mode="HTML",
-                reply_markup=_detail_keyboard(b.bouquet_id, page)
+                reply_markup=_detail_keyboard(b.bouquet_id, page, _photo_count(b), anchor)
             )
 
         await callback.answer()
@@ -233,8 +245,30 @@ async def show_bouquet_details(callback: types.CallbackQuery):
             await callback.answer("Не удалось показать детали букета.")
         except Exception:
             pass
-    finally:
-        await session.close()
+
+
+async def show_bouquet_album(callback: types.CallbackQuery, session: AsyncSession):
+    """Все фото букета одним альбомом (send_media_group, до 10 штук)."""
+    bouquet_id = (callback.data or "").split(":", 1)[-1]
+
+    try:
+        res = await session.execute(select(Bouquet.photos).where(Bouquet.bouquet_id == bouquet_id))
+        photos = res.scalar_one_or_none()
+        if not photos:
+            await callback.answer("У букета нет фото.")
+            return
+
+        sent = await send_bouquet_album(callback.message, bouquet_id, photos)
+        if sent is None:
+            await callback.answer("Не удалось отправить фото.")
+            return
+        await callback.answer()
+    except Exception as e:
+        logging.error(f"Ошибка в show_bouquet_album: {e}", exc_info=True)
+        try:
+            await callback.answer("Не удалось показать фото.")
+        except Exception:
+            pass
 
 
 # ===== РЕДАКТИРОВАНИЕ / УДАЛЕНИЕ =====
@@ -293,7 +327,7 @@ async def handle_edit_field(callback: types.CallbackQuery, state: FSMContext):
     await callback.answer()
 
 
-async def handle_delete_bouquet(callback: types.CallbackQuery):
+async def handle_delete_bouquet(callback: types.CallbackQuery, session: AsyncSession):
     """Удалить букет без подтверждения (можно добавить подтверждение по желанию)."""
     try:
         bouquet_id = (callback.data or "").split(":")[1]
@@ -301,52 +335,37 @@ async def handle_delete_bouquet(callback: types.CallbackQuery):
         await callback.answer("Ошибка.")
         return
 
-    session = await get_db_session()
     try:
         await session.execute(delete(Bouquet).where(Bouquet.bouquet_id == bouquet_id))
+        # фиксируем до фоновой чистки файлов и ответа пользователю
         await session.commit()
+        # файлы в облаке удаляем в фоне — ответ пользователю не ждёт S3
+        schedule_bouquet_cleanup(bouquet_id)
+        await forget_bouquet(bouquet_id)
         await callback.message.answer(f"Букет #{bouquet_id} удалён.")
         await callback.answer()
     except Exception as e:
+        await session.rollback()
         logging.error(f"handle_delete_bouquet error: {e}", exc_info=True)
         try:
             await callback.answer("Не удалось удалить букет.")
         except Exception:
             pass
-    finally:
-        await session.close()
 
 
-async def handle_back_to_list(callback: types.CallbackQuery):
-    """Возврат к списку (если передавали страницу — вернёмся к ней)."""
-    try:
-        parts = (callback.data or "").split(":")
-        page = int(parts[1]) if len(parts) > 1 else 1
-    except Exception:
-        page = 1
-
-    session = await get_db_session()
+async def handle_back_to_list(callback: types.CallbackQuery, session: AsyncSession,
+                              user: Optional[CachedUser] = None):
+    """Возврат к списку: back_to_list[:<страница>:<якорь>] — на ту страницу, откуда пришли."""
+    page, anchor = _parse_list_callback(callback.data, skip=1)
     try:
-        user = await get_or_create_user(session, callback.from_user.id)
-        res = await session.execute(
-            select(Bouquet)
-            .where(Bouquet.user_id == user.id)
-            .order_by(Bouquet.created_at.desc())
-        )
-        all_bouquets = res.scalars().all()
-        if not all_bouquets:
-            await callback.message.edit_text("Букетов пока нет.")
-            await callback.answer()
-            return
-
-        total = len(all_bouquets)
-        total_pages = max(1, math.ceil(total / PAGE_SIZE))
-        page = max(1, min(page, total_pages))
-        start = (page - 1) * PAGE_SIZE
-        items = all_bouquets[start:start + PAGE_SIZE]
-
-        text = f"📚 Ваши букеты ({total}): страница {page}/{total_pages}"
-        await callback.message.edit_text(text, reply_markup=_list_keyboard(items, page, total_pages))
+        user = user or await resolve_user(callback.from_user.id)
+        view = await _bouquet_list_view(session, user.id, page, anchor)
+        text, markup = view if view else ("Букетов пока нет.", None)
+        if callback.message.text:
+            await callback.message.edit_text(text, reply_markup=markup)
+        else:
+            # карточка с фото — текстом её не заменить, отправляем список отдельно
+            await callback.message.answer(text, reply_markup=markup)
         await callback.answer()
     except Exception as e:
         logging.error(f"handle_back_to_list error: {e}", exc_info=True)
@@ -354,5 +373,3 @@ async def handle_back_to_list(callback: types.CallbackQuery):
             await callback.answer("Ошибка.")
         except Exception:
             pass
-    finally:
-        await session.close()
@@ -3,10 +3,30 @@ from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 import logging
 
+import config
 # Хранилище и загрузка
-from storage import upload_photo_to_storage
-# групповые буферы для медиа отображаются/наполняются в media_processing
-from handlers.shared_data import media_groups, media_group_locks, document_groups, document_group_locks
+from media_pipeline import draft_uploads, UPLOAD_DONE
+from storage import schedule_url_cleanup
+import bouquet_numbers
+import draft_media
+
+
+async def abandon_draft(state: FSMContext) -> None:
+    """
+    Очистить FSM, бросив текущий черновик букета. Номер черновика возвращается в
+    оборот, а allocate может выдать его снова — поэтому фоновые загрузки черновика
+    отменяются, а его видео удаляется, чтобы ничего из него не попало в новый.
+    """
+    data = await state.get_data()
+    bouquet_id = data.get("current_id")
+    await state.clear()
+    await draft_media.clear(state)
+    if not bouquet_id:
+        return
+    draft_uploads.discard(bouquet_id)
+    await draft_media.forget_uploaded(bouquet_id)
+    if data.get("user_id") is not None and await bouquet_numbers.release(bouquet_id, data["user_id"]):
+        schedule_url_cleanup(data.get("video"))
 
 
 async def show_media_buttons(chat_id: int, state: FSMContext, bot):
@@ -18,9 +38,9 @@ async def show_media_buttons(chat_id: int, state: FSMContext, bot):
     """
     try:
         data = await state.get_data()
-        media_list = data.get("media", [])
         limit = data.get("media_limit", 6)
-        count = len(media_list)
+        count = await draft_media.count(state)
+        uploaded = draft_uploads.counts(data.get("current_id", ""))[UPLOAD_DONE]
 
         builder = InlineKeyboardBuilder()
         builder.add(types.InlineKeyboardButton(text="Готово", callback_data="media_done"))
@@ -29,7 +49,7 @@ async def show_media_buttons(chat_id: int, state: FSMContext, bot):
 
         await bot.send_message(
             chat_id,
-            f"📷 Фото: {count}/{limit}\n"
+            f"📷 Фото: {count}/{limit} (☁️ загружено: {uploaded})\n"
             "• Можно отправлять как фото или как документ (качество лучше)\n"
             "• Когда закончите — нажмите «Готово»",
             reply_markup=builder.as_markup()
@@ -38,33 +58,42 @@ async def show_media_buttons(chat_id: int, state: FSMContext, bot):
         logging.error(f"Ошибка в show_media_buttons: {e}", exc_info=True)
 
 
-async def handle_media_upload(bot, media_list, bouquet_id: str):
+async def handle_media_upload(bot, media_list, bouquet_id: str, defer: bool = False):
     """
     Загружает все фото в облако и возвращает СПИСОК СЛОВАРЕЙ для записи в БД.
 
     👉 Формат элемента:
         {
           "file_id": "<telegram_file_id>",             # ВСЕГДА
-          "url": "https://<yandex-object-storage>..."  # если загрузка удалась
+          "url": "https://<yandex-object-storage>...", # если загрузка удалась
+          "thumb_url": "https://...",                  # превью (если сгенерировано)
+          "webp_url": "https://..."                    # WebP-вариант (если сгенерирован)
         }
 
     Если облако временно недоступно — всё равно вернём {"file_id": "..."}.
+    Фото начинают грузиться ещё при приёме (draft_uploads), здесь дожидаемся только
+    незавершённых и догружаем упавшие (параллельно, с повторами MEDIA_UPLOAD_RETRIES).
+    Порядок результата совпадает с порядком media_list.
+
+    defer=True — не блокировать обработчик: ждём не дольше UPLOAD_SAVE_WAIT и ничего
+    не догружаем сами; фото без "url" после сохранения ставятся в upload_queue.
     """
-    uploaded = []
     logging.info(f"Загрузка {len(media_list)} медиа для букета {bouquet_id}")
+    if defer:
+        results = await draft_uploads.collect(
+            bot, bouquet_id, media_list, wait=config.UPLOAD_SAVE_WAIT, reupload=False
+        )
+    else:
+        results = await draft_uploads.collect(bot, bouquet_id, media_list)
 
-    for index, file_id in enumerate(media_list, start=1):
-        try:
-            url = await upload_photo_to_storage(bot, file_id, bouquet_id, index - 1)
-            if url:
-                uploaded.append({"file_id": file_id, "url": url})
-                logging.info(f"[{index}] загружено -> {url}")
-            else:
-                uploaded.append({"file_id": file_id})
-                logging.warning(f"[{index}] не удалось загрузить на облако, сохраняю только file_id")
-        except Exception as e:
-            logging.error(f"[{index}] ошибка загрузки фото: {e}", exc_info=True)
+    uploaded = []
+    for index, (file_id, result) in enumerate(zip(media_list, results), start=1):
+        if result:
+            uploaded.append({"file_id": file_id, **result})
+            logging.info(f"[{index}] загружено -> {result['url']}")
+        else:
             uploaded.append({"file_id": file_id})
+            logging.warning(f"[{index}] не загружено в облако, сохраняю только file_id")
 
     logging.info(f"Итог медиа к сохранению: {uploaded}")
     return uploaded
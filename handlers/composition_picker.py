@@ -2,11 +2,12 @@ from aiogram import types
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 import logging
 import math
 
 from states import BouquetStates
-from database import get_db_session, Category, Product
+from database import Category, Product
 
 
 PAGE_SIZE = 6
@@ -14,8 +15,7 @@ PAGE_SIZE = 6
 
 # ---------- Витрина категорий ----------
 
-async def show_category_page(chat_id: int, state: FSMContext, bot, page: int = 1):
-    session = await get_db_session()
+async def show_category_page(chat_id: int, state: FSMContext, bot, session: AsyncSession, page: int = 1):
     try:
         result = await session.execute(select(Category).order_by(Category.name.asc()))
         categories = result.scalars().all()
@@ -51,14 +51,11 @@ async def show_category_page(chat_id: int, state: FSMContext, bot, page: int = 1
     except Exception as e:
         logging.error(f"show_category_page error: {e}", exc_info=True)
         await bot.send_message(chat_id, "Не удалось загрузить категории.")
-    finally:
-        await session.close()
 
 
 # ---------- Витрина товаров категории ----------
 
-async def show_product_page(chat_id: int, state: FSMContext, bot, category_id: int, page: int = 1):
-    session = await get_db_session()
+async def show_product_page(chat_id: int, state: FSMContext, bot, session: AsyncSession, category_id: int, page: int = 1):
     try:
         # найдём категорию
         result_cat = await session.execute(select(Category).where(Category.id == category_id))
@@ -103,44 +100,37 @@ async def show_product_page(chat_id: int, state: FSMContext, bot, category_id: i
     except Exception as e:
         logging.error(f"show_product_page error: {e}", exc_info=True)
         await bot.send_message(chat_id, "Не удалось загрузить товары категории.")
-    finally:
-        await session.close()
 
 
 # ---------- Колбэки и ввод количества ----------
 
-async def handle_category_page(callback: types.CallbackQuery, state: FSMContext):
+async def handle_category_page(callback: types.CallbackQuery, state: FSMContext, session: AsyncSession):
     page = int(callback.data.split(":")[1])
     await callback.answer()
-    await show_category_page(callback.message.chat.id, state, callback.bot, page=page)
+    await show_category_page(callback.message.chat.id, state, callback.bot, session, page=page)
 
-async def handle_category_select(callback: types.CallbackQuery, state: FSMContext):
+async def handle_category_select(callback: types.CallbackQuery, state: FSMContext, session: AsyncSession):
     # format: cat_select:<cat_id>:<page>
     parts = callback.data.split(":")
     category_id = int(parts[1])
     page = int(parts[2]) if len(parts) > 2 else 1
     await callback.answer()
     await state.set_state(BouquetStates.choosing_product)
-    await show_product_page(callback.message.chat.id, state, callback.bot, category_id=category_id, page=page)
+    await show_product_page(callback.message.chat.id, state, callback.bot, session, category_id=category_id, page=page)
 
-async def handle_product_page(callback: types.CallbackQuery, state: FSMContext):
+async def handle_product_page(callback: types.CallbackQuery, state: FSMContext, session: AsyncSession):
     # format: prod_page:<cat_id>:<page>
     _, cat_id, page = callback.data.split(":")
     await callback.answer()
-    await show_product_page(callback.message.chat.id, state, callback.bot, category_id=int(cat_id), page=int(page))
+    await show_product_page(callback.message.chat.id, state, callback.bot, session, category_id=int(cat_id), page=int(page))
 
-async def handle_product_select(callback: types.CallbackQuery, state: FSMContext):
+async def handle_product_select(callback: types.CallbackQuery, state: FSMContext, session: AsyncSession):
     """
     После клика по товару:
-      1) сохраняем его id в FSM
+      1) сохраняем в FSM снимок товара — process_quantity возьмёт его оттуда, без БД
       2) показываем подсказку «Введите количество для <название товара>»
     """
     product_id = int(callback.data.split(":")[1])
-    await state.update_data(selected_product_id=product_id)
-    await state.set_state(BouquetStates.entering_quantity)
-
-    # Получим название/цвет, чтобы показать пользователю
-    session = await get_db_session()
     try:
         res = await session.execute(
             select(Product, Category).join(Category, Product.category_id == Category.id).where(Product.id == product_id)
@@ -149,11 +139,20 @@ async def handle_product_select(callback: types.CallbackQuery, state: FSMContext
         if not row:
             await callback.message.answer("Товар не найден. Вернёмся к категориям.")
             await state.set_state(BouquetStates.choosing_category)
-            await show_category_page(callback.message.chat.id, state, callback.bot, page=1)
+            await show_category_page(callback.message.chat.id, state, callback.bot, session, page=1)
             await callback.answer()
             return
 
-        product, _ = row
+        product, category = row
+        await state.update_data(selected_product={
+            "product_id": product.id,
+            "raw_name": product.name,
+            "color": product.color,
+            "type": product.product_type,
+            "category": category.name,
+        })
+        await state.set_state(BouquetStates.entering_quantity)
+
         title = product.name if not product.color else f"{product.name} ({product.color})"
         await callback.message.answer(
             f"Введите количество для <b>{title}</b> (целое число 1..9999):",
@@ -162,12 +161,10 @@ async def handle_product_select(callback: types.CallbackQuery, state: FSMContext
     except Exception as e:
         logging.error(f"handle_product_select error: {e}", exc_info=True)
         await callback.message.answer("Ошибка. Попробуйте ещё раз выбрать товар.")
-    finally:
-        await session.close()
 
     await callback.answer()
 
-async def process_quantity(message: types.Message, state: FSMContext):
+async def process_quantity(message: types.Message, state: FSMContext, session: AsyncSession):
     try:
         qty_text = (message.text or "").strip()
         if not qty_text.isdigit():
@@ -179,54 +176,39 @@ async def process_quantity(message: types.Message, state: FSMContext):
             return
 
         data = await state.get_data()
-        product_id = int(data.get("selected_product_id") or 0)
-        if not product_id:
+        product = data.get("selected_product")
+        if not product:
             await message.answer("Не удалось определить товар. Вернёмся к категориям.")
             await state.set_state(BouquetStates.choosing_category)
-            await show_category_page(message.chat.id, state, message.bot, page=1)
+            await show_category_page(message.chat.id, state, message.bot, session, page=1)
             return
 
-        session = await get_db_session()
-        try:
-            res = await session.execute(
-                select(Product, Category).join(Category, Product.category_id == Category.id).where(Product.id == product_id)
-            )
-            row = res.one_or_none()
-            if not row:
-                await message.answer("Товар не найден. Вернёмся к категориям.")
-                await state.set_state(BouquetStates.choosing_category)
-                await show_category_page(message.chat.id, state, message.bot, page=1)
-                return
-
-            product, category = row
-            composition = data.get("composition", []) or []
-            composition.append({
-                "raw_name": product.name,
-                "qty": qty,
-                "color": product.color,
-                "type": product.product_type,
-                "category": category.name,
-                "product_id": product.id
-            })
-            await state.update_data(composition=composition, selected_product_id=None)
-
-            title = product.name if not product.color else f"{product.name} ({product.color})"
-            await message.answer(
-                f"Добавлено: <b>{title}</b> — {qty} шт.\n"
-                f"➕ Можно добавить ещё или завершить.",
-                parse_mode="HTML"
-            )
+        composition = data.get("composition", []) or []
+        composition.append({
+            "raw_name": product["raw_name"],
+            "qty": qty,
+            "color": product["color"],
+            "type": product["type"],
+            "category": product["category"],
+            "product_id": product["product_id"]
+        })
+        await state.update_data(composition=composition, selected_product=None)
+
+        title = product["raw_name"] if not product["color"] else f"{product['raw_name']} ({product['color']})"
+        await message.answer(
+            f"Добавлено: <b>{title}</b> — {qty} шт.\n"
+            f"➕ Можно добавить ещё или завершить.",
+            parse_mode="HTML"
+        )
 
-            await state.set_state(BouquetStates.choosing_category)
-            await show_category_page(message.chat.id, state, message.bot, page=1)
-        finally:
-            await session.close()
+        await state.set_state(BouquetStates.choosing_category)
+        await show_category_page(message.chat.id, state, message.bot, session, page=1)
 
     except Exception as e:
         logging.error(f"process_quantity error: {e}", exc_info=True)
         await message.answer("Ошибка при добавлении. Попробуйте ещё раз.")
         await state.set_state(BouquetStates.choosing_category)
-        await show_category_page(message.chat.id, state, message.bot, page=1)
+        await show_category_page(message.chat.id, state, message.bot, session, page=1)
 
 async def handle_composition_done(callback: types.CallbackQuery, state: FSMContext):
     await callback.answer()
@@ -245,7 +227,7 @@ async def handle_composition_done(callback: types.CallbackQuery, state: FSMConte
     await state.set_state(BouquetStates.waiting_price)
     await callback.message.edit_text(text, parse_mode="HTML")
 
-async def handle_composition_back(callback: types.CallbackQuery, state: FSMContext):
+async def handle_composition_back(callback: types.CallbackQuery, state: FSMContext, session: AsyncSession):
     await callback.answer()
     await state.set_state(BouquetStates.choosing_category)
-    await show_category_page(callback.message.chat.id, state, callback.bot, page=1)
+    await show_category_page(callback.message.chat.id, state, callback.bot, session, page=1)
@@ -6,8 +6,9 @@ import tempfile
 import os
 import re
 from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from database import get_db_session, Bouquet, Category, Product
+from database import Bouquet, Category, Product
 
 
 # -----------------------------
@@ -16,9 +17,10 @@ from database import get_db_session, Bouquet, Category, Product
 
 _URL_RE = re.compile(r"^https?://", re.IGNORECASE)
 
-def _photos_to_urls(photos) -> str:
+def _photos_to_urls(photos, key: str = "url") -> str:
     """
     Вернуть ТОЛЬКО http(s) URL-адреса (через '; ') из поля photos.
+    key — какое поле словаря брать: "url" (оригинал), "thumb_url" (превью), "webp_url".
     Поддерживаются форматы:
       • список словарей: {"file_id": "...", "url": "https://..."}
       • список строк: ["https://...", "AgACAgIA..."]
@@ -31,12 +33,12 @@ def _photos_to_urls(photos) -> str:
         if isinstance(photos, list):
             for item in photos:
                 if isinstance(item, dict):
-                    url = item.get("url")
+                    url = item.get(key)
                     if isinstance(url, str) and _URL_RE.match(url.strip()):
                         urls.append(url.strip())
-                elif isinstance(item, str) and _URL_RE.match(item.strip()):
+                elif key == "url" and isinstance(item, str) and _URL_RE.match(item.strip()):
                     urls.append(item.strip())
-        elif isinstance(photos, str) and _URL_RE.match(photos.strip()):
+        elif key == "url" and isinstance(photos, str) and _URL_RE.match(photos.strip()):
             urls.append(photos.strip())
 
         # уникализуем, сохраняя порядок
@@ -74,9 +76,8 @@ def _composition_to_text(composition) -> str:
 # ЭКСПОРТ ТОВАРОВ
 # -----------------------------
 
-async def export_products_to_excel(message: types.Message):
+async def export_products_to_excel(message: types.Message, session: AsyncSession):
     """Экспорт всех товаров в Excel файл."""
-    session = await get_db_session()
     try:
         result = await session.execute(
             select(Product, Category).join(Category, Product.category_id == Category.id)
@@ -118,20 +119,17 @@ async def export_products_to_excel(message: types.Message):
     except Exception as e:
         logging.error(f"Ошибка при экспорте товаров: {e}", exc_info=True)
         await message.answer("Ошибка при экспорте данных.")
-    finally:
-        await session.close()
 
 
 # -----------------------------
 # ЭКСПОРТ БУКЕТОВ (КАТАЛОГ)
 # -----------------------------
 
-async def export_bouquets_to_excel(message: types.Message):
+async def export_bouquets_to_excel(message: types.Message, session: AsyncSession):
     """
     Экспорт всех букетов в Excel.
     В колонке «Фото (URL)» — ТОЛЬКО ссылки из Яндекс-облака; file_id отфильтровываются.
     """
-    session = await get_db_session()
     try:
         result = await session.execute(select(Bouquet).order_by(Bouquet.created_at.desc()))
         bouquets = result.scalars().all()
@@ -155,6 +153,7 @@ async def export_bouquets_to_excel(message: types.Message):
                 "Валюта": getattr(b, "currency", "RUB") or "RUB",
                 "Видео (URL)": getattr(b, "video_path", "") or "",
                 "Фото (URL)": _photos_to_urls(getattr(b, "photos", None)),
+                "Превью (URL)": _photos_to_urls(getattr(b, "photos", None), key="thumb_url"),
                 "Создано": created_at,
                 "Обновлено": updated_at,
             })
@@ -179,5 +178,3 @@ async def export_bouquets_to_excel(message: types.Message):
     except Exception as e:
         logging.error(f"Ошибка при экспорте букетов: {e}", exc_info=True)
         await message.answer("Ошибка при экспорте каталога.")
-    finally:
-        await session.close()
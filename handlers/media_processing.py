@@ -1,15 +1,50 @@
 # handlers/media_processing.py
 from aiogram import F, types
 from aiogram.fsm.context import FSMContext
-import asyncio
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
 import logging
+from dataclasses import asdict
+from functools import partial
 
-from .shared_data import media_groups, media_group_locks, document_groups, document_group_locks
+from .shared_data import photo_groups, document_groups
 from .common import show_media_buttons
 from storage import upload_video_to_storage
+from media_pipeline import draft_uploads
+import draft_media
 from states import BouquetStates
 
 
+def setup_album_recovery(bot, storage: BaseStorage) -> None:
+    """
+    Альбом, брошенный упавшим процессом бота, доводит до черновика любой живой:
+    FSMContext восстанавливается по ключу состояния, сохранённому в context альбома.
+    """
+    def _factory(handler):
+        def make(context: dict):
+            state = FSMContext(storage=storage, key=StorageKey(**context))
+            return partial(handler, state=state, chat_id=state.key.chat_id, bot=bot)
+        return make
+
+    photo_groups.set_recovery(_factory(process_media_group))
+    document_groups.set_recovery(_factory(process_document_group))
+    photo_groups.start_sweeper()
+    document_groups.start_sweeper()
+
+
+async def stop_album_recovery() -> None:
+    await photo_groups.stop_sweeper()
+    await document_groups.stop_sweeper()
+
+
+def _start_background_uploads(bot, data: dict, file_ids: list[str], first_index: int):
+    """Сразу отправить принятые фото в облако, не дожидаясь «Сохранить»."""
+    bouquet_id = data.get("current_id")
+    if not bouquet_id:
+        return
+    for offset, fid in enumerate(file_ids):
+        draft_uploads.start(bot, bouquet_id, fid, first_index + offset)
+
+
 async def handle_back_to_media(callback_query: types.CallbackQuery, state: FSMContext):
     """Кнопка 'Назад' при загрузке медиа: возвращаемся к состоянию ожидания фото."""
     try:
@@ -24,61 +59,49 @@ async def handle_photos(message: types.Message, state: FSMContext):
     """Приём фотографий (включая альбомы)."""
     try:
         data = await state.get_data()
-        media_list = data.get("media", [])
         limit = int(data.get("media_limit", 6))
 
-        # Альбом
+        # Альбом: отдаём обработчику, когда элементы перестанут приходить
         if message.media_group_id:
-            async with media_group_locks[message.media_group_id]:
-                media_groups[message.media_group_id].append(message.photo[-1].file_id)
-                if len(media_groups[message.media_group_id]) == 1:
-                    asyncio.create_task(process_media_group(message.media_group_id, state, message.chat.id, message.bot))
+            await photo_groups.add(
+                message.media_group_id, message.photo[-1].file_id,
+                flush=partial(process_media_group, state=state, chat_id=message.chat.id, bot=message.bot),
+                expected=limit - await draft_media.count(state),
+                context=asdict(state.key),
+            )
             return
 
-        # Одиночное фото
-        if len(media_list) >= limit:
+        # Одиночное фото: лимит проверяется атомарно вместе с добавлением
+        added, total = await draft_media.append(state, [message.photo[-1].file_id], limit)
+        if not added:
             await message.answer(f"Достигнут лимит в {limit} фото")
             await show_media_buttons(message.chat.id, state, message.bot)
             return
 
-        media_list.append(message.photo[-1].file_id)
-        await state.update_data(media=media_list)
-        await message.answer(f"Фото добавлено. Всего: {len(media_list)}/{limit}")
+        _start_background_uploads(message.bot, data, [message.photo[-1].file_id], total - 1)
+        await message.answer(f"Фото добавлено. Всего: {total}/{limit}")
         await show_media_buttons(message.chat.id, state, message.bot)
     except Exception as e:
         logging.error(f"handle_photos error: {e}", exc_info=True)
         await message.answer("Произошла ошибка при обработке фото.")
 
 
-async def process_media_group(media_group_id: str, state: FSMContext, chat_id: int, bot):
-    """Собираем все фото из альбома и добавляем в state с учётом лимита."""
+async def process_media_group(file_ids: list[str], state: FSMContext, chat_id: int, bot):
+    """Добавить фото собранного альбома в state с учётом лимита."""
     try:
-        await asyncio.sleep(1.5)
-        async with media_group_locks[media_group_id]:
-            file_ids = media_groups.get(media_group_id, [])
-            if not file_ids:
-                return
-
-            data = await state.get_data()
-            media_list = data.get("media", [])
-            limit = int(data.get("media_limit", 6))
+        if not file_ids:
+            return
 
-            added = 0
-            for fid in file_ids:
-                if len(media_list) < limit:
-                    media_list.append(fid)
-                    added += 1
-                else:
-                    break
+        data = await state.get_data()
+        limit = int(data.get("media_limit", 6))
 
-            await state.update_data(media=media_list)
-            if added:
-                await bot.send_message(chat_id, f"Добавлено фото из альбома: {added}. Всего: {len(media_list)}/{limit}")
-                await show_media_buttons(chat_id, state, bot)
+        added, total = await draft_media.append(state, file_ids, limit)
+        _start_background_uploads(bot, data, file_ids[:added], total - added)
+        if added:
+            await bot.send_message(chat_id, f"Добавлено фото из альбома: {added}. Всего: {total}/{limit}")
+            await show_media_buttons(chat_id, state, bot)
     except Exception as e:
         logging.error(f"process_media_group error: {e}", exc_info=True)
-    finally:
-        media_groups.pop(media_group_id, None)
 
 
 async def handle_documents(message: types.Message, state: FSMContext):
@@ -89,7 +112,6 @@ async def handle_documents(message: types.Message, state: FSMContext):
 
         mime = (message.document.mime_type or "")
         data = await state.get_data()
-        media_list = data.get("media", [])
         limit = int(data.get("media_limit", 6))
 
         # Видео как документ
@@ -101,69 +123,67 @@ async def handle_documents(message: types.Message, state: FSMContext):
                     await state.update_data(video=url)
                     await processing.edit_text("Видео загружено ✅")
                 else:
-                    await processing.edit_text("❌ Не удалось загрузить видео. Попробуйте другой файл.")
+                    # облако недоступно — сохраняем file_id, видео догрузит upload_worker
+                    await state.update_data(video=message.document.file_id)
+                    await processing.edit_text("Видео добавлено ✅ (в облако загрузится позже)")
             except Exception as e:
                 logging.error(f"upload video error: {e}", exc_info=True)
                 await processing.edit_text("❌ Не удалось загрузить видео.")
             await show_media_buttons(message.chat.id, state, message.bot)
             return
 
-        # Изображение как документ
-        if mime.startswith("image/"):
-            if len(media_list) >= limit:
+        # Изображение как документ (HEIC/HEIF конвертируем в JPEG при загрузке)
+        filename = (message.document.file_name or "").lower()
+        is_heic = mime in ("image/heic", "image/heif") or filename.endswith((".heic", ".heif"))
+        if mime.startswith("image/") or is_heic:
+            count = await draft_media.count(state)
+            if count >= limit:
                 await message.answer(f"Достигнут лимит в {limit} фото")
                 await show_media_buttons(message.chat.id, state, message.bot)
                 return
 
             # Альбом документов
             if message.media_group_id:
-                async with document_group_locks[message.media_group_id]:
-                    document_groups[message.media_group_id].append(message.document.file_id)
-                    if len(document_groups[message.media_group_id]) == 1:
-                        asyncio.create_task(process_document_group(message.media_group_id, state, message.chat.id, message.bot))
+                await document_groups.add(
+                    message.media_group_id, message.document.file_id,
+                    flush=partial(process_document_group, state=state, chat_id=message.chat.id, bot=message.bot),
+                    expected=limit - count,
+                    context=asdict(state.key),
+                )
                 return
 
             # Одиночный документ
-            media_list.append(message.document.file_id)
-            await state.update_data(media=media_list)
-            await message.answer(f"Фото (как документ) добавлено. Всего: {len(media_list)}/{limit}")
+            added, total = await draft_media.append(state, [message.document.file_id], limit)
+            if not added:
+                await message.answer(f"Достигнут лимит в {limit} фото")
+                await show_media_buttons(message.chat.id, state, message.bot)
+                return
+            _start_background_uploads(message.bot, data, [message.document.file_id], total - 1)
+            await message.answer(f"Фото (как документ) добавлено. Всего: {total}/{limit}")
             await show_media_buttons(message.chat.id, state, message.bot)
             return
 
-        await message.answer("Неподдерживаемый тип файла. Отправьте изображение (JPEG/PNG/WEBP) или видео.")
+        await message.answer("Неподдерживаемый тип файла. Отправьте изображение (JPEG/PNG/WEBP/HEIC) или видео.")
     except Exception as e:
         logging.error(f"handle_documents error: {e}", exc_info=True)
         await message.answer("Произошла ошибка при обработке документа.")
 
 
-async def process_document_group(media_group_id: str, state: FSMContext, chat_id: int, bot):
+async def process_document_group(file_ids: list[str], state: FSMContext, chat_id: int, bot):
     try:
-        await asyncio.sleep(1.5)
-        async with document_group_locks[media_group_id]:
-            file_ids = document_groups.get(media_group_id, [])
-            if not file_ids:
-                return
-
-            data = await state.get_data()
-            media_list = data.get("media", [])
-            limit = int(data.get("media_limit", 6))
+        if not file_ids:
+            return
 
-            added = 0
-            for fid in file_ids:
-                if len(media_list) < limit:
-                    media_list.append(fid)
-                    added += 1
-                else:
-                    break
+        data = await state.get_data()
+        limit = int(data.get("media_limit", 6))
 
-            await state.update_data(media=media_list)
-            if added:
-                await bot.send_message(chat_id, f"Добавлено файлов (как документы): {added}. Всего: {len(media_list)}/{limit}")
-                await show_media_buttons(chat_id, state, bot)
+        added, total = await draft_media.append(state, file_ids, limit)
+        _start_background_uploads(bot, data, file_ids[:added], total - added)
+        if added:
+            await bot.send_message(chat_id, f"Добавлено файлов (как документы): {added}. Всего: {total}/{limit}")
+            await show_media_buttons(chat_id, state, bot)
     except Exception as e:
         logging.error(f"process_document_group error: {e}", exc_info=True)
-    finally:
-        document_groups.pop(media_group_id, None)
 
 
 async def handle_add_video(callback_query: types.CallbackQuery, state: FSMContext):
@@ -179,8 +199,7 @@ async def handle_media_done(callback_query: types.CallbackQuery, state: FSMConte
     """Переход к вводу описания после загрузки медиа."""
     try:
         await callback_query.answer()
-        data = await state.get_data()
-        if not data.get("media"):
+        if not await draft_media.count(state):
             await callback_query.message.answer("Нужно добавить хотя бы одно фото")
             return
 
@@ -204,7 +223,9 @@ async def process_video(message: types.Message, state: FSMContext):
             await state.update_data(video=url)
             await processing.edit_text("Видео загружено ✅")
         else:
-            await processing.edit_text("❌ Не удалось загрузить видео.")
+            # облако недоступно — сохраняем file_id, видео догрузит upload_worker
+            await state.update_data(video=message.video.file_id)
+            await processing.edit_text("Видео добавлено ✅ (в облако загрузится позже)")
         await show_media_buttons(message.chat.id, state, message.bot)
     except Exception as e:
         logging.error(f"process_video error: {e}", exc_info=True)
@@ -6,7 +6,8 @@ import os
 import logging
 
 from sqlalchemy import select, delete
-from database import get_db_session, Category, Product
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import Category, Product
 
 
 # ---------- Шаблон каталога ----------
@@ -50,7 +51,7 @@ async def send_excel_template(message: types.Message):
 
 # ---------- Импорт каталога из .xlsx ----------
 
-async def handle_catalog_import(message: types.Message):
+async def handle_catalog_import(message: types.Message, session: AsyncSession):
     """
     Импортирует категории и товары из .xlsx (по шаблону).
     Поведение: ПОЛНАЯ ПЕРЕЗАПИСЬ таблиц categories и products.
@@ -166,13 +167,11 @@ async def handle_catalog_import(message: types.Message):
             await message.answer("В листе «Товары» нет валидных строк (обязательны 'category' и 'name').")
             return
 
-        # Пишем в БД
-        session = await get_db_session()
+        # Пишем в БД: удаление и новый каталог — одна транзакция, при ошибке старый каталог остаётся
         try:
             # Полная перезапись справочников
             await session.execute(delete(Product))
             await session.execute(delete(Category))
-            await session.commit()
 
             # Создаём категории
             name_to_id = {}
@@ -210,8 +209,6 @@ async def handle_catalog_import(message: types.Message):
             await session.rollback()
             logging.error(f"Ошибка при импорте в БД: {db_err}", exc_info=True)
             await message.answer("Ошибка при импорте данных в базу.")
-        finally:
-            await session.close()
 
     except Exception as e:
         logging.error(f"Ошибка при обработке Excel файла: {e}", exc_info=True)
@@ -1,6 +1,8 @@
 from aiogram import types
 from aiogram.fsm.context import FSMContext
 import logging
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from states import BouquetStates
 from .product_handler import send_excel_template, handle_catalog_import
@@ -19,7 +21,7 @@ async def show_settings(message: types.Message):
     await message.answer("⚙️ Настройки:", reply_markup=keyboard)
 
 
-async def handle_settings(callback_query: types.CallbackQuery, state: FSMContext):
+async def handle_settings(callback_query: types.CallbackQuery, state: FSMContext, session: AsyncSession):
     """Обработка кнопок меню настроек."""
     parts = (callback_query.data or "").split(":")
     action = parts[1] if len(parts) > 1 else ""
@@ -41,7 +43,7 @@ async def handle_settings(callback_query: types.CallbackQuery, state: FSMContext
         await state.set_state(BouquetStates.waiting_catalog_file)
 
     elif action == "export_catalog":
-        await export_bouquets_to_excel(callback_query.message)
+        await export_bouquets_to_excel(callback_query.message, session)
 
     else:
         await callback_query.answer("Неизвестная команда.")
@@ -50,7 +52,7 @@ async def handle_settings(callback_query: types.CallbackQuery, state: FSMContext
     await callback_query.answer()
 
 
-async def process_photo_limit(message: types.Message, state: FSMContext):
+async def process_photo_limit(message: types.Message, state: FSMContext, session: AsyncSession):
     """Сохранение нового лимита фото для пользователя."""
     try:
         new_limit = int((message.text or "").strip())
@@ -62,17 +64,20 @@ async def process_photo_limit(message: types.Message, state: FSMContext):
         await message.answer("Лимит должен быть от 1 до 10. Попробуйте снова.")
         return
 
-    from database import get_db_session, get_or_create_user
+    from database import User
+    from user_cache import invalidate as invalidate_user
 
-    session = await get_db_session()
     try:
-        user = await get_or_create_user(session, message.from_user.id)
-        user.media_limit = new_limit
+        await session.execute(
+            update(User).where(User.telegram_id == message.from_user.id).values(media_limit=new_limit)
+        )
+        # фиксируем до сброса кэша, иначе другой апдейт закэширует старый лимит
         await session.commit()
+        # закэшированный пользователь со старым лимитом больше не нужен
+        await invalidate_user(message.from_user.id)
         await message.answer(f"Лимит фото изменён на {new_limit}")
         await show_settings(message)
     except Exception as e:
+        await session.rollback()
         logging.error(f"Ошибка при обновлении лимита фото: {e}", exc_info=True)
         await message.answer("Ошибка при изменении лимита фото.")
-    finally:
-        await session.close()
@@ -1,8 +1,5 @@
-import asyncio
-from collections import defaultdict
+from media_groups import create_collector
 
-# Глобальные переменные для обработки медиа-групп
-media_groups = defaultdict(list)
-media_group_locks = defaultdict(asyncio.Lock)
-document_groups = defaultdict(list)
-document_group_locks = defaultdict(asyncio.Lock)
\ No newline at end of file
+# Сборка альбомов: фото и документы копятся отдельно (MEDIA_GROUP_BACKEND)
+photo_groups = create_collector("photo-groups")
+document_groups = create_collector("document-groups")
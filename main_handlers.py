@@ -10,9 +10,10 @@ from database import Bouquet
 import logging
 import asyncio
 from collections import defaultdict
-import os
-import uuid
-from storage import yandex_storage
+# Загрузка медиа — общая с пакетом handlers: при недоступном хранилище фото остаются
+# в виде {"file_id": ...}, а не подменяют URL сырыми file_id
+from storage import upload_video_to_storage
+from handlers.common import handle_media_upload
 
 # Глобальные переменные для обработки медиа-групп
 media_groups = defaultdict(list)
@@ -43,92 +44,6 @@ async def show_media_buttons(chat_id, state, bot):
         logging.error(f"Ошибка в show_media_buttons: {e}")
 
 
-async def upload_photo_to_storage(bot, file_id, bouquet_id, index):
-    """Загружает фото на Yandex Object Storage и возвращает URL"""
-    try:
-        # Проверяем доступность хранилища
-        if not all([yandex_storage.access_key_id, yandex_storage.secret_access_key, yandex_storage.bucket_name]):
-            logging.warning("Не настроены учетные данные Yandex Object Storage")
-            return file_id  # возвращаем file_id как fallback
-
-        # Скачиваем файл из Telegram
-        file = await bot.get_file(file_id)
-        file_path = file.file_path
-
-        # Генерируем уникальное имя файла
-        file_extension = os.path.splitext(file_path)[1] or '.jpg'
-        unique_name = f"{uuid.uuid4().hex}{file_extension}"
-        object_name = f"bouquets/{bouquet_id}/{unique_name}"
-
-        # Скачиваем файл
-        downloaded_file = await bot.download_file(file_path)
-        file_content = downloaded_file.read()
-
-        # Загружаем на Yandex Object Storage
-        photo_url = await yandex_storage.upload_from_memory(
-            file_content,
-            object_name,
-            content_type='image/jpeg'
-        )
-
-        logging.info(f"Фото успешно загружено на сервер: {photo_url}")
-        return photo_url
-    except Exception as e:
-        logging.error(f"Ошибка при загрузке фото на сервер: {e}")
-        return file_id  # возвращаем file_id как fallback
-
-
-async def upload_video_to_storage(bot, file_id, bouquet_id):
-    """Загружает видео на Yandex Object Storage и возвращает URL"""
-    try:
-        # Проверяем доступность хранилища
-        if not all([yandex_storage.access_key_id, yandex_storage.secret_access_key, yandex_storage.bucket_name]):
-            logging.warning("Не настроены учетные данные Yandex Object Storage")
-            return file_id  # возвращаем file_id как fallback
-
-        # Скачиваем файл из Telegram
-        file = await bot.get_file(file_id)
-        file_path = file.file_path
-
-        # Генерируем уникальное имя файла
-        file_extension = os.path.splitext(file_path)[1] or '.mp4'
-        unique_name = f"{uuid.uuid4().hex}{file_extension}"
-        object_name = f"bouquets/{bouquet_id}/{unique_name}"
-
-        # Скачиваем файл
-        downloaded_file = await bot.download_file(file_path)
-        file_content = downloaded_file.read()
-
-        # Загружаем на Yandex Object Storage
-        video_url = await yandex_storage.upload_from_memory(
-            file_content,
-            object_name,
-            content_type='video/mp4'
-        )
-
-        logging.info(f"Видео успешно загружено на сервер: {video_url}")
-        return video_url
-    except Exception as e:
-        logging.error(f"Ошибка при загрузке видео на сервер: {e}")
-        return file_id  # возвращаем file_id как fallback
-
-
-async def handle_media_upload(bot, media_list, bouquet_id):
-    """Загружает все медиафайлы на сервер и возвращает список URL"""
-    uploaded_media = []
-
-    for i, file_id in enumerate(media_list):
-        photo_url = await upload_photo_to_storage(bot, file_id, bouquet_id, i)
-        if photo_url:
-            uploaded_media.append(photo_url)
-        else:
-            # Если не удалось загрузить на сервер, оставляем file_id как fallback
-            uploaded_media.append(file_id)
-            logging.warning(f"Не удалось загрузить фото {i} для букета {bouquet_id}, используем file_id")
-
-    return uploaded_media
-
-
 async def handle_photos(message: types.Message, state: FSMContext):
     try:
         # Получаем текущие данные состояния
@@ -720,11 +635,14 @@ async def handle_edit_field(callback: types.CallbackQuery, state: FSMContext):
                 }
 
                 bouquet = await update_bouquet(session, bouquet_id, update_data)
+                # хелперы database.py только делают flush — фиксируем сами
+                await session.commit()
                 await callback.message.answer(f"Букет {bouquet.title_display} успешно обновлен!")
 
                 await state.clear()
 
             except Exception as e:
+                await session.rollback()
                 logging.error(f"Ошибка при обновлении букета: {e}")
                 await callback.message.answer("Произошла ошибка при сохранении изменений.")
             finally:
@@ -743,6 +661,7 @@ async def handle_delete_bouquet(callback: types.CallbackQuery):
         try:
             success = await delete_bouquet(session, bouquet_id)
             if success:
+                await session.commit()
                 await callback.message.answer("Букет успешно удален!")
             else:
                 await callback.message.answer("Не удалось удалить букет.")
@@ -859,10 +778,12 @@ async def handle_actions(callback: types.CallbackQuery, state: FSMContext):
                 }
 
                 bouquet = await create_bouquet(session, bouquet_data)
+                await session.commit()
                 await callback.message.answer(f"Букет {bouquet.title_display} сохранен!")
 
                 await state.clear()
             except Exception as e:
+                await session.rollback()
                 logging.error(f"Ошибка при сохранении букета: {e}")
                 await callback.message.answer("Произошла ошибка при сохранении букета. Попробуйте еще раз.")
             finally:
@@ -0,0 +1,207 @@
+# media_delivery.py
+"""
+Отправка фото букетов с переиспользованием Telegram file_id.
+
+Элемент bouquets.photos — {"file_id", "url", ...}: file_id — тот, с которым фото прислал
+пользователь (для документа он не годится в send_photo), url — объект в облаке. Фото,
+отправленное по URL, Telegram каждый раз заново скачивает из бакета. Поэтому file_id из
+ответного сообщения дописывается в элемент ("tg_file_id") и дублируется в Redis-хэш
+букета — повторные показы идут из кэша Telegram, без трафика из бакета.
+"""
+import asyncio
+import logging
+from typing import Optional
+
+from aiogram import types
+from aiogram.exceptions import TelegramBadRequest
+
+import config
+from cache import get_redis
+from database import merge_bouquet_photos
+
+_BOUQUET_KEY = "tg:bouquet:{}"
+# больше элементов send_media_group не принимает
+ALBUM_LIMIT = 10
+
+# сильные ссылки на фоновые записи file_id
+_background_tasks: set[asyncio.Task] = set()
+
+
+def _clean(value) -> Optional[str]:
+    if isinstance(value, str) and value.strip():
+        return value.strip()
+    return None
+
+
+def photo_key(item) -> Optional[str]:
+    """Ключ элемента photos в кэше: URL, иначе исходный file_id."""
+    if isinstance(item, dict):
+        return _clean(item.get("url")) or _clean(item.get("file_id"))
+    return _clean(item)
+
+
+def photo_candidates(item, cached: dict[str, str]) -> list[str]:
+    """
+    Чем можно отправить фото, по порядку: выданный Telegram file_id (из элемента или
+    Redis), исходный file_id, URL.
+    """
+    if isinstance(item, dict):
+        refs = [
+            _clean(item.get("tg_file_id")) or _clean(item.get("telegram_file_id")),
+            cached.get(photo_key(item) or ""),
+            _clean(item.get("file_id")),
+            _clean(item.get("url")),
+        ]
+    else:
+        refs = [cached.get(photo_key(item) or ""), _clean(item)]
+    return list(dict.fromkeys(ref for ref in refs if ref))
+
+
+def is_issued(item, ref: str, cached: dict[str, str]) -> bool:
+    """ref уже выдан Telegram для этого фото — записывать нечего."""
+    if isinstance(item, dict) and ref in (item.get("tg_file_id"), item.get("telegram_file_id")):
+        return True
+    return cached.get(photo_key(item) or "") == ref
+
+
+async def cached_file_ids(bouquet_id: str) -> dict[str, str]:
+    """{ключ фото: file_id} из Redis; при ошибке Redis — пусто."""
+    try:
+        return await get_redis().hgetall(_BOUQUET_KEY.format(bouquet_id)) or {}
+    except Exception as e:
+        logging.debug(f"media_delivery: redis hgetall failed: {e}")
+        return {}
+
+
+async def remember_file_ids(bouquet_id: str, issued: dict[str, str]) -> None:
+    """Записать выданные Telegram file_id в Redis и в bouquets.photos (tg_file_id)."""
+    if not issued:
+        return
+    key = _BOUQUET_KEY.format(bouquet_id)
+    try:
+        redis = get_redis()
+        await redis.hset(key, mapping=issued)
+        await redis.expire(key, config.TG_FILE_ID_CACHE_TTL)
+    except Exception as e:
+        logging.debug(f"media_delivery: redis hset failed: {e}")
+
+    def _merge(photos: list) -> Optional[list]:
+        changed = False
+        for i, item in enumerate(photos):
+            file_id = issued.get(photo_key(item) or "")
+            if not file_id and isinstance(item, dict):
+                # ключ мог смениться: пока фото показывали, upload_worker дописал url
+                file_id = issued.get(_clean(item.get("file_id")) or "")
+            if not file_id:
+                continue
+            if isinstance(item, dict):
+                if item.get("tg_file_id") != file_id:
+                    photos[i] = {**item, "tg_file_id": file_id}
+                    changed = True
+            else:
+                ref = _clean(item)
+                entry = {"url": ref} if ref.startswith("http") else {"file_id": ref}
+                photos[i] = {**entry, "tg_file_id": file_id}
+                changed = True
+        return photos if changed else None
+
+    try:
+        # upload_worker может одновременно дописывать URL в ту же строку
+        await merge_bouquet_photos(bouquet_id, _merge)
+    except Exception as e:
+        logging.error(f"media_delivery.remember_file_ids error: {e}", exc_info=True)
+
+
+def schedule_remember(bouquet_id: str, issued: dict[str, str]) -> Optional[asyncio.Task]:
+    """remember_file_ids в фоне — ответ пользователю не ждёт записи в БД."""
+    if not issued:
+        return None
+    task = asyncio.create_task(remember_file_ids(bouquet_id, issued))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+async def forget_bouquet(bouquet_id: str) -> None:
+    try:
+        await get_redis().delete(_BOUQUET_KEY.format(bouquet_id))
+    except Exception as e:
+        logging.debug(f"media_delivery: redis delete failed: {e}")
+
+
+def _photo_list(photos) -> list:
+    if not photos:
+        return []
+    return photos if isinstance(photos, list) else [photos]
+
+
+async def send_bouquet_photo(message: types.Message, bouquet_id: str, photos, **kwargs) -> Optional[types.Message]:
+    """
+    Ответить первым фото букета, которое удаётся отправить. Если Telegram отверг
+    ссылку (документ вместо фото, битый URL) — пробуем следующую. None — отправить
+    не удалось, вызывающий покажет карточку текстом.
+    """
+    items = [item for item in _photo_list(photos) if photo_key(item)]
+    if not items:
+        return None
+
+    cached = await cached_file_ids(bouquet_id)
+    for item in items:
+        for ref in photo_candidates(item, cached):
+            try:
+                sent = await message.answer_photo(photo=ref, **kwargs)
+            except TelegramBadRequest as e:
+                logging.info(f"send_bouquet_photo {bouquet_id}: Telegram отклонил ссылку: {e.message}")
+                continue
+            if sent.photo and not is_issued(item, ref, cached):
+                schedule_remember(bouquet_id, {photo_key(item): sent.photo[-1].file_id})
+            return sent
+    return None
+
+
+def _album_ref(candidates: list[str], item, cached: dict[str, str]) -> str:
+    """Для повторной попытки альбома: выданный Telegram file_id, иначе URL, иначе что есть."""
+    if is_issued(item, candidates[0], cached):
+        return candidates[0]
+    url = _clean(item.get("url")) if isinstance(item, dict) else None
+    return url or candidates[-1]
+
+
+async def send_bouquet_album(message: types.Message, bouquet_id: str, photos,
+                             limit: int = ALBUM_LIMIT) -> Optional[list[types.Message]]:
+    """
+    Все фото букета (до limit, не больше 10) одним send_media_group. Ссылки берутся как
+    в send_bouquet_photo; если Telegram отверг альбом (в нём оказался file_id документа),
+    он отправляется ещё раз по URL. Новые file_id сохраняются для следующих показов.
+    """
+    items = [item for item in _photo_list(photos) if photo_key(item)][:min(limit, ALBUM_LIMIT)]
+    if not items:
+        return None
+    if len(items) == 1:
+        # альбом — от 2 элементов
+        sent = await send_bouquet_photo(message, bouquet_id, items)
+        return [sent] if sent else None
+
+    cached = await cached_file_ids(bouquet_id)
+    candidates = [photo_candidates(item, cached) for item in items]
+    attempts = [[refs[0] for refs in candidates]]
+    fallback = [_album_ref(refs, item, cached) for refs, item in zip(candidates, items)]
+    if fallback != attempts[0]:
+        attempts.append(fallback)
+
+    for refs in attempts:
+        try:
+            sent = await message.answer_media_group(
+                media=[types.InputMediaPhoto(media=ref) for ref in refs]
+            )
+        except TelegramBadRequest as e:
+            logging.info(f"send_bouquet_album {bouquet_id}: Telegram отклонил альбом: {e.message}")
+            continue
+        issued = {
+            photo_key(item): msg.photo[-1].file_id
+            for item, ref, msg in zip(items, refs, sent)
+            if msg.photo and not is_issued(item, ref, cached)
+        }
+        schedule_remember(bouquet_id, issued)
+        return sent
+    return None
@@ -0,0 +1,337 @@
+# media_groups.py
+"""
+Сборка альбомов (media_group_id) из отдельных апдейтов.
+
+Telegram присылает элементы альбома отдельными сообщениями и не сообщает их число.
+Вместо фиксированной паузы альбом отдаётся обработчику, как только:
+  - MEDIA_GROUP_QUIET сек не пришло ни одного нового элемента;
+  - набрано expected элементов (сколько ещё влезает в лимит букета, не больше 10);
+  - прошло MEDIA_GROUP_MAX_WAIT сек с первого элемента.
+
+MediaGroupCollector держит альбомы в памяти процесса. RedisMediaGroupCollector
+(MEDIA_GROUP_BACKEND=redis) копит их в Redis, поэтому альбом собирается целиком, даже
+если его элементы разошлись по разным процессам/репликам бота: элементы добавляются
+атомарно Lua-скриптом, ждёт и отдаёт альбом один процесс — тот, кто первым занял
+ключ owner (SET NX). Ключи альбома живут не дольше MEDIA_GROUP_MAX_WAIT + минуту.
+
+Владелец держит альбом по lease (MEDIA_GROUP_MAX_WAIT + 5 сек). Если он умер после
+последнего элемента, следующего элемента, который выбрал бы нового владельца, уже не
+будет — такие альбомы подбирает sweep (start_sweeper): альбом с элементами, но без
+owner, забирает любой процесс и отдаёт flush, восстановленный фабрикой set_recovery
+из context первого элемента. Без фабрики или context альбом забирается и
+учитывается в метрике media_group.lost (с предупреждением в логе).
+"""
+import asyncio
+import json
+import logging
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Optional
+
+import config
+import metrics
+from cache import get_redis
+
+# больше элементов в альбоме Telegram не бывает
+MAX_ALBUM_SIZE = 10
+
+FlushCallback = Callable[[list[str]], Awaitable[None]]
+# context альбома (JSON-совместимый dict) -> flush для альбома, брошенного владельцем
+RecoveryFactory = Callable[[dict], Optional[FlushCallback]]
+
+
+class _Group:
+    __slots__ = ("items", "expected", "started", "wakeup", "flush")
+
+    def __init__(self, flush: FlushCallback, expected: int) -> None:
+        self.items: list[str] = []
+        self.expected = expected
+        self.started = time.monotonic()
+        self.wakeup = asyncio.Event()
+        self.flush = flush
+
+
+class MediaGroupCollector:
+    """Копит элементы альбомов по media_group_id и вызывает flush(items) один раз на альбом."""
+
+    def __init__(self, name: str, quiet: Optional[float] = None, max_wait: Optional[float] = None) -> None:
+        self.name = name
+        self.quiet = quiet
+        self.max_wait = max_wait
+        self._groups: dict[str, _Group] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    async def add(self, group_id: str, item: str, flush: FlushCallback, expected: Optional[int] = None,
+                  context: Optional[dict[str, Any]] = None) -> None:
+        """
+        Добавить элемент. flush берётся от первого элемента альбома; expected —
+        сколько элементов достаточно, чтобы не ждать тишины; context — из чего
+        set_recovery восстановит flush в другом процессе (нужен только Redis-сборщику).
+        """
+        group = self._groups.get(group_id)
+        if group is None:
+            group = _Group(flush, MAX_ALBUM_SIZE)
+            self._groups[group_id] = group
+            self._spawn(self._run(group_id, group), group_id)
+        if expected is not None:
+            group.expected = min(group.expected, max(1, expected))
+        group.items.append(item)
+        group.wakeup.set()
+
+    def pending(self) -> int:
+        return len(self._groups)
+
+    def set_recovery(self, factory: RecoveryFactory) -> None:
+        """Альбомы в памяти процесса не переживают его — восстанавливать нечего."""
+
+    def start_sweeper(self, interval: Optional[float] = None) -> None:
+        return None
+
+    async def stop_sweeper(self) -> None:
+        return None
+
+    async def _run(self, group_id: str, group: _Group) -> None:
+        quiet = self.quiet if self.quiet is not None else config.MEDIA_GROUP_QUIET
+        max_wait = self.max_wait if self.max_wait is not None else config.MEDIA_GROUP_MAX_WAIT
+        deadline = group.started + max_wait
+        reason = "max_wait"
+        try:
+            while True:
+                if len(group.items) >= group.expected:
+                    reason = "full"
+                    break
+                timeout = min(quiet, deadline - time.monotonic())
+                if timeout <= 0:
+                    break
+                group.wakeup.clear()
+                try:
+                    await asyncio.wait_for(group.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    if time.monotonic() < deadline:
+                        reason = "quiet"
+                        break
+        finally:
+            # элемент, пришедший после этой точки, начнёт новый альбом
+            self._groups.pop(group_id, None)
+
+        await self._flush(group_id, group.flush, list(group.items), reason, time.monotonic() - group.started)
+
+    def _spawn(self, coro, group_id: str) -> None:
+        task = asyncio.create_task(coro, name=f"{self.name}-{group_id}")
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush(self, group_id: str, flush: FlushCallback, items: list[str], reason: str, waited: float) -> None:
+        metrics.inc(f"media_group.flush.{reason}")
+        metrics.inc("media_group.wait.seconds", waited)
+        metrics.inc("media_group.wait.count")
+        try:
+            await flush(items)
+        except Exception as e:
+            logging.error(f"{self.name}: обработка альбома {group_id} упала: {e}", exc_info=True)
+
+
+# KEYS: items, meta, owner; ARGV: item, expected, ttl_ms, owner_token, lease_ms, context (JSON или '').
+# Возвращает {число элементов, 1 — вызывающий стал владельцем альбома}.
+_ADD_SCRIPT = """
+local n = redis.call('RPUSH', KEYS[1], ARGV[1])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+redis.call('HSETNX', KEYS[2], 'first', now)
+redis.call('HSET', KEYS[2], 'last', now)
+local expected = tonumber(ARGV[2])
+local current = tonumber(redis.call('HGET', KEYS[2], 'expected') or expected)
+if current < expected then expected = current end
+redis.call('HSET', KEYS[2], 'expected', expected)
+redis.call('PEXPIRE', KEYS[1], ARGV[3])
+redis.call('PEXPIRE', KEYS[2], ARGV[3])
+if ARGV[6] ~= '' then redis.call('HSETNX', KEYS[2], 'ctx', ARGV[6]) end
+local owner = redis.call('SET', KEYS[3], ARGV[4], 'NX', 'PX', ARGV[5])
+if owner then return {n, 1} end
+return {n, 0}
+"""
+
+# KEYS: items, meta, owner; ARGV: owner_token. Забрать альбом, если мы всё ещё владелец.
+_TAKE_SCRIPT = """
+if redis.call('GET', KEYS[3]) ~= ARGV[1] then return false end
+local items = redis.call('LRANGE', KEYS[1], 0, -1)
+redis.call('DEL', KEYS[1], KEYS[2], KEYS[3])
+return items
+"""
+
+# KEYS: items, meta, owner; ARGV: owner_token, lease_ms. Стать владельцем альбома,
+# чей владелец пропал (lease истёк), а элементы остались. Возвращает context или false.
+_CLAIM_SCRIPT = """
+if redis.call('EXISTS', KEYS[3]) == 1 or redis.call('LLEN', KEYS[1]) == 0 then return false end
+redis.call('SET', KEYS[3], ARGV[1], 'PX', ARGV[2])
+return redis.call('HGET', KEYS[2], 'ctx') or ''
+"""
+
+# KEYS: meta, items. Состояние альбома по часам Redis: {now, first, last, expected, count, есть ли meta}.
+_STATE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local meta = redis.call('HMGET', KEYS[1], 'first', 'last', 'expected')
+return {now, meta[1] or now, meta[2] or now, meta[3] or 0, redis.call('LLEN', KEYS[2]), redis.call('EXISTS', KEYS[1])}
+"""
+
+
+class RedisMediaGroupCollector(MediaGroupCollector):
+    """
+    Альбомы в Redis: общий для всех процессов бота. Если Redis недоступен, элемент
+    уходит в сборщик в памяти процесса (альбом может разделиться, но не потеряется).
+    """
+
+    def __init__(self, name: str, quiet: Optional[float] = None, max_wait: Optional[float] = None) -> None:
+        super().__init__(name, quiet, max_wait)
+        self._add_script = None
+        self._take_script = None
+        self._state_script = None
+        self._claim_script = None
+        self._recover: Optional[RecoveryFactory] = None
+        self._sweeper: Optional[asyncio.Task] = None
+
+    def _keys(self, group_id: str) -> list[str]:
+        # общий hash tag — ключи одного альбома в одном слоте Redis Cluster
+        base = f"mg:{self.name}:{{{group_id}}}"
+        return [f"{base}:items", f"{base}:meta", f"{base}:owner"]
+
+    def _scripts(self):
+        if self._add_script is None:
+            redis = get_redis()
+            self._add_script = redis.register_script(_ADD_SCRIPT)
+            self._take_script = redis.register_script(_TAKE_SCRIPT)
+            self._state_script = redis.register_script(_STATE_SCRIPT)
+            self._claim_script = redis.register_script(_CLAIM_SCRIPT)
+        return self._add_script, self._take_script, self._state_script
+
+    async def add(self, group_id: str, item: str, flush: FlushCallback, expected: Optional[int] = None,
+                  context: Optional[dict[str, Any]] = None) -> None:
+        max_wait = self.max_wait if self.max_wait is not None else config.MEDIA_GROUP_MAX_WAIT
+        # владелец, упавший посреди сборки, освобождает альбом через lease — следующий
+        # элемент выберет нового; сами элементы живут дольше, чтобы их было кому отдать
+        lease_ms = int((max_wait + 5) * 1000)
+        ttl_ms = int((max_wait + 60) * 1000)
+        token = uuid.uuid4().hex
+        expected = MAX_ALBUM_SIZE if expected is None else min(MAX_ALBUM_SIZE, max(1, expected))
+        try:
+            add_script, _, _ = self._scripts()
+            _, owner = await add_script(
+                keys=self._keys(group_id),
+                args=[item, expected, ttl_ms, token, lease_ms, json.dumps(context) if context else ""],
+            )
+        except Exception as e:
+            logging.warning(f"{self.name}: Redis недоступен, альбом {group_id} собирается локально: {e}")
+            await super().add(group_id, item, flush, expected)
+            return
+        if owner:
+            self._spawn(self._run_owner(group_id, token, flush), group_id)
+
+    async def _run_owner(self, group_id: str, token: str, flush: FlushCallback) -> None:
+        quiet = self.quiet if self.quiet is not None else config.MEDIA_GROUP_QUIET
+        max_wait = self.max_wait if self.max_wait is not None else config.MEDIA_GROUP_MAX_WAIT
+        # опрос чаще, чем quiet, иначе тишина затянется на лишний тик
+        tick = max(0.02, quiet / 4)
+        keys = self._keys(group_id)
+        _, take_script, state_script = self._scripts()
+        started = time.monotonic()
+        reason = "max_wait"
+        try:
+            while True:
+                now, first, last, expected, count, has_meta = map(int, await state_script(keys=keys[1::-1]))
+                if not has_meta:
+                    # meta истекла или её удалили — забираем, что есть, и не ждём дальше
+                    reason = "lost"
+                    break
+                if expected and count >= expected:
+                    reason = "full"
+                    break
+                # и по своим часам: max_wait не превышается, даже если first в Redis сдвинулся
+                if now - first >= max_wait * 1000 or time.monotonic() - started >= max_wait:
+                    break
+                if now - last >= quiet * 1000:
+                    reason = "quiet"
+                    break
+                await asyncio.sleep(tick)
+            items = await take_script(keys=keys, args=[token])
+        except Exception as e:
+            logging.error(f"{self.name}: сборка альбома {group_id} в Redis не удалась: {e}", exc_info=True)
+            return
+        if items is None:
+            logging.warning(f"{self.name}: альбом {group_id} забрал другой процесс (истёк owner)")
+            return
+        if not items:
+            logging.warning(f"{self.name}: альбом {group_id} истёк в Redis до сборки")
+            return
+        await self._flush(group_id, flush, list(items), reason, time.monotonic() - started)
+
+    def set_recovery(self, factory: RecoveryFactory) -> None:
+        self._recover = factory
+
+    async def sweep(self) -> int:
+        """Подобрать альбомы, брошенные умершим владельцем. Возвращает их число."""
+        max_wait = self.max_wait if self.max_wait is not None else config.MEDIA_GROUP_MAX_WAIT
+        lease_ms = int((max_wait + 5) * 1000)
+        _, take_script, _ = self._scripts()
+        redis = get_redis()
+        claimed = 0
+        async for items_key in redis.scan_iter(match=f"mg:{self.name}:*:items", count=500):
+            group_id = items_key[items_key.index("{") + 1:items_key.rindex("}")]
+            keys = self._keys(group_id)
+            token = uuid.uuid4().hex
+            context = await self._claim_script(keys=keys, args=[token, lease_ms])
+            if context is None:
+                continue
+            claimed += 1
+            flush = None
+            if context and self._recover is not None:
+                try:
+                    flush = self._recover(json.loads(context))
+                except Exception as e:
+                    logging.error(f"{self.name}: не удалось восстановить альбом {group_id}: {e}", exc_info=True)
+            if flush is None:
+                items = await take_script(keys=keys, args=[token]) or []
+                metrics.inc("media_group.lost")
+                logging.warning(f"{self.name}: альбом {group_id} брошен владельцем, {len(items)} элементов потеряно")
+                continue
+            metrics.inc("media_group.recovered")
+            logging.warning(f"{self.name}: альбом {group_id} брошен владельцем, отдаю его заново")
+            # max_wait с первого элемента уже прошёл — _run_owner заберёт альбом сразу
+            self._spawn(self._run_owner(group_id, token, flush), group_id)
+        return claimed
+
+    async def _sweep_loop(self, interval: float) -> None:
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                logging.warning(f"{self.name}: проверка брошенных альбомов не удалась: {e}")
+            await asyncio.sleep(interval)
+
+    def start_sweeper(self, interval: Optional[float] = None) -> None:
+        """
+        Периодический sweep. По умолчанию — раз в lease владельца: брошенный альбом
+        отдаётся задолго до того, как его ключи истекут (MEDIA_GROUP_MAX_WAIT + минута).
+        """
+        if self._sweeper is not None and not self._sweeper.done():
+            return
+        max_wait = self.max_wait if self.max_wait is not None else config.MEDIA_GROUP_MAX_WAIT
+        self._sweeper = asyncio.create_task(
+            self._sweep_loop(interval or max_wait + 5), name=f"{self.name}-sweeper"
+        )
+
+    async def stop_sweeper(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+
+
+def create_collector(name: str) -> MediaGroupCollector:
+    """Сборщик альбомов по MEDIA_GROUP_BACKEND (local | redis)."""
+    if config.MEDIA_GROUP_BACKEND == "redis":
+        return RedisMediaGroupCollector(name)
+    return MediaGroupCollector(name)
@@ -0,0 +1,177 @@
+# media_index.py
+"""
+Индекс загруженных медиа: file_unique_id -> sha256 -> ключ объекта / URL.
+Источник истины — таблицы media_aliases / media_objects, Redis — зеркало для быстрых проверок.
+
+Найденный объект возвращается словарём для элемента photos: {"url", "thumb_url"?, "webp_url"?}.
+Каждое попадание дедупликации обновляет media_objects.last_used_at: объект, только что
+выданный черновику, storage_gc не удалит, даже если букет ещё не сохранён.
+"""
+import json
+import logging
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+
+import config
+from cache import get_redis
+from database import get_db_session, MediaObject, MediaAlias
+
+_ALIAS_KEY = "media:fuid:{}"
+_OBJECT_KEY = "media:sha:{}"
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+async def _cache_get(key: str) -> Optional[str]:
+    try:
+        return await get_redis().get(key)
+    except Exception as e:
+        logging.debug(f"media_index: redis get failed: {e}")
+        return None
+
+
+async def _cache_set(key: str, value: str) -> None:
+    try:
+        await get_redis().set(key, value, ex=config.MEDIA_INDEX_CACHE_TTL)
+    except Exception as e:
+        logging.debug(f"media_index: redis set failed: {e}")
+
+
+def _as_entry(url: str, thumb_url: Optional[str], webp_url: Optional[str]) -> dict:
+    entry = {"url": url}
+    if thumb_url:
+        entry["thumb_url"] = thumb_url
+    if webp_url:
+        entry["webp_url"] = webp_url
+    return entry
+
+
+async def touch(sha256: str) -> bool:
+    """Отметить выдачу объекта. False — строки уже нет (удалил storage_gc) или БД недоступна."""
+    session = await get_db_session()
+    try:
+        res = await session.execute(
+            update(MediaObject).where(MediaObject.sha256 == sha256).values(last_used_at=_utcnow())
+        )
+        await session.commit()
+        return bool(res.rowcount)
+    except Exception as e:
+        await session.rollback()
+        logging.error(f"media_index.touch error: {e}", exc_info=True)
+        return False
+    finally:
+        await session.close()
+
+
+async def lookup_hash(sha256: str) -> Optional[dict]:
+    """
+    Объект с таким содержимым, если он уже загружен. Зеркало в Redis экономит только
+    чтение: выдача всегда отмечается в БД, и без строки в media_objects — промах.
+    """
+    cached = await _cache_get(_OBJECT_KEY.format(sha256))
+    if cached:
+        try:
+            entry = json.loads(cached)
+        except ValueError:
+            entry = None
+        if entry is not None:
+            return entry if await touch(sha256) else None
+
+    session = await get_db_session()
+    try:
+        row = (await session.execute(
+            select(MediaObject.url, MediaObject.thumb_url, MediaObject.webp_url)
+            .where(MediaObject.sha256 == sha256)
+        )).one_or_none()
+        if row:
+            await session.execute(
+                update(MediaObject).where(MediaObject.sha256 == sha256).values(last_used_at=_utcnow())
+            )
+            await session.commit()
+    except Exception as e:
+        await session.rollback()
+        logging.error(f"media_index.lookup_hash error: {e}", exc_info=True)
+        return None
+    finally:
+        await session.close()
+
+    if not row:
+        return None
+    entry = _as_entry(*row)
+    await _cache_set(_OBJECT_KEY.format(sha256), json.dumps(entry))
+    return entry
+
+
+async def lookup_unique_id(file_unique_id: Optional[str]) -> Optional[dict]:
+    """Объект по Telegram file_unique_id — без скачивания файла."""
+    if not file_unique_id:
+        return None
+
+    sha256 = await _cache_get(_ALIAS_KEY.format(file_unique_id))
+    if not sha256:
+        session = await get_db_session()
+        try:
+            res = await session.execute(
+                select(MediaAlias.sha256).where(MediaAlias.file_unique_id == file_unique_id)
+            )
+            sha256 = res.scalar_one_or_none()
+        except Exception as e:
+            logging.error(f"media_index.lookup_unique_id error: {e}", exc_info=True)
+            return None
+        finally:
+            await session.close()
+        if not sha256:
+            return None
+        await _cache_set(_ALIAS_KEY.format(file_unique_id), sha256)
+
+    return await lookup_hash(sha256)
+
+
+async def remember(file_unique_id: Optional[str], sha256: str, object_key: str, entry: dict,
+                   size: int | None = None, content_type: str | None = None) -> None:
+    """Записать новый объект (и алиас file_unique_id). Гонка двух одинаковых загрузок безопасна."""
+    session = await get_db_session()
+    try:
+        session.add(MediaObject(
+            sha256=sha256, object_key=object_key,
+            url=entry["url"], thumb_url=entry.get("thumb_url"), webp_url=entry.get("webp_url"),
+            size=size, content_type=content_type, last_used_at=_utcnow(),
+        ))
+        await session.commit()
+    except IntegrityError:
+        # тот же объект загрузили параллельно — он тоже только что использован
+        await session.rollback()
+        await touch(sha256)
+    except Exception as e:
+        await session.rollback()
+        logging.error(f"media_index.remember error: {e}", exc_info=True)
+        return
+    finally:
+        await session.close()
+
+    await _cache_set(_OBJECT_KEY.format(sha256), json.dumps(entry))
+    await remember_alias(file_unique_id, sha256)
+
+
+async def remember_alias(file_unique_id: Optional[str], sha256: str) -> None:
+    if not file_unique_id:
+        return
+    session = await get_db_session()
+    try:
+        session.add(MediaAlias(file_unique_id=file_unique_id, sha256=sha256))
+        await session.commit()
+    except IntegrityError:
+        await session.rollback()
+    except Exception as e:
+        await session.rollback()
+        logging.error(f"media_index.remember_alias error: {e}", exc_info=True)
+        return
+    finally:
+        await session.close()
+
+    await _cache_set(_ALIAS_KEY.format(file_unique_id), sha256)
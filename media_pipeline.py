@@ -0,0 +1,326 @@
+# media_pipeline.py
+import asyncio
+import hashlib
+import logging
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+from aiogram import Bot
+
+import config
+import draft_media
+import media_index
+import metrics
+from media_workers import run_in_image_pool
+from storage import (
+    media_storage, get_telegram_file, download_telegram_file, prepare_photo, content_object_name
+)
+from utils import make_derivatives, normalize_photo
+
+
+async def _with_retries(stage: str, label: str, retries: int, func, *args):
+    """
+    Вызвать корутину func(*args) с повторами.
+    Неудача = исключение или пустой результат. Между попытками — экспоненциальная задержка с джиттером.
+    """
+    for attempt in range(retries + 1):
+        try:
+            result = await func(*args)
+            if result:
+                return result
+            logging.warning(f"[{label}] {stage}: пустой результат (попытка {attempt + 1}/{retries + 1})")
+        except Exception as e:
+            logging.warning(f"[{label}] {stage}: {e} (попытка {attempt + 1}/{retries + 1})")
+
+        if attempt < retries:
+            delay = config.MEDIA_UPLOAD_BACKOFF * (2 ** attempt)
+            await asyncio.sleep(delay + random.uniform(0, delay / 2))
+    return None
+
+
+class PhotoUploadPipeline:
+    """
+    Конвейер загрузки фото: download -> convert -> upload.
+    Каждая стадия ограничена своим семафором, поэтому пока один файл
+    заливается в облако, следующий уже качается из Telegram.
+
+    Ключи объектов контентно-адресуемые (sha256), а media_index помнит
+    file_unique_id -> sha256 -> URL: уже загруженное фото не скачивается и не заливается повторно.
+
+    Результат — элемент для Bouquet.photos без file_id: {"url", "thumb_url"?, "webp_url"?}.
+    Превью и WebP (MEDIA_DERIVATIVES) считаются в пуле процессов и лежат рядом с оригиналом.
+    С MEDIA_NORMALIZE оригинал перед загрузкой тоже проходит через пул: поворот, без EXIF,
+    не больше MEDIA_MAX_EDGE, прогрессивный JPEG.
+    """
+
+    def __init__(self, bot: Bot, bouquet_id: str, concurrency: int | None = None, retries: int | None = None):
+        self.bot = bot
+        self.bouquet_id = bouquet_id
+        self.concurrency = concurrency or config.MEDIA_UPLOAD_CONCURRENCY
+        self.retries = config.MEDIA_UPLOAD_RETRIES if retries is None else retries
+        self._download_slots = asyncio.Semaphore(self.concurrency)
+        self._convert_slots = asyncio.Semaphore(self.concurrency)
+        self._upload_slots = asyncio.Semaphore(self.concurrency)
+
+    async def upload_one(self, file_id: str, index: int) -> Optional[dict]:
+        label = f"{self.bouquet_id}#{index}"
+
+        async with self._download_slots:
+            with metrics.timer("media.stage.get_file"):
+                file = await _with_retries("get_file", label, self.retries, get_telegram_file, self.bot, file_id)
+            if not file:
+                return None
+
+            with metrics.timer("media.stage.index_lookup"):
+                known = await media_index.lookup_unique_id(file.file_unique_id)
+            if known:
+                logging.info(f"[{label}] уже в хранилище (file_unique_id) -> {known}")
+                return known
+
+            with metrics.timer("media.stage.download"):
+                file_bytes = await _with_retries(
+                    "download", label, self.retries, download_telegram_file, self.bot, file.file_path
+                )
+        if not file_bytes:
+            return None
+
+        with metrics.timer("media.stage.hash"):
+            sha256 = await asyncio.to_thread(lambda: hashlib.sha256(file_bytes).hexdigest())
+            known = await media_index.lookup_hash(sha256)
+        if known:
+            await media_index.remember_alias(file.file_unique_id, sha256)
+            logging.info(f"[{label}] уже в хранилище (sha256) -> {known}")
+            return known
+
+        async with self._convert_slots, metrics.timer("media.stage.convert"):
+            try:
+                prepared = await prepare_photo(file_bytes, file.file_path)
+            except Exception as e:
+                logging.error(f"[{label}] convert: {e}", exc_info=True)
+                return None
+        if not prepared:
+            return None
+        data, ext, mime = prepared
+        if config.MEDIA_NORMALIZE:
+            data, ext, mime = await self._normalize(label, data, ext, mime)
+
+        object_name = content_object_name(sha256, ext)
+        async with self._upload_slots, metrics.timer("media.stage.upload"):
+            url = await _with_retries(
+                "upload", label, self.retries,
+                media_storage.upload_from_memory, data, object_name, mime,
+            )
+        if not url:
+            return None
+
+        entry = {"url": url}
+        if config.MEDIA_DERIVATIVES:
+            entry.update(await self._derivatives(label, sha256, data))
+        with metrics.timer("media.stage.index_write"):
+            await media_index.remember(file.file_unique_id, sha256, object_name, entry, len(data), mime)
+        return entry
+
+    async def _normalize(self, label: str, data: bytes, ext: str, mime: str) -> tuple[bytes, str, str]:
+        """EXIF-поворот, без метаданных, MEDIA_MAX_EDGE, прогрессивный JPEG. При ошибке или если файл не уменьшился — оригинал."""
+        async with self._convert_slots, metrics.timer("media.stage.normalize"):
+            try:
+                normalized = await run_in_image_pool(
+                    normalize_photo, data, config.MEDIA_MAX_EDGE, config.MEDIA_JPEG_QUALITY
+                )
+            except Exception as e:
+                logging.error(f"[{label}] normalize: {e}")
+                metrics.inc("media.normalize.errors")
+                return data, ext, mime
+
+        if len(normalized) >= len(data):
+            # перекодирование не уменьшило файл — грузим оригинал, экономию не считаем
+            normalized = data
+            metrics.inc("media.normalize.kept_original")
+        saved = len(data) - len(normalized)
+        metrics.inc("media.normalize.count")
+        metrics.inc("media.normalize.bytes_in", len(data))
+        metrics.inc("media.normalize.bytes_out", len(normalized))
+        total = metrics.inc("media.normalize.bytes_saved", saved)
+        logging.info(
+            f"[{label}] normalize: {len(data) / 1024:.0f} KB -> {len(normalized) / 1024:.0f} KB "
+            f"(сэкономлено {saved / 1024:.0f} KB, всего {total / 1024 ** 2:.1f} MB)"
+        )
+        if normalized is data:
+            return data, ext, mime
+        return normalized, ".jpg", "image/jpeg"
+
+
+    async def _derivatives(self, label: str, sha256: str, data: bytes) -> dict:
+        """Превью + WebP. Ошибка здесь не мешает сохранить оригинал."""
+        async with self._convert_slots, metrics.timer("media.stage.derivatives"):
+            try:
+                thumb, webp = await run_in_image_pool(
+                    make_derivatives, data, config.THUMB_MAX_EDGE, config.WEBP_MAX_EDGE, config.WEBP_QUALITY
+                )
+            except Exception as e:
+                logging.error(f"[{label}] derivatives: {e}")
+                return {}
+
+        async with self._upload_slots, metrics.timer("media.stage.derivatives_upload"):
+            thumb_url, webp_url = await asyncio.gather(
+                _with_retries("upload thumb", label, self.retries, media_storage.upload_from_memory,
+                              thumb, content_object_name(sha256, ".thumb.jpg"), "image/jpeg"),
+                _with_retries("upload webp", label, self.retries, media_storage.upload_from_memory,
+                              webp, content_object_name(sha256, ".opt.webp"), "image/webp"),
+            )
+        result = {}
+        if thumb_url:
+            result["thumb_url"] = thumb_url
+        if webp_url:
+            result["webp_url"] = webp_url
+        return result
+
+    async def upload_all(self, file_ids: list[str]) -> list[Optional[dict]]:
+        """Результат для каждого file_id в том же порядке (None — если файл так и не загрузился)."""
+        results = await asyncio.gather(
+            *(self.upload_one(fid, index) for index, fid in enumerate(file_ids)),
+            return_exceptions=True,
+        )
+        uploaded = []
+        for index, res in enumerate(results):
+            if isinstance(res, BaseException):
+                logging.error(f"[{self.bouquet_id}#{index}] ошибка загрузки фото: {res}")
+                uploaded.append(None)
+            else:
+                uploaded.append(res)
+        return uploaded
+
+
+async def upload_photos(bot: Bot, file_ids: list[str], bouquet_id: str) -> list[Optional[dict]]:
+    return await PhotoUploadPipeline(bot, bouquet_id).upload_all(file_ids)
+
+
+# ---------- Фоновая загрузка фото черновика ----------
+
+UPLOAD_PENDING = "pending"
+UPLOAD_DONE = "done"
+UPLOAD_FAILED = "failed"
+
+
+@dataclass
+class DraftUpload:
+    index: int
+    status: str = UPLOAD_PENDING
+    result: Optional[dict] = None
+    task: Optional[asyncio.Task] = None
+
+
+@dataclass
+class _Draft:
+    pipeline: PhotoUploadPipeline
+    entries: dict[str, DraftUpload] = field(default_factory=dict)
+    touched: float = field(default_factory=time.monotonic)
+
+
+class DraftUploads:
+    """
+    Фото черновика начинают грузиться в облако сразу, как только попали в FSM.
+    Статус каждого файла (pending/done/failed) хранится здесь, по номеру букета;
+    при сохранении ждём только то, что ещё в полёте, а упавшее/потерянное догружаем.
+    """
+
+    def __init__(self, ttl: float = 6 * 3600):
+        self.ttl = ttl
+        self._drafts: dict[str, _Draft] = {}
+
+    def start(self, bot: Bot, bouquet_id: str, file_id: str, index: int) -> None:
+        self._prune()
+        draft = self._drafts.get(bouquet_id)
+        if draft is None:
+            draft = self._drafts[bouquet_id] = _Draft(PhotoUploadPipeline(bot, bouquet_id))
+        draft.touched = time.monotonic()
+        if file_id in draft.entries:
+            return
+
+        entry = DraftUpload(index=index)
+        entry.task = asyncio.create_task(self._run(draft.pipeline, entry, file_id))
+        draft.entries[file_id] = entry
+
+    async def _run(self, pipeline: PhotoUploadPipeline, entry: DraftUpload, file_id: str) -> Optional[dict]:
+        try:
+            entry.result = await pipeline.upload_one(file_id, entry.index)
+        except Exception as e:
+            logging.error(f"[{pipeline.bouquet_id}#{entry.index}] фоновая загрузка: {e}", exc_info=True)
+            entry.result = None
+        entry.status = UPLOAD_DONE if entry.result else UPLOAD_FAILED
+        if entry.result:
+            # пока букет не сохранён, объект держит только эта запись (см. storage_gc)
+            await draft_media.remember_uploaded(pipeline.bouquet_id, entry.result["url"])
+        return entry.result
+
+    def status(self, bouquet_id: str, file_id: str) -> Optional[str]:
+        draft = self._drafts.get(bouquet_id)
+        entry = draft.entries.get(file_id) if draft else None
+        return entry.status if entry else None
+
+    def counts(self, bouquet_id: str) -> dict[str, int]:
+        draft = self._drafts.get(bouquet_id)
+        result = {UPLOAD_PENDING: 0, UPLOAD_DONE: 0, UPLOAD_FAILED: 0}
+        for entry in (draft.entries.values() if draft else ()):
+            result[entry.status] += 1
+        return result
+
+    async def collect(self, bot: Bot, bouquet_id: str, file_ids: list[str],
+                      wait: Optional[float] = None, reupload: bool = True) -> list[Optional[dict]]:
+        """
+        Результаты загрузки для file_ids в исходном порядке.
+        pending — дожидаемся (не дольше wait секунд, если задано);
+        failed или неизвестные (например, после рестарта) — грузим сейчас, если reupload.
+        """
+        draft = self._drafts.get(bouquet_id)
+        entries = draft.entries if draft else {}
+
+        pending = [
+            entries[fid].task for fid in file_ids
+            if fid in entries and entries[fid].status == UPLOAD_PENDING and entries[fid].task
+        ]
+        if pending:
+            # asyncio.wait не отменяет незавершённое по таймауту — загрузки продолжаются в фоне
+            await asyncio.wait(pending, timeout=wait)
+
+        uploaded: list[Optional[dict]] = []
+        retry: list[tuple[int, str]] = []
+        for pos, fid in enumerate(file_ids):
+            entry = entries.get(fid)
+            if entry and entry.status == UPLOAD_DONE:
+                uploaded.append(entry.result)
+            else:
+                uploaded.append(None)
+                retry.append((pos, fid))
+
+        if retry and reupload:
+            pipeline = draft.pipeline if draft else PhotoUploadPipeline(bot, bouquet_id)
+            results = await asyncio.gather(
+                *(pipeline.upload_one(fid, pos) for pos, fid in retry),
+                return_exceptions=True,
+            )
+            for (pos, _), res in zip(retry, results):
+                uploaded[pos] = None if isinstance(res, BaseException) else res
+                if uploaded[pos]:
+                    await draft_media.remember_uploaded(bouquet_id, uploaded[pos]["url"])
+        return uploaded
+
+    def discard(self, bouquet_id: str, cancel: bool = True) -> None:
+        """Забыть черновик. cancel=False — незавершённые загрузки доработают (и попадут в индекс медиа)."""
+        draft = self._drafts.pop(bouquet_id, None)
+        if not draft or not cancel:
+            return
+        for entry in draft.entries.values():
+            if entry.task and not entry.task.done():
+                entry.task.cancel()
+
+    def _prune(self) -> None:
+        now = time.monotonic()
+        for bouquet_id in [b for b, d in self._drafts.items() if now - d.touched > self.ttl]:
+            self.discard(bouquet_id)
+
+
+# Общий реестр фоновых загрузок процесса
+draft_uploads = DraftUploads()
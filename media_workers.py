@@ -0,0 +1,79 @@
+# media_workers.py
+"""
+Отдельный пул процессов для CPU-тяжёлой обработки изображений (HEIC, Pillow).
+Event loop только ставит задачи в очередь и ждёт результат, не блокируя остальные чаты.
+"""
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+import config
+import metrics
+
+QUEUE_DEPTH_METRIC = "image_pool.queue_depth"
+
+_pool: Optional[ProcessPoolExecutor] = None
+_slots: Optional[asyncio.Semaphore] = None
+_depth = 0
+
+
+def get_image_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: не форкаем процесс с живыми потоками (executor'ы, драйверы БД)
+        _pool = ProcessPoolExecutor(
+            max_workers=config.IMAGE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        logging.info(f"Image process pool started: {config.IMAGE_WORKERS} workers")
+    return _pool
+
+
+def image_queue_depth() -> int:
+    """Сколько задач сейчас ждут или выполняются в пуле."""
+    return _depth
+
+
+async def run_in_image_pool(func, *args):
+    """
+    Выполнить func(*args) в пуле процессов. func и аргументы должны быть picklable.
+    Очередь ограничена IMAGE_QUEUE_LIMIT: сверх лимита вызывающие ждут, а не копят байты в памяти.
+    """
+    global _slots, _depth
+    if _slots is None:
+        _slots = asyncio.Semaphore(config.IMAGE_QUEUE_LIMIT)
+
+    _depth += 1
+    metrics.set_gauge(QUEUE_DEPTH_METRIC, _depth)
+    try:
+        async with _slots:
+            loop = asyncio.get_running_loop()
+            pool = get_image_pool()
+            try:
+                return await loop.run_in_executor(pool, func, *args)
+            except BrokenProcessPool:
+                # воркер упал (например, декодер на битом файле) — следующий вызов поднимет новый пул
+                metrics.inc("image_pool.crashes")
+                _discard_pool(pool)
+                raise
+    finally:
+        _depth -= 1
+        metrics.set_gauge(QUEUE_DEPTH_METRIC, _depth)
+
+
+def _discard_pool(pool: ProcessPoolExecutor) -> None:
+    global _pool
+    if _pool is pool:
+        logging.error("Image process pool is broken, it will be restarted")
+        _pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_image_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
@@ -0,0 +1,65 @@
+# metrics.py
+"""Простые счётчики и gauge'и процесса (для логов и health-проверок)."""
+import time
+import logging
+import threading
+from collections import defaultdict
+
+_lock = threading.Lock()
+_counters: dict[str, float] = defaultdict(float)
+_gauges: dict[str, float] = {}
+
+
+def inc(name: str, value: float = 1) -> float:
+    with _lock:
+        _counters[name] += value
+        return _counters[name]
+
+
+def set_gauge(name: str, value: float) -> None:
+    with _lock:
+        _gauges[name] = value
+
+
+class timer:
+    """
+    Накопить длительность блока в {name}.seconds и число вызовов в {name}.count.
+    Работает и как with, и как async with (можно ставить рядом с семафором).
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = 0.0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        inc(f"{self.name}.seconds", time.perf_counter() - self.started)
+        inc(f"{self.name}.count")
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, *exc):
+        return self.__exit__(*exc)
+
+
+def get(name: str, default: float = 0) -> float:
+    with _lock:
+        if name in _gauges:
+            return _gauges[name]
+        return _counters.get(name, default)
+
+
+def snapshot() -> dict[str, float]:
+    with _lock:
+        return {**_counters, **_gauges}
+
+
+def log_snapshot() -> None:
+    data = snapshot()
+    if data:
+        logging.info("metrics: " + ", ".join(f"{k}={v:g}" for k, v in sorted(data.items())))
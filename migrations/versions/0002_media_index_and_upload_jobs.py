@@ -0,0 +1,59 @@
+"""media index (media_objects, media_aliases) and upload_jobs queue
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 10:00:01
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "media_objects",
+        sa.Column("sha256", sa.String(length=64), primary_key=True),
+        sa.Column("object_key", sa.String(), nullable=False),
+        sa.Column("url", sa.String(), nullable=False),
+        sa.Column("thumb_url", sa.String(), nullable=True),
+        sa.Column("webp_url", sa.String(), nullable=True),
+        sa.Column("size", sa.Integer(), nullable=True),
+        sa.Column("content_type", sa.String(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+    )
+    op.create_table(
+        "media_aliases",
+        sa.Column("file_unique_id", sa.String(), primary_key=True),
+        sa.Column("sha256", sa.String(length=64), sa.ForeignKey("media_objects.sha256"), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+    )
+    op.create_table(
+        "upload_jobs",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("bouquet_id", sa.String(), nullable=False),
+        sa.Column("kind", sa.String(length=16), nullable=False),
+        sa.Column("file_id", sa.String(), nullable=False),
+        sa.Column("status", sa.String(length=16), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("last_error", sa.Text(), nullable=True),
+        sa.Column("next_attempt_at", sa.DateTime(), nullable=True),
+        sa.Column("locked_at", sa.DateTime(), nullable=True),
+        sa.Column("locked_by", sa.String(length=32), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_upload_jobs_bouquet_id", "upload_jobs", ["bouquet_id"])
+    op.create_index("ix_upload_jobs_status", "upload_jobs", ["status"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_upload_jobs_status", table_name="upload_jobs")
+    op.drop_index("ix_upload_jobs_bouquet_id", table_name="upload_jobs")
+    op.drop_table("upload_jobs")
+    op.drop_table("media_aliases")
+    op.drop_table("media_objects")
@@ -0,0 +1,27 @@
+"""composite indexes for the bouquet list and the product picker
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 10:00:02
+
+- bouquets (user_id, created_at, id): список «📚 Мои букеты» — фильтр по владельцу,
+  keyset-пагинация по (created_at, id) в обе стороны, COUNT по user_id;
+- products (category_id, name): show_product_page — товары категории по алфавиту.
+"""
+from alembic import op
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index("ix_bouquets_user_created", "bouquets", ["user_id", "created_at", "id"], if_not_exists=True)
+    op.create_index("ix_products_category_name", "products", ["category_id", "name"], if_not_exists=True)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_products_category_name", table_name="products")
+    op.drop_index("ix_bouquets_user_created", table_name="bouquets")
@@ -0,0 +1,46 @@
+"""bouquet number counter and draft reservations
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 10:00:03
+
+Счётчик стартует с наибольшего числового bouquet_id (не меньше 200 — с этого
+номера нумерация шла и раньше).
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+FIRST_NUMBER = 200
+
+
+def upgrade() -> None:
+    counters = op.create_table(
+        "id_counters",
+        sa.Column("name", sa.String(length=32), primary_key=True),
+        sa.Column("value", sa.Integer(), nullable=False),
+    )
+    op.create_table(
+        "bouquet_number_reservations",
+        sa.Column("number", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("reserved_at", sa.DateTime(), nullable=False),
+    )
+    op.create_index(
+        "ix_bouquet_number_reservations_reserved_at", "bouquet_number_reservations", ["reserved_at"]
+    )
+
+    ids = op.get_bind().execute(sa.text("SELECT bouquet_id FROM bouquets")).scalars()
+    last = max([int(i) for i in ids if i and i.isdigit()] + [FIRST_NUMBER])
+    op.bulk_insert(counters, [{"name": "bouquet", "value": last}])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_bouquet_number_reservations_reserved_at", table_name="bouquet_number_reservations")
+    op.drop_table("bouquet_number_reservations")
+    op.drop_table("id_counters")
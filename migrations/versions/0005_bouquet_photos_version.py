@@ -0,0 +1,27 @@
+"""bouquets.photos_version for conflict-checked photos updates
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17 12:00:00
+
+Каждая запись bouquets.photos (URL от upload_worker, tg_file_id от бота) увеличивает
+версию; запись со старой версией не применяется и повторяется на свежих данных.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("bouquets") as batch:
+        batch.add_column(sa.Column("photos_version", sa.Integer(), nullable=False, server_default="0"))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("bouquets") as batch:
+        batch.drop_column("photos_version")
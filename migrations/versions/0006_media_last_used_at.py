@@ -0,0 +1,27 @@
+"""media_objects.last_used_at for storage GC liveness
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17 12:00:01
+
+Существующим объектам last_used_at = created_at: их возраст для GC не меняется.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("media_objects") as batch:
+        batch.add_column(sa.Column("last_used_at", sa.DateTime(), nullable=True))
+    op.execute("UPDATE media_objects SET last_used_at = created_at")
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("media_objects") as batch:
+        batch.drop_column("last_used_at")
@@ -14,8 +14,15 @@ from aiogram.fsm.context import FSMContext
 from dotenv import load_dotenv
 
 # Импортируем наши модули
-from database import init_db, get_db_session, get_or_create_user
+from database import init_db
 from handlers import setup_handlers
+from handlers.common import abandon_draft
+from handlers.media_processing import setup_album_recovery, stop_album_recovery
+from storage import media_storage
+from cache import close_redis
+from user_cache import UserMiddleware, CachedUser, resolve as resolve_user
+from db_session import DbSessionMiddleware
+from media_workers import shutdown_image_pool
 
 # Настройка логирования
 logging.basicConfig(
@@ -62,6 +69,10 @@ async def create_bot():
 
         # Добавляем middleware для логирования FSM
         dp.update.outer_middleware(FSMLoggingMiddleware())
+        # пользователь из кэша — обработчики получают его как user
+        dp.update.outer_middleware(UserMiddleware())
+        # одна сессия БД (и один commit) на апдейт — обработчики получают её как session
+        dp.update.outer_middleware(DbSessionMiddleware())
 
         # Регистрация основных обработчиков команд (В ПЕРВУЮ ОЧЕРЕДЬ!)
         dp.message.register(cmd_start, Command("start"))
@@ -70,6 +81,8 @@ async def create_bot():
 
         # Регистрация обработчиков (ВО ВТОРУЮ ОЧЕРЕДЬ!)
         setup_handlers(dp)
+        # альбомы, брошенные упавшей репликой (MEDIA_GROUP_BACKEND=redis)
+        setup_album_recovery(bot, storage)
 
         logger.info("Бот успешно создан и настроен")
         return True
@@ -78,15 +91,15 @@ async def create_bot():
         return False
 
 
-async def cmd_start(message: types.Message, state: FSMContext):
+async def cmd_start(message: types.Message, state: FSMContext, user: CachedUser | None = None):
     """Обработчик команды /start"""
     try:
-        # Очищаем состояние при старте
-        await state.clear()
+        # Очищаем состояние при старте (незаконченный черновик букета бросаем)
+        await abandon_draft(state)
 
-        session = await get_db_session()
         try:
-            user = await get_or_create_user(session, message.from_user.id)
+            # новый пользователь создаётся здесь, если UserMiddleware не смог
+            user = user or await resolve_user(message.from_user.id)
 
             # Создаем клавиатуру главного меню
             builder = ReplyKeyboardBuilder()
@@ -103,8 +116,6 @@ async def cmd_start(message: types.Message, state: FSMContext):
         except Exception as e:
             logger.error(f"Ошибка в cmd_start (работа с БД): {e}")
             await message.answer("Произошла ошибка при инициализации. Попробуйте еще раз.")
-        finally:
-            await session.close()
     except Exception as e:
         logger.error(f"Ошибка в cmd_start: {e}")
         await message.answer("Произошла внутренняя ошибка. Попробуйте позже.")
@@ -113,8 +124,8 @@ async def cmd_start(message: types.Message, state: FSMContext):
 async def cmd_help(message: types.Message, state: FSMContext):
     """Обработчик команды /help"""
     try:
-        # Очищаем состояние при запросе помощи
-        await state.clear()
+        # Очищаем состояние при запросе помощи (незаконченный черновик букета бросаем)
+        await abandon_draft(state)
 
         help_text = (
             "🤖 <b>Помощь по боту</b>\n\n"
@@ -140,6 +151,11 @@ async def shutdown():
     logger.info("Завершение работы бота...")
     if bot:
         await bot.session.close()
+    await stop_album_recovery()
+    await media_storage.stop_health_probe()
+    await media_storage.close()
+    await close_redis()
+    shutdown_image_pool()
     logger.info("Бот остановлен")
 
 
@@ -170,6 +186,16 @@ async def main():
             await init_db()
             logger.info("База данных инициализирована")
 
+            # Хранилище медиа: прогреваем клиент до старта polling (вне event loop),
+            # дальше фоновая проверка держит готовность в media_storage.health()
+            if await media_storage.ensure_ready():
+                logger.info(f"Хранилище медиа ({media_storage.name}) готово")
+            else:
+                logger.warning("Хранилище медиа недоступно, фото догрузит upload_worker")
+            media_storage.start_health_probe()
+            # раздачу файлов (локальный бэкенд) поднимает только бот, не воркеры и скрипты
+            await media_storage.serve_files()
+
             # Соединение с Redis
             try:
                 import redis
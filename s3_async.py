@@ -0,0 +1,292 @@
+# s3_async.py
+import io
+import os
+import base64
+import hashlib
+import hmac
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Optional, BinaryIO, AsyncIterator
+from urllib.parse import quote, urlsplit
+from xml.etree import ElementTree
+
+import aiohttp
+from yarl import URL
+
+import config
+from storage_base import StorageBackend
+
+
+def _quote(value: str, safe: str = "-_.~") -> str:
+    return quote(value, safe=safe)
+
+
+def _sha256_hex(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _hmac(key: bytes, msg: str) -> bytes:
+    return hmac.new(key, msg.encode("utf-8"), hashlib.sha256).digest()
+
+
+class S3Error(Exception):
+    def __init__(self, status: int, body: str):
+        super().__init__(f"S3 responded {status}: {body[:300]}")
+        self.status = status
+
+
+class AsyncS3Storage(StorageBackend):
+    """
+    Asyncio-native S3 client for Yandex Object Storage.
+    Signs requests with SigV4 itself and sends them over one pooled aiohttp
+    connector (keep-alive), so no executor threads are involved.
+    Exposes the same API as storage.YandexObjectStorage.
+    """
+    name = "s3-aiohttp"
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.access_key_id = os.getenv("YC_ACCESS_KEY_ID")
+        self.secret_access_key = os.getenv("YC_SECRET_ACCESS_KEY")
+        self.bucket_name = os.getenv("YC_BUCKET_NAME")
+        self.endpoint_url = (os.getenv("YC_ENDPOINT_URL") or "").rstrip("/")
+        self.region = config.YC_REGION
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    # ---------- low level ----------
+
+    def is_configured(self) -> bool:
+        return all([self.access_key_id, self.secret_access_key, self.bucket_name, self.endpoint_url])
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=config.S3_POOL_SIZE,
+                keepalive_timeout=config.S3_KEEPALIVE_TIMEOUT,
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    def _object_path(self, object_name: str = "") -> str:
+        path = f"/{self.bucket_name}"
+        if object_name:
+            path += "/" + _quote(object_name, safe="/-_.~")
+        return urlsplit(self.endpoint_url).path.rstrip("/") + path
+
+    def _sign(self, method: str, path: str, query: dict, headers: dict, payload_hash: str) -> dict:
+        now = datetime.now(timezone.utc)
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        datestamp = now.strftime("%Y%m%d")
+
+        signed = {k.lower(): str(v).strip() for k, v in headers.items()}
+        signed["host"] = urlsplit(self.endpoint_url).netloc
+        signed["x-amz-date"] = amz_date
+        signed["x-amz-content-sha256"] = payload_hash
+
+        header_names = sorted(signed)
+        canonical_headers = "".join(f"{name}:{signed[name]}\n" for name in header_names)
+        signed_headers = ";".join(header_names)
+        canonical_query = "&".join(f"{_quote(k)}={_quote(str(v))}" for k, v in sorted(query.items()))
+        canonical_request = "\n".join(
+            [method, path, canonical_query, canonical_headers, signed_headers, payload_hash]
+        )
+
+        scope = f"{datestamp}/{self.region}/s3/aws4_request"
+        string_to_sign = "\n".join(
+            ["AWS4-HMAC-SHA256", amz_date, scope, _sha256_hex(canonical_request.encode("utf-8"))]
+        )
+        key = _hmac(("AWS4" + self.secret_access_key).encode("utf-8"), datestamp)
+        for part in (self.region, "s3", "aws4_request"):
+            key = _hmac(key, part)
+        signature = hmac.new(key, string_to_sign.encode("utf-8"), hashlib.sha256).hexdigest()
+
+        signed["authorization"] = (
+            f"AWS4-HMAC-SHA256 Credential={self.access_key_id}/{scope}, "
+            f"SignedHeaders={signed_headers}, Signature={signature}"
+        )
+        return signed
+
+    async def _request(self, method: str, object_name: str = "", query: dict | None = None,
+                       headers: dict | None = None, body: bytes = b"") -> tuple[int, dict, bytes]:
+        query = query or {}
+        path = self._object_path(object_name)
+        signed = self._sign(method, path, query, headers or {}, _sha256_hex(body))
+
+        url = urlsplit(self.endpoint_url)
+        target = f"{url.scheme}://{url.netloc}{path}"
+        if query:
+            target += "?" + "&".join(f"{_quote(k)}={_quote(str(v))}" for k, v in sorted(query.items()))
+
+        async with self._get_session().request(method, URL(target, encoded=True), headers=signed, data=body) as resp:
+            payload = await resp.read()
+            if resp.status >= 300:
+                raise S3Error(resp.status, payload.decode("utf-8", "replace"))
+            return resp.status, dict(resp.headers), payload
+
+    # ---------- public API ----------
+
+    def public_url(self, object_name: str) -> str:
+        return f"{self.endpoint_url}/{self.bucket_name}/{object_name}".rstrip("/")
+
+    async def initialize(self) -> bool:
+        """Probe the bucket once (HEAD)."""
+        if not self.is_configured():
+            logging.warning("YC storage credentials are not fully configured.")
+            return False
+        try:
+            await self._request("HEAD")
+            self.initialized = True
+            logging.info("Yandex Object Storage (aiohttp) client initialized.")
+            return True
+        except S3Error as e:
+            if e.status == 404:
+                logging.error(f"Bucket {self.bucket_name} not found")
+            elif e.status == 403:
+                logging.error("Access to bucket denied. Check credentials/permissions.")
+            else:
+                logging.error(f"S3 client error during init: {e}")
+            return False
+        except Exception as e:
+            logging.error(f"Unexpected error initializing storage: {e}")
+            return False
+
+    async def probe(self) -> bool:
+        await self._request("HEAD")
+        return True
+
+    async def upload_from_memory(self, file_content: bytes, object_name: str, content_type: str = "application/octet-stream") -> Optional[str]:
+        """Upload bytes to object storage and return public URL."""
+        try:
+            if not await self.ensure_ready():
+                return None
+            if not file_content:
+                logging.error("upload_from_memory: empty content")
+                return None
+
+            await self._request(
+                "PUT", object_name,
+                headers={"content-type": content_type, "x-amz-acl": "public-read"},
+                body=file_content,
+            )
+            return self.public_url(object_name)
+        except Exception as e:
+            logging.error(f"upload_from_memory failed: {e}")
+            return None
+
+    async def upload_stream(self, file_obj: BinaryIO, object_name: str, content_type: str = "application/octet-stream",
+                            part_size: int | None = None) -> Optional[str]:
+        """Multipart upload of a seekable file object, one part in memory at a time."""
+        part_size = max(part_size or config.MEDIA_STREAM_CHUNK_SIZE, config.MIN_MULTIPART_PART_SIZE)
+        loop = asyncio.get_running_loop()
+        upload_id = None
+        try:
+            if not await self.ensure_ready():
+                return None
+
+            file_obj.seek(0, io.SEEK_END)
+            size = file_obj.tell()
+            file_obj.seek(0)
+            if not size:
+                logging.error("upload_stream: empty content")
+                return None
+
+            if size <= part_size:
+                body = await loop.run_in_executor(None, file_obj.read)
+                return await self.upload_from_memory(body, object_name, content_type)
+
+            _, _, payload = await self._request(
+                "POST", object_name, query={"uploads": ""},
+                headers={"content-type": content_type, "x-amz-acl": "public-read"},
+            )
+            upload_id = ElementTree.fromstring(payload).findtext("{*}UploadId")
+
+            parts = []
+            while True:
+                chunk = await loop.run_in_executor(None, file_obj.read, part_size)
+                if not chunk:
+                    break
+                number = len(parts) + 1
+                _, headers, _ = await self._request(
+                    "PUT", object_name, query={"partNumber": number, "uploadId": upload_id}, body=chunk,
+                )
+                parts.append((number, headers.get("ETag", "")))
+
+            complete = "<CompleteMultipartUpload>" + "".join(
+                f"<Part><PartNumber>{n}</PartNumber><ETag>{etag}</ETag></Part>" for n, etag in parts
+            ) + "</CompleteMultipartUpload>"
+            await self._request("POST", object_name, query={"uploadId": upload_id}, body=complete.encode("utf-8"))
+            return self.public_url(object_name)
+        except Exception as e:
+            logging.error(f"upload_stream failed: {e}")
+            if upload_id:
+                try:
+                    await self._request("DELETE", object_name, query={"uploadId": upload_id})
+                except Exception as abort_err:
+                    logging.error(f"abort multipart upload failed: {abort_err}")
+            return None
+
+    async def delete_object(self, object_name: str) -> bool:
+        try:
+            if not await self.ensure_ready():
+                return False
+            await self._request("DELETE", object_name)
+            return True
+        except Exception as e:
+            logging.error(f"delete_object failed: {e}")
+            return False
+
+    async def iter_object_pages(self, prefix: str = "") -> AsyncIterator[list[dict]]:
+        """Yield the listing page by page (<= 1000 objects: Key, Size, LastModified)."""
+        if not await self.ensure_ready():
+            raise RuntimeError("object storage is not available")
+        token = None
+        while True:
+            query = {"list-type": "2", "prefix": prefix}
+            if token:
+                query["continuation-token"] = token
+            _, _, payload = await self._request("GET", query=query)
+            root = ElementTree.fromstring(payload)
+            yield [
+                {
+                    "Key": el.findtext("{*}Key"),
+                    "Size": int(el.findtext("{*}Size") or 0),
+                    "LastModified": _parse_time(el.findtext("{*}LastModified")),
+                }
+                for el in root.iterfind("{*}Contents")
+            ]
+            if root.findtext("{*}IsTruncated") != "true":
+                return
+            token = root.findtext("{*}NextContinuationToken")
+
+    async def _delete_objects(self, keys: list[str]) -> int:
+        """Delete up to 1000 keys in one DeleteObjects call. Returns the number of keys that failed."""
+        body = ("<Delete><Quiet>true</Quiet>" + "".join(
+            f"<Object><Key>{_xml_escape(k)}</Key></Object>" for k in keys
+        ) + "</Delete>").encode("utf-8")
+        md5 = base64.b64encode(hashlib.md5(body).digest()).decode("ascii")
+        _, _, payload = await self._request("POST", query={"delete": ""}, headers={"content-md5": md5}, body=body)
+
+        errors = list(ElementTree.fromstring(payload).iterfind("{*}Error")) if payload else []
+        for err in errors[:5]:
+            logging.error(
+                f"delete_objects: {err.findtext('{*}Key')}: {err.findtext('{*}Code')} {err.findtext('{*}Message')}"
+            )
+        return len(errors)
+
+    async def close(self) -> None:
+        if self._session and not self._session.closed:
+            await self._session.close()
+
+
+def _parse_time(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+
+def _xml_escape(value: str) -> str:
+    return value.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
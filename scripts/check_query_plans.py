@@ -0,0 +1,159 @@
+# scripts/check_query_plans.py
+"""
+Check that the hot queries are served by indexes (EXPLAIN), on a schema built by
+the Alembic migrations.
+
+Runs the real query helpers from database.py (bouquet list page, previous-page
+anchor, count) and the product query of show_product_page against a seeded
+database, captures the SQL they send and EXPLAINs it. Fails (exit 1) when a hot
+table is scanned without an index or needs a separate sort step.
+
+    python -m scripts.check_query_plans                 # temp SQLite file
+    DATABASE_URL=postgresql+asyncpg://... python -m scripts.check_query_plans
+
+On PostgreSQL the check runs with enable_seqscan=off: the tables are tiny, so the
+question is "can the planner use an index here", not "would it right now".
+Nothing is written to an existing database except the seed rows in a rolled-back
+transaction.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+HOT_TABLES = ("bouquets", "products")
+
+
+def _sqlite_problems(plan: list[str]) -> list[str]:
+    problems = []
+    for line in plan:
+        for table in HOT_TABLES:
+            if line.startswith(f"SCAN {table}") and "INDEX" not in line:
+                problems.append(f"full scan: {line}")
+        if "TEMP B-TREE" in line:
+            problems.append(f"separate sort: {line}")
+    return problems
+
+
+def _postgres_problems(plan: list[str]) -> list[str]:
+    problems = []
+    for line in plan:
+        for table in HOT_TABLES:
+            if f"Seq Scan on {table}" in line:
+                problems.append(f"full scan: {line.strip()}")
+        if line.strip().startswith("->  Sort") or line.strip().startswith("Sort"):
+            problems.append(f"separate sort: {line.strip()}")
+    return problems
+
+
+async def _seed(session, users: int = 3, bouquets_per_user: int = 200, categories: int = 5, products: int = 60):
+    from database import User, Bouquet, Category, Product
+
+    base = datetime(2024, 1, 1)
+    owners = [User(telegram_id=900_000 + i) for i in range(users)]
+    session.add_all(owners)
+    await session.flush()
+    for u, owner in enumerate(owners):
+        session.add_all([
+            Bouquet(
+                bouquet_id=f"plan-{u}-{i}", user_id=owner.id, short_title=f"b{i}", title_display=f"b{i}",
+                photos=[], description="", price_minor=100,
+                # пачками по 3 с одинаковым временем — проверяем и добивку по id
+                created_at=base + timedelta(minutes=i // 3),
+            )
+            for i in range(bouquets_per_user)
+        ])
+    cats = [Category(name=f"plan-cat-{i}") for i in range(categories)]
+    session.add_all(cats)
+    await session.flush()
+    for cat in cats:
+        session.add_all([Product(category_id=cat.id, name=f"p{i:03d}") for i in range(products)])
+    await session.flush()
+    return owners[0].id, cats[0].id
+
+
+async def main() -> int:
+    if not os.getenv("DATABASE_URL"):
+        path = os.path.join(tempfile.mkdtemp(prefix="query-plans-"), "plans.db")
+        os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{path}"
+
+    from sqlalchemy import event, select
+    from database import (
+        engine, init_db, get_db_session, Product,
+        get_user_bouquet_page, get_prev_page_anchor, count_user_bouquets,
+    )
+
+    engine.sync_engine.echo = False
+    await init_db()
+    dialect = engine.dialect.name
+    if dialect not in ("sqlite", "postgresql"):
+        print(f"unsupported dialect: {dialect}")
+        return 2
+
+    captured: list[tuple[str, object]] = []
+
+    def _capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            captured.append((statement, parameters))
+
+    failures = 0
+    session = await get_db_session()
+    try:
+        user_id, category_id = await _seed(session)
+        connection = await session.connection()
+        if dialect == "postgresql":
+            await connection.exec_driver_sql("SET LOCAL enable_seqscan = off")
+
+        async def _statement(label: str, call):
+            captured.clear()
+            event.listen(engine.sync_engine, "before_cursor_execute", _capture)
+            try:
+                result = await call()
+            finally:
+                event.remove(engine.sync_engine, "before_cursor_execute", _capture)
+            return label, list(captured), result
+
+        checks = []
+        label, sql, first_page = await _statement(
+            "bouquet list, first page", lambda: get_user_bouquet_page(session, user_id, None, 5))
+        checks.append((label, sql))
+        anchor = tuple(first_page[-1][:2])
+        label, sql, page = await _statement(
+            "bouquet list, page by anchor", lambda: get_user_bouquet_page(session, user_id, anchor, 5))
+        checks.append((label, sql))
+        label, sql, _ = await _statement(
+            "bouquet list, previous anchor", lambda: get_prev_page_anchor(session, user_id, tuple(page[0][:2]), 5))
+        checks.append((label, sql))
+        label, sql, _ = await _statement(
+            "bouquet count", lambda: count_user_bouquets(session, user_id))
+        checks.append((label, sql))
+        # тот же запрос, что в handlers.composition_picker.show_product_page
+        label, sql, _ = await _statement(
+            "products of a category", lambda: session.execute(
+                select(Product).where(Product.category_id == category_id).order_by(Product.name.asc())))
+        checks.append((label, sql))
+
+        prefix = "EXPLAIN QUERY PLAN " if dialect == "sqlite" else "EXPLAIN "
+        for label, statements in checks:
+            for statement, parameters in statements:
+                rows = (await connection.exec_driver_sql(prefix + statement, parameters)).all()
+                plan = [str(row[-1]) for row in rows]
+                problems = _sqlite_problems(plan) if dialect == "sqlite" else _postgres_problems(plan)
+                print(f"{'FAIL' if problems else 'ok  '} {label}")
+                for line in plan:
+                    print(f"       {line}")
+                for problem in problems:
+                    print(f"     ! {problem}")
+                failures += bool(problems)
+    finally:
+        await session.rollback()
+        await session.close()
+        await engine.dispose()
+
+    print(f"\n{failures} problem queries" if failures else "\nall hot queries use indexes")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
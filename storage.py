@@ -4,30 +4,40 @@ import io
 import uuid
 import asyncio
 import logging
-from typing import Optional
+import tempfile
+from typing import Optional, BinaryIO, AsyncIterator
 
 import boto3
 from botocore.client import Config
 from botocore.exceptions import ClientError
 
 from aiogram import Bot
-from utils import convert_heic_to_jpeg
+import config
+import metrics
+from storage_base import StorageBackend
+from utils import convert_heic_to_jpeg, is_heif
 
 
-class YandexObjectStorage:
+class YandexObjectStorage(StorageBackend):
     """Thin async wrapper around boto3 S3 client for Yandex Object Storage."""
+    name = "s3"
+
     def __init__(self) -> None:
+        super().__init__()
         # ENV variable names follow your .env (YC_*)
         self.access_key_id = os.getenv("YC_ACCESS_KEY_ID")
         self.secret_access_key = os.getenv("YC_SECRET_ACCESS_KEY")
         self.bucket_name = os.getenv("YC_BUCKET_NAME")
         self.endpoint_url = os.getenv("YC_ENDPOINT_URL")
         self.s3_client = None
-        self.initialized = False
+
+    def is_configured(self) -> bool:
+        return all([self.access_key_id, self.secret_access_key, self.bucket_name, self.endpoint_url])
 
     def initialize_client(self) -> bool:
+        """Build the client and probe the bucket. Blocking: call via initialize()/ensure_ready()."""
         try:
-            if not all([self.access_key_id, self.secret_access_key, self.bucket_name, self.endpoint_url]):
+            if not self.is_configured():
                 logging.warning("YC storage credentials are not fully configured.")
                 return False
 
@@ -36,7 +46,8 @@ class YandexObjectStorage:
                 endpoint_url=self.endpoint_url,
                 aws_access_key_id=self.access_key_id,
                 aws_secret_access_key=self.secret_access_key,
-                config=Config(signature_version="s3v4"),
+                region_name=config.YC_REGION,
+                config=Config(signature_version="s3v4", s3={"addressing_style": "path"}),
             )
             # Probe bucket
             self.s3_client.head_bucket(Bucket=self.bucket_name)
@@ -56,10 +67,17 @@ class YandexObjectStorage:
             logging.error(f"Unexpected error initializing storage: {e}")
             return False
 
+    async def initialize(self) -> bool:
+        return await asyncio.to_thread(self.initialize_client)
+
+    async def probe(self) -> bool:
+        await asyncio.to_thread(self.s3_client.head_bucket, Bucket=self.bucket_name)
+        return True
+
     async def upload_from_memory(self, file_content: bytes, object_name: str, content_type: str = "application/octet-stream") -> Optional[str]:
         """Upload bytes to object storage and return public URL."""
         try:
-            if not self.initialized and not self.initialize_client():
+            if not await self.ensure_ready():
                 return None
             if not file_content:
                 logging.error("upload_from_memory: empty content")
@@ -78,15 +96,102 @@ class YandexObjectStorage:
                 )
 
             await loop.run_in_executor(None, _put)
-            url = f"{self.endpoint_url}/{self.bucket_name}/{object_name}".rstrip("/")
-            return url
+            return self.public_url(object_name)
         except Exception as e:
             logging.error(f"upload_from_memory failed: {e}")
             return None
 
+    def public_url(self, object_name: str) -> str:
+        return f"{self.endpoint_url}/{self.bucket_name}/{object_name}".rstrip("/")
+
+    async def upload_stream(self, file_obj: BinaryIO, object_name: str, content_type: str = "application/octet-stream",
+                            part_size: int | None = None) -> Optional[str]:
+        """
+        Upload a seekable file object part by part (S3 multipart upload).
+        Only one part is held in memory at a time, so peak RAM is bounded by part_size.
+        """
+        part_size = max(part_size or config.MEDIA_STREAM_CHUNK_SIZE, config.MIN_MULTIPART_PART_SIZE)
+        upload_id = None
+        loop = asyncio.get_running_loop()
+        try:
+            if not await self.ensure_ready():
+                return None
+
+            file_obj.seek(0, io.SEEK_END)
+            size = file_obj.tell()
+            file_obj.seek(0)
+            if not size:
+                logging.error("upload_stream: empty content")
+                return None
+
+            if size <= part_size:
+                def _put():
+                    self.s3_client.put_object(
+                        Bucket=self.bucket_name,
+                        Key=object_name,
+                        Body=file_obj.read(),
+                        ContentType=content_type,
+                        ACL="public-read",
+                    )
+
+                await loop.run_in_executor(None, _put)
+                return self.public_url(object_name)
+
+            def _create():
+                return self.s3_client.create_multipart_upload(
+                    Bucket=self.bucket_name,
+                    Key=object_name,
+                    ContentType=content_type,
+                    ACL="public-read",
+                )["UploadId"]
+
+            upload_id = await loop.run_in_executor(None, _create)
+
+            def _upload_part(part_number: int) -> Optional[dict]:
+                chunk = file_obj.read(part_size)
+                if not chunk:
+                    return None
+                resp = self.s3_client.upload_part(
+                    Bucket=self.bucket_name,
+                    Key=object_name,
+                    UploadId=upload_id,
+                    PartNumber=part_number,
+                    Body=chunk,
+                )
+                return {"PartNumber": part_number, "ETag": resp["ETag"]}
+
+            parts = []
+            while True:
+                part = await loop.run_in_executor(None, _upload_part, len(parts) + 1)
+                if not part:
+                    break
+                parts.append(part)
+
+            def _complete():
+                self.s3_client.complete_multipart_upload(
+                    Bucket=self.bucket_name,
+                    Key=object_name,
+                    UploadId=upload_id,
+                    MultipartUpload={"Parts": parts},
+                )
+
+            await loop.run_in_executor(None, _complete)
+            return self.public_url(object_name)
+        except Exception as e:
+            logging.error(f"upload_stream failed: {e}")
+            if upload_id:
+                def _abort():
+                    self.s3_client.abort_multipart_upload(Bucket=self.bucket_name, Key=object_name, UploadId=upload_id)
+
+                try:
+                    await loop.run_in_executor(None, _abort)
+                except Exception as abort_err:
+                    logging.error(f"abort_multipart_upload failed: {abort_err}")
+            return None
+
     async def delete_object(self, object_name: str) -> bool:
         try:
-            if not self.initialized and not self.initialize_client():
+            if not await self.ensure_ready():
                 return False
             loop = asyncio.get_running_loop()
 
@@ -99,89 +204,158 @@ class YandexObjectStorage:
             logging.error(f"delete_object failed: {e}")
             return False
 
-    async def delete_bouquet_files(self, bouquet_id: str) -> bool:
-        """Delete all objects under bouquets/{bouquet_id}/ prefix."""
-        try:
-            if not self.initialized and not self.initialize_client():
-                return False
-            prefix = f"bouquets/{bouquet_id}/"
-            loop = asyncio.get_running_loop()
+    async def iter_object_pages(self, prefix: str = "") -> AsyncIterator[list[dict]]:
+        """Yield the listing page by page (<= 1000 objects: Key, Size, LastModified)."""
+        if not await self.ensure_ready():
+            raise RuntimeError("object storage is not available")
+        loop = asyncio.get_running_loop()
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        pages = iter(paginator.paginate(Bucket=self.bucket_name, Prefix=prefix))
+        while True:
+            page = await loop.run_in_executor(None, next, pages, None)
+            if page is None:
+                return
+            yield [
+                {"Key": c["Key"], "Size": c.get("Size", 0), "LastModified": c.get("LastModified")}
+                for c in page.get("Contents", [])
+            ]
+
+    async def _delete_objects(self, keys: list[str]) -> int:
+        """Delete up to 1000 keys in one DeleteObjects call. Returns the number of keys that failed."""
+        loop = asyncio.get_running_loop()
+
+        def _batch_delete():
+            return self.s3_client.delete_objects(
+                Bucket=self.bucket_name,
+                Delete={"Objects": [{"Key": k} for k in keys], "Quiet": True},
+            )
 
-            def _list():
-                return self.s3_client.list_objects_v2(Bucket=self.bucket_name, Prefix=prefix)
+        response = await loop.run_in_executor(None, _batch_delete)
+        errors = response.get("Errors", [])
+        for err in errors[:5]:
+            logging.error(f"delete_objects: {err.get('Key')}: {err.get('Code')} {err.get('Message')}")
+        return len(errors)
+
+def create_storage() -> StorageBackend:
+    """Pick the backend configured by STORAGE_BACKEND (and the S3 client by STORAGE_S3_CLIENT)."""
+    if config.STORAGE_BACKEND == "local":
+        from storage_local import LocalFileStorage
+        return LocalFileStorage()
+    if config.STORAGE_BACKEND != "s3":
+        logging.warning(f"Unknown STORAGE_BACKEND={config.STORAGE_BACKEND!r}, using s3")
+    if config.STORAGE_S3_CLIENT == "aiohttp":
+        from s3_async import AsyncS3Storage
+        return AsyncS3Storage()
+    return YandexObjectStorage()
 
-            response = await loop.run_in_executor(None, _list)
-            to_delete = [{"Key": c["Key"]} for c in response.get("Contents", [])]
-            if not to_delete:
-                return True
 
-            def _batch_delete():
-                self.s3_client.delete_objects(
-                    Bucket=self.bucket_name,
-                    Delete={"Objects": to_delete, "Quiet": True},
-                )
+# Global instance
+media_storage = create_storage()
+# Old name, kept for external scripts
+yandex_storage = media_storage
 
-            await loop.run_in_executor(None, _batch_delete)
-            return True
-        except Exception as e:
-            logging.error(f"delete_bouquet_files failed: {e}")
-            return False
+# Strong references to fire-and-forget cleanup tasks
+_background_tasks: set[asyncio.Task] = set()
 
 
-# Global instance
-yandex_storage = YandexObjectStorage()
+def schedule_bouquet_cleanup(bouquet_id: str) -> asyncio.Task:
+    """Delete bouquets/{bouquet_id}/ in the background, without blocking the handler."""
+    task = asyncio.create_task(media_storage.delete_bouquet_files(bouquet_id))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
 
 
-async def upload_photo_to_storage(bot: Bot, file_id: str, bouquet_id: str, index: int) -> Optional[str]:
-    """Download a Telegram photo by file_id and upload to Yandex storage. Returns URL or None."""
-    try:
-        # Resolve file path
-        file = await bot.get_file(file_id)
-        if not file:
-            logging.error("Telegram get_file returned None")
-            return None
+def schedule_url_cleanup(url: Optional[str]) -> Optional[asyncio.Task]:
+    """Delete the object behind one of our public URLs in the background; other values are ignored."""
+    base = media_storage.public_url("") + "/"
+    if not url or not url.startswith(base):
+        return None
+    task = asyncio.create_task(media_storage.delete_object(url[len(base):]))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
 
-        file_path = file.file_path
-        # Download bytes
-        downloaded = await bot.download_file(file_path)
-        file_bytes = downloaded.read() if downloaded else None
-        if not file_bytes:
-            logging.error("Failed to download photo from Telegram")
+
+PHOTO_MIME_TYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".webp": "image/webp",
+}
+
+
+async def get_telegram_file(bot: Bot, file_id: str):
+    """Resolve file_id -> aiogram File (file_path, file_unique_id)."""
+    file = await bot.get_file(file_id)
+    if not file:
+        logging.error("Telegram get_file returned None")
+        return None
+    return file
+
+
+async def download_telegram_file(bot: Bot, file_path: str) -> Optional[bytes]:
+    """Download stage: fetch file bytes from Telegram."""
+    downloaded = await bot.download_file(file_path)
+    file_bytes = downloaded.read() if downloaded else None
+    if not file_bytes:
+        logging.error("Failed to download photo from Telegram")
+        return None
+    return file_bytes
+
+
+async def prepare_photo(file_bytes: bytes, file_path: str) -> Optional[tuple[bytes, str, str]]:
+    """Convert stage: HEIC/HEIF -> JPEG. Returns (bytes, ext, content_type) or None."""
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext in (".heic", ".heif") or is_heif(file_bytes):
+        converted = await convert_heic_to_jpeg(file_bytes)
+        if not converted:
+            logging.error("HEIC conversion failed")
             return None
+        file_bytes = converted
+        ext = ".jpg"
 
-        # Determine extension
-        ext = os.path.splitext(file_path)[1].lower()
-        if ext == ".heic":
-            converted = await convert_heic_to_jpeg(file_bytes)
-            if not converted:
-                logging.error("HEIC conversion failed")
-                return None
-            file_bytes = converted
-            ext = ".jpg"
-
-        # Object key
-        unique = uuid.uuid4().hex
-        object_name = f"bouquets/{bouquet_id}/{unique}-{index}{ext or '.jpg'}"
-
-        # Content type
-        mime = {
-            ".jpg": "image/jpeg",
-            ".jpeg": "image/jpeg",
-            ".png": "image/png",
-            ".webp": "image/webp",
-        }.get(ext, "image/jpeg")
-
-        url = await yandex_storage.upload_from_memory(file_bytes, object_name, content_type=mime)
-        if not url:
+    ext = ext or ".jpg"
+    return file_bytes, ext, PHOTO_MIME_TYPES.get(ext, "image/jpeg")
+
+
+def content_object_name(sha256: str, ext: str) -> str:
+    """Content-addressed key: the same bytes always land on the same object."""
+    return f"media/{sha256[:2]}/{sha256}{ext}"
+
+
+async def upload_photo_to_storage(bot: Bot, file_id: str, bouquet_id: str, index: int) -> Optional[str]:
+    """
+    Download a Telegram photo by file_id and upload to media storage. Returns URL or None.
+    Goes through the deduplicating media pipeline: a photo that is already stored is not re-uploaded.
+    """
+    from media_pipeline import PhotoUploadPipeline
+
+    try:
+        uploaded = await PhotoUploadPipeline(bot, bouquet_id, retries=0).upload_one(file_id, index)
+        if not uploaded:
             logging.error("Photo upload failed")
-        return url
+            return None
+        return uploaded["url"]
     except Exception as e:
         logging.error(f"upload_photo_to_storage error: {e}", exc_info=True)
         return None
 
 
+VIDEO_MIME_TYPES = {
+    ".mp4": "video/mp4",
+    ".mov": "video/quicktime",
+    ".m4v": "video/x-m4v",
+    ".webm": "video/webm",
+}
+
+
 async def upload_video_to_storage(bot: Bot, file_id: str, bouquet_id: str) -> Optional[str]:
-    """Download a Telegram video by file_id and upload to Yandex storage. Returns URL or None."""
+    """
+    Download a Telegram video by file_id and upload to media storage. Returns URL or None.
+    The video is streamed: Telegram -> spooled temp file (on disk past MEDIA_STREAM_CHUNK_SIZE)
+    -> multipart upload, so it is never held in memory as a whole.
+    """
     try:
         file = await bot.get_file(file_id)
         if not file:
@@ -189,17 +363,21 @@ async def upload_video_to_storage(bot: Bot, file_id: str, bouquet_id: str) -> Op
             return None
 
         file_path = file.file_path
-        downloaded = await bot.download_file(file_path)
-        file_bytes = downloaded.read() if downloaded else None
-        if not file_bytes:
-            logging.error("Failed to download video from Telegram")
-            return None
-
         ext = os.path.splitext(file_path)[1].lower() or ".mp4"
-        unique = uuid.uuid4().hex
-        object_name = f"bouquets/{bouquet_id}/{unique}{ext}"
+        object_name = f"bouquets/{bouquet_id}/{uuid.uuid4().hex}{ext}"
+
+        with tempfile.SpooledTemporaryFile(max_size=config.MEDIA_STREAM_CHUNK_SIZE) as buffer:
+            with metrics.timer("media.stage.video_download"):
+                await bot.download_file(file_path, destination=buffer, timeout=config.MEDIA_DOWNLOAD_TIMEOUT)
+            buffer.seek(0, io.SEEK_END)
+            if not buffer.tell():
+                logging.error("Failed to download video from Telegram")
+                return None
 
-        url = await yandex_storage.upload_from_memory(file_bytes, object_name, content_type="video/mp4")
+            with metrics.timer("media.stage.video_upload"):
+                url = await media_storage.upload_stream(
+                    buffer, object_name, content_type=VIDEO_MIME_TYPES.get(ext, "video/mp4")
+                )
         if not url:
             logging.error("Video upload failed")
         return url
@@ -0,0 +1,215 @@
+# storage_base.py
+import time
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from typing import Optional, BinaryIO, AsyncIterator
+
+import config
+import metrics
+
+
+class StorageBackend(ABC):
+    """
+    Interface every media storage backend implements (S3 via boto3, S3 via aiohttp, local disk).
+
+    Objects are addressed by key ("media/ab/<sha>.jpg", "bouquets/<id>/<uuid>.mp4");
+    uploads return the public URL that is stored in bouquets.photos / video_path.
+    Upload methods return None and delete methods return False/failure counts
+    instead of raising, so handlers can fall back gracefully.
+
+    Initialization goes through ensure_ready(): one attempt at a time, off the event
+    loop, and after a failure further attempts are skipped for a backoff window
+    (STORAGE_INIT_BACKOFF doubling up to STORAGE_INIT_BACKOFF_MAX), so a wrong
+    credential or a dead endpoint costs callers nothing but a fast None.
+    """
+
+    name = "base"
+
+    def __init__(self) -> None:
+        self.initialized = False
+        self.ready = False
+        self.last_check: Optional[float] = None
+        self._failures = 0
+        self._retry_at = 0.0
+        self._init_lock = asyncio.Lock()
+        self._probe_task: Optional[asyncio.Task] = None
+
+    @abstractmethod
+    def is_configured(self) -> bool:
+        """Whether the backend has everything it needs to be initialized."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def initialize(self) -> bool:
+        """One initialization attempt (probe bucket, create directories, ...). Use ensure_ready()."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def probe(self) -> bool:
+        """Cheap liveness check of an initialized backend."""
+        raise NotImplementedError
+
+    async def ensure_ready(self) -> bool:
+        """Initialize once; after a failure return False until the backoff window passes."""
+        if self.initialized:
+            return True
+        if time.monotonic() < self._retry_at:
+            return False
+        async with self._init_lock:
+            if self.initialized:
+                return True
+            if time.monotonic() < self._retry_at:
+                return False
+            try:
+                ok = await self.initialize()
+            except Exception as e:
+                logging.error(f"{self.name} storage initialization error: {e}")
+                ok = False
+            self._record_check(ok)
+            return ok
+
+    def _record_check(self, ok: bool) -> None:
+        self.last_check = time.time()
+        if ok:
+            if not self.ready:
+                logging.info(f"{self.name} storage is ready")
+            self._failures = 0
+            self._retry_at = 0.0
+        else:
+            self._failures += 1
+            delay = min(config.STORAGE_INIT_BACKOFF * 2 ** (self._failures - 1), config.STORAGE_INIT_BACKOFF_MAX)
+            self._retry_at = time.monotonic() + delay
+            if self.ready or self._failures == 1:
+                logging.warning(f"{self.name} storage is not available, next attempt in {delay:.0f}s")
+        self.ready = ok
+        metrics.set_gauge("storage.ready", int(ok))
+
+    async def _health_loop(self, interval: float) -> None:
+        while True:
+            if self.initialized:
+                try:
+                    ok = await self.probe()
+                except Exception as e:
+                    logging.debug(f"{self.name} storage probe failed: {e}")
+                    ok = False
+                self._record_check(ok)
+            else:
+                await self.ensure_ready()
+            await asyncio.sleep(interval)
+
+    def start_health_probe(self, interval: float | None = None) -> asyncio.Task:
+        """Probe the backend every STORAGE_HEALTH_INTERVAL seconds; readiness is in health()."""
+        if self._probe_task is None or self._probe_task.done():
+            self._probe_task = asyncio.create_task(
+                self._health_loop(interval or config.STORAGE_HEALTH_INTERVAL), name=f"{self.name}-health"
+            )
+        return self._probe_task
+
+    async def stop_health_probe(self) -> None:
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            try:
+                await self._probe_task
+            except asyncio.CancelledError:
+                pass
+            self._probe_task = None
+
+    def health(self) -> dict:
+        return {
+            "backend": self.name,
+            "ready": self.ready,
+            "initialized": self.initialized,
+            "failures": self._failures,
+            "retry_in": max(0.0, self._retry_at - time.monotonic()),
+            "last_check": self.last_check,
+        }
+
+    @abstractmethod
+    def public_url(self, object_name: str) -> str:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def upload_from_memory(self, file_content: bytes, object_name: str,
+                                 content_type: str = "application/octet-stream") -> Optional[str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def upload_stream(self, file_obj: BinaryIO, object_name: str,
+                            content_type: str = "application/octet-stream",
+                            part_size: int | None = None) -> Optional[str]:
+        """Upload a seekable file object without reading it into memory as a whole."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def delete_object(self, object_name: str) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def iter_object_pages(self, prefix: str = "") -> AsyncIterator[list[dict]]:
+        """Yield the listing page by page (<= 1000 objects: Key, Size, LastModified)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def _delete_objects(self, keys: list[str]) -> int:
+        """
+        Delete one batch (<= S3_DELETE_BATCH_SIZE keys) in a single call, e.g. S3
+        DeleteObjects. Returns the number of keys that failed.
+        """
+        raise NotImplementedError
+
+    async def _delete_batch(self, keys: list[str], slots: asyncio.Semaphore) -> int:
+        async with slots:
+            return await self._delete_objects(keys)
+
+    async def delete_keys(self, keys: list[str]) -> int:
+        """Delete keys in batches of S3_DELETE_BATCH_SIZE, S3_DELETE_CONCURRENCY batches at once. Returns failures."""
+        if not keys:
+            return 0
+        if not await self.ensure_ready():
+            return len(keys)
+        slots = asyncio.Semaphore(config.S3_DELETE_CONCURRENCY)
+        results = await asyncio.gather(*(
+            self._delete_batch(keys[i:i + config.S3_DELETE_BATCH_SIZE], slots)
+            for i in range(0, len(keys), config.S3_DELETE_BATCH_SIZE)
+        ))
+        return sum(results)
+
+    async def delete_prefix(self, prefix: str) -> tuple[int, int]:
+        """
+        Delete everything under prefix: each listing page becomes a delete batch,
+        batches run concurrently while the listing continues. Returns (deleted, failed).
+        """
+        slots = asyncio.Semaphore(config.S3_DELETE_CONCURRENCY)
+        batches: list[tuple[int, asyncio.Task]] = []
+        async for page in self.iter_object_pages(prefix):
+            keys = [obj["Key"] for obj in page]
+            for i in range(0, len(keys), config.S3_DELETE_BATCH_SIZE):
+                chunk = keys[i:i + config.S3_DELETE_BATCH_SIZE]
+                batches.append((len(chunk), asyncio.create_task(self._delete_batch(chunk, slots))))
+
+        failed = sum(await asyncio.gather(*(task for _, task in batches)))
+        return sum(size for size, _ in batches) - failed, failed
+
+    async def delete_bouquet_files(self, bouquet_id: str) -> bool:
+        """
+        Delete all objects under bouquets/{bouquet_id}/ prefix (videos, legacy photos).
+        Content-addressed photos under media/ may be shared and are left to storage_gc,
+        which upload_worker runs every STORAGE_GC_INTERVAL_HOURS (or cron, if that is 0).
+        """
+        try:
+            if not await self.ensure_ready():
+                return False
+            deleted, failed = await self.delete_prefix(f"bouquets/{bouquet_id}/")
+            logging.info(f"delete_bouquet_files {bouquet_id}: deleted={deleted} failed={failed}")
+            return failed == 0
+        except Exception as e:
+            logging.error(f"delete_bouquet_files failed: {e}")
+            return False
+
+    async def serve_files(self) -> None:
+        """Serve objects at public_url() from this process if the backend needs it; the bot calls it once."""
+        return None
+
+    async def close(self) -> None:
+        return None
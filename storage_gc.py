@@ -0,0 +1,323 @@
+# storage_gc.py
+"""
+Сборщик мусора объектного хранилища.
+
+Сверяет листинг бакета со ссылками из БД (bouquets.photos / bouquets.video_path)
+и удаляет объекты, на которые ничего не ссылается и которые старше grace-периода
+(брошенные черновики, замененные медиа, видео из bouquets/temp/).
+
+Объекты media/ адресуются по sha256: объект жив, пока на этот sha ссылается хоть
+один букет (превью и WebP-варианты живут вместе с оригиналом) или пока дедупликация
+выдавала его позже grace-порога (media_objects.last_used_at — так защищены объекты,
+отданные ещё не сохранённым черновикам). Открытые черновики тоже держат объекты:
+фото, загруженные для них (draft_media.open_draft_urls), и папки bouquets/<номер>/
+неподтверждённых броней номеров (туда грузится видео черновика). Файлы букетов с
+pending/running задачами upload_jobs (bouquets/<id>/...) тоже считаются используемыми. При удалении объекта
+из индекса медиа убираются строки media_objects / media_aliases и их зеркало в
+Redis, чтобы дедупликация не вернула битую ссылку; строка, которую успели выдать
+после начала прохода, не удаляется — как и сам объект. Перед удалением каждой
+пачки ключей индекс проверяется ещё раз: объект, который успели загрузить заново
+(тот же ключ, новая строка media_objects), остаётся (revived в отчёте).
+
+По умолчанию проход ограничен пространствами ключей бота (GC_PREFIXES: media/ и
+bouquets/); чужие ключи бакета он не трогает. Префикс вне них, в том числе пустой
+(весь бакет), — только с --whole-bucket.
+
+Удаление букета убирает только bouquets/<id>/; его фото в media/ освобождает этот
+проход. upload_worker запускает его каждые STORAGE_GC_INTERVAL_HOURS (run_if_due: один
+проход на интервал на все процессы); с STORAGE_GC_INTERVAL_HOURS=0 — запускать по cron.
+
+    python storage_gc.py --dry-run
+    python storage_gc.py --grace-hours 48 --prefix bouquets/
+"""
+import argparse
+import asyncio
+import logging
+import re
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Optional
+
+from sqlalchemy import select, delete, or_
+
+import bouquet_numbers
+import config
+import draft_media
+from cache import get_redis, close_redis
+from database import get_db_session, Bouquet, MediaObject, MediaAlias, UploadJob
+from media_index import _ALIAS_KEY, _OBJECT_KEY
+from upload_queue import JOB_PENDING, JOB_RUNNING
+from storage import media_storage
+
+# media/ab/<sha256><ext>, media/ab/<sha256>.thumb.jpg, media/ab/<sha256>.opt.webp
+_MEDIA_KEY_RE = re.compile(r"^media/[0-9a-f]{2}/([0-9a-f]{64})")
+_PHOTO_URL_FIELDS = ("url", "thumb_url", "webp_url")
+# метка последнего планового прохода (живёт STORAGE_GC_INTERVAL_HOURS)
+_SCHEDULE_KEY = "storage_gc:scheduled"
+# куда пишет бот: контентно-адресуемые фото и папки букетов
+GC_PREFIXES = ("media/", "bouquets/")
+
+
+@dataclass
+class GCReport:
+    scanned: int = 0
+    referenced: int = 0
+    orphans: int = 0
+    too_young: int = 0
+    deleted: int = 0
+    failed: int = 0
+    revived: int = 0
+    bytes_reclaimed: int = 0
+    orphan_hashes: set[str] = field(default_factory=set)
+
+    def summary(self, dry_run: bool) -> str:
+        verb = "would reclaim" if dry_run else "reclaimed"
+        return (
+            f"scanned={self.scanned} referenced={self.referenced} orphans={self.orphans} "
+            f"too_young={self.too_young} deleted={self.deleted} failed={self.failed} revived={self.revived} "
+            f"{verb}={self.bytes_reclaimed / 1024 ** 2:.1f} MiB"
+        )
+
+
+def _media_hash(key: str) -> Optional[str]:
+    match = _MEDIA_KEY_RE.match(key)
+    return match.group(1) if match else None
+
+
+def _urls_of(photos, video_path) -> Iterable[str]:
+    for item in photos or []:
+        if isinstance(item, str):
+            yield item
+        elif isinstance(item, dict):
+            for name in _PHOTO_URL_FIELDS:
+                if item.get(name):
+                    yield item[name]
+    if video_path:
+        yield video_path
+
+
+@dataclass
+class References:
+    keys: set[str] = field(default_factory=set)
+    hashes: set[str] = field(default_factory=set)
+    # bouquets/<id>/ букетов, которым upload_worker ещё догружает файлы
+    prefixes: set[str] = field(default_factory=set)
+
+    def covers(self, key: str) -> bool:
+        if key in self.keys:
+            return True
+        sha = _media_hash(key)
+        if sha is not None and sha in self.hashes:
+            return True
+        return any(key.startswith(prefix) for prefix in self.prefixes)
+
+
+async def collect_references(base_url: str, used_since: datetime) -> References:
+    """
+    Всё, что GC трогать нельзя: ключи объектов из букетов и открытых черновиков и их
+    sha256 (ссылки не на наш бакет — file_id, внешние URL — пропускаются), sha256
+    объектов, выданных дедупликацией после used_since, папки букетов с незавершёнными
+    upload_jobs и папки неподтверждённых номеров черновиков.
+    """
+    refs = References()
+
+    def _add_url(url: str) -> None:
+        if not url.startswith(base_url):
+            return
+        key = url[len(base_url):]
+        refs.keys.add(key)
+        sha = _media_hash(key)
+        if sha:
+            refs.hashes.add(sha)
+
+    for url in await draft_media.open_draft_urls():
+        _add_url(url)
+    refs.prefixes.update(f"bouquets/{bouquet_id}/" for bouquet_id in await bouquet_numbers.open_ids())
+
+    session = await get_db_session()
+    try:
+        result = await session.stream(
+            select(Bouquet.photos, Bouquet.video_path).execution_options(yield_per=500)
+        )
+        async for photos, video_path in result:
+            for url in _urls_of(photos, video_path):
+                _add_url(url)
+
+        refs.hashes.update((await session.execute(
+            select(MediaObject.sha256).where(MediaObject.last_used_at >= used_since)
+        )).scalars().all())
+        refs.prefixes.update(
+            f"bouquets/{bouquet_id}/" for bouquet_id in (await session.execute(
+                select(UploadJob.bouquet_id).distinct()
+                .where(UploadJob.status.in_((JOB_PENDING, JOB_RUNNING)))
+            )).scalars().all()
+        )
+    finally:
+        await session.close()
+    return refs
+
+
+async def _indexed(hashes: set[str]) -> set[str]:
+    """sha256 из hashes, у которых сейчас есть строка в индексе медиа."""
+    if not hashes:
+        return set()
+    session = await get_db_session()
+    try:
+        return set((await session.execute(
+            select(MediaObject.sha256).where(MediaObject.sha256.in_(hashes))
+        )).scalars().all())
+    finally:
+        await session.close()
+
+
+async def forget_media(hashes: set[str], used_before: datetime) -> set[str]:
+    """
+    Убрать удаляемые объекты из индекса медиа (БД + Redis). Строки, выданные
+    дедупликацией после used_before (пока шёл проход), остаются. Возвращает sha256
+    оставшихся строк — их объекты удалять нельзя.
+    """
+    if not hashes:
+        return set()
+    stale = (
+        MediaObject.sha256.in_(hashes),
+        or_(MediaObject.last_used_at.is_(None), MediaObject.last_used_at < used_before),
+    )
+    session = await get_db_session()
+    try:
+        stale_hashes = select(MediaObject.sha256).where(*stale)
+        aliases = (await session.execute(
+            select(MediaAlias.file_unique_id).where(MediaAlias.sha256.in_(stale_hashes))
+        )).scalars().all()
+        await session.execute(delete(MediaAlias).where(MediaAlias.sha256.in_(stale_hashes)))
+        await session.execute(delete(MediaObject).where(*stale))
+        kept = set((await session.execute(
+            select(MediaObject.sha256).where(MediaObject.sha256.in_(hashes))
+        )).scalars().all())
+        await session.commit()
+    except Exception:
+        await session.rollback()
+        raise
+    finally:
+        await session.close()
+
+    try:
+        cache_keys = [_OBJECT_KEY.format(sha) for sha in hashes - kept] + [_ALIAS_KEY.format(a) for a in aliases]
+        for i in range(0, len(cache_keys), 500):
+            await get_redis().delete(*cache_keys[i:i + 500])
+    except Exception as e:
+        # зеркало само истечет по TTL
+        logging.warning(f"storage_gc: redis cleanup failed: {e}")
+    return kept
+
+
+def _scan_prefixes(prefix: Optional[str], whole_bucket: bool) -> tuple[str, ...]:
+    if prefix is None:
+        return ("",) if whole_bucket else GC_PREFIXES
+    if not whole_bucket and not prefix.startswith(GC_PREFIXES):
+        raise ValueError(
+            f"prefix {prefix!r} is outside {', '.join(GC_PREFIXES)}; pass whole_bucket=True (--whole-bucket) to allow it"
+        )
+    return (prefix,)
+
+
+async def run_gc(grace: timedelta, prefix: Optional[str] = None, dry_run: bool = False,
+                 whole_bucket: bool = False) -> GCReport:
+    """
+    Один проход GC по prefix (по умолчанию — GC_PREFIXES). Префикс вне GC_PREFIXES
+    или пустой требует whole_bucket=True, иначе ValueError.
+    """
+    prefixes = _scan_prefixes(prefix, whole_bucket)
+    storage = media_storage
+    base_url = storage.public_url("") + "/"
+    cutoff = datetime.now(timezone.utc) - grace
+    # last_used_at в БД — наивное UTC
+    used_since = cutoff.replace(tzinfo=None)
+    refs = await collect_references(base_url, used_since)
+    report = GCReport()
+    orphans: list[tuple[str, int]] = []
+
+    for scan_prefix in prefixes:
+        async for page in storage.iter_object_pages(scan_prefix):
+            for obj in page:
+                report.scanned += 1
+                key = obj["Key"]
+                if refs.covers(key):
+                    report.referenced += 1
+                    continue
+                modified = obj.get("LastModified")
+                if modified is None or modified > cutoff:
+                    report.too_young += 1
+                    continue
+                orphans.append((key, obj.get("Size") or 0))
+
+    if orphans:
+        # букеты, сохраненные во время листинга, могли сослаться на старые объекты
+        refs = await collect_references(base_url, used_since)
+        orphans = [(key, size) for key, size in orphans if not refs.covers(key)]
+
+    report.orphans = len(orphans)
+    report.orphan_hashes = {sha for sha in (_media_hash(key) for key, _ in orphans) if sha}
+    report.bytes_reclaimed = sum(size for _, size in orphans)
+    for key, size in orphans[:20]:
+        logging.info(f"storage_gc: orphan {key} ({size} B)")
+
+    if dry_run or not orphans:
+        return report
+
+    # сначала индекс: новая загрузка того же содержимого пойдет в облако заново, а не на удаленный объект
+    await forget_media(report.orphan_hashes, used_since)
+
+    report.bytes_reclaimed = 0
+    for i in range(0, len(orphans), config.S3_DELETE_BATCH_SIZE):
+        batch = orphans[i:i + config.S3_DELETE_BATCH_SIZE]
+        # строка индекса есть — объект выдан дедупликацией после повторной сверки или
+        # загружен заново по тому же ключу уже после forget_media: не удаляем
+        revived = await _indexed({sha for sha in (_media_hash(key) for key, _ in batch) if sha})
+        if revived:
+            report.revived += sum(1 for key, _ in batch if _media_hash(key) in revived)
+            report.orphan_hashes -= revived
+            batch = [(key, size) for key, size in batch if _media_hash(key) not in revived]
+            if not batch:
+                continue
+        failed = await storage.delete_keys([key for key, _ in batch])
+        report.failed += failed
+        report.deleted += len(batch) - failed
+        # точный размер неудаленных неизвестен — не завышаем отчет
+        report.bytes_reclaimed += int(sum(size for _, size in batch) * (len(batch) - failed) / len(batch))
+    return report
+
+
+async def run_if_due(interval: timedelta) -> Optional[GCReport]:
+    """
+    Плановый проход: None, если за interval его уже запускал какой-то процесс.
+    Метка ставится до прохода (SET NX EX), поэтому упавший проход повторится через interval.
+    """
+    if not await get_redis().set(_SCHEDULE_KEY, int(time.time()), nx=True, ex=max(1, int(interval.total_seconds()))):
+        return None
+    return await run_gc(timedelta(hours=config.STORAGE_GC_GRACE_HOURS))
+
+
+async def main(args) -> None:
+    try:
+        report = await run_gc(
+            timedelta(hours=args.grace_hours), prefix=args.prefix, dry_run=args.dry_run,
+            whole_bucket=args.whole_bucket,
+        )
+        logging.info(f"storage_gc{' (dry run)' if args.dry_run else ''}: {report.summary(args.dry_run)}")
+    finally:
+        await media_storage.close()
+        await close_redis()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--grace-hours", type=float, default=config.STORAGE_GC_GRACE_HOURS,
+                        help="не трогать объекты моложе этого возраста")
+    parser.add_argument("--prefix", default=None,
+                        help=f"ограничить проход префиксом ключей (по умолчанию {' и '.join(GC_PREFIXES)})")
+    parser.add_argument("--whole-bucket", action="store_true",
+                        help="разрешить префикс вне пространств бота, без --prefix — весь бакет")
+    parser.add_argument("--dry-run", action="store_true", help="только отчет, ничего не удалять")
+    asyncio.run(main(parser.parse_args()))
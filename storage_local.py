@@ -0,0 +1,188 @@
+# storage_local.py
+import os
+import asyncio
+import logging
+import tempfile
+from datetime import datetime, timezone
+from typing import Optional, BinaryIO, AsyncIterator
+
+from aiohttp import web
+
+import config
+from storage_base import StorageBackend
+
+_COPY_CHUNK = 1024 * 1024
+_PAGE_SIZE = 1000
+
+
+class LocalFileStorage(StorageBackend):
+    """
+    Media storage on the local disk, for load tests and benchmarks on a single box.
+
+    Objects are files under LOCAL_STORAGE_DIR; every write goes to a temp file in
+    the target directory and is moved into place with os.replace, so readers never
+    see a half-written object. Files are served by a small aiohttp static route at
+    LOCAL_STORAGE_BASE_URL (Telegram cannot fetch such URLs unless they are public);
+    only the bot process starts it (serve_files), so workers and scripts sharing the
+    directory do not compete for LOCAL_STORAGE_PORT.
+    """
+    name = "local"
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.root = os.path.abspath(config.LOCAL_STORAGE_DIR)
+        self.base_url = config.LOCAL_STORAGE_BASE_URL.rstrip("/")
+        self._runner: Optional[web.AppRunner] = None
+
+    def is_configured(self) -> bool:
+        return bool(self.root and self.base_url)
+
+    def _path(self, object_name: str) -> str:
+        path = os.path.normpath(os.path.join(self.root, object_name))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"object key escapes storage root: {object_name!r}")
+        return path
+
+    async def initialize(self) -> bool:
+        if self.initialized:
+            return True
+        try:
+            await asyncio.to_thread(os.makedirs, self.root, exist_ok=True)
+            self.initialized = True
+            logging.info(f"Local media storage initialized at {self.root}")
+            return True
+        except Exception as e:
+            logging.error(f"Unexpected error initializing local storage: {e}")
+            return False
+
+    async def probe(self) -> bool:
+        return await asyncio.to_thread(os.access, self.root, os.W_OK)
+
+    async def serve_files(self) -> None:
+        if not config.LOCAL_STORAGE_SERVE or self._runner is not None:
+            return
+        await asyncio.to_thread(os.makedirs, self.root, exist_ok=True)
+        app = web.Application()
+        app.router.add_static(config.LOCAL_STORAGE_ROUTE, self.root, follow_symlinks=False)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, config.LOCAL_STORAGE_HOST, config.LOCAL_STORAGE_PORT).start()
+        self._runner = runner
+        logging.info(
+            f"Serving {self.root} at http://{config.LOCAL_STORAGE_HOST}:{config.LOCAL_STORAGE_PORT}"
+            f"{config.LOCAL_STORAGE_ROUTE}"
+        )
+
+    def public_url(self, object_name: str) -> str:
+        return f"{self.base_url}/{object_name}".rstrip("/")
+
+    def _write_atomic(self, object_name: str, source: BinaryIO | bytes) -> None:
+        target = self._path(object_name)
+        directory = os.path.dirname(target)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".upload-")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                if isinstance(source, bytes):
+                    out.write(source)
+                else:
+                    while chunk := source.read(_COPY_CHUNK):
+                        out.write(chunk)
+                out.flush()
+                os.fsync(out.fileno())
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, target)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    async def upload_from_memory(self, file_content: bytes, object_name: str, content_type: str = "application/octet-stream") -> Optional[str]:
+        """Write bytes to disk and return public URL."""
+        try:
+            if not await self.ensure_ready():
+                return None
+            if not file_content:
+                logging.error("upload_from_memory: empty content")
+                return None
+            await asyncio.to_thread(self._write_atomic, object_name, file_content)
+            return self.public_url(object_name)
+        except Exception as e:
+            logging.error(f"upload_from_memory failed: {e}")
+            return None
+
+    async def upload_stream(self, file_obj: BinaryIO, object_name: str, content_type: str = "application/octet-stream",
+                            part_size: int | None = None) -> Optional[str]:
+        """Copy a seekable file object to disk in chunks."""
+        try:
+            if not await self.ensure_ready():
+                return None
+            file_obj.seek(0, os.SEEK_END)
+            if not file_obj.tell():
+                logging.error("upload_stream: empty content")
+                return None
+            file_obj.seek(0)
+            await asyncio.to_thread(self._write_atomic, object_name, file_obj)
+            return self.public_url(object_name)
+        except Exception as e:
+            logging.error(f"upload_stream failed: {e}")
+            return None
+
+    def _unlink(self, object_name: str) -> bool:
+        try:
+            os.unlink(self._path(object_name))
+        except FileNotFoundError:
+            pass  # same as S3: deleting a missing key is not an error
+        except Exception as e:
+            logging.error(f"delete {object_name} failed: {e}")
+            return False
+        return True
+
+    async def delete_object(self, object_name: str) -> bool:
+        return await asyncio.to_thread(self._unlink, object_name)
+
+    def _list(self, prefix: str) -> list[dict]:
+        # walk only the directory the prefix points into, not the whole root
+        head = prefix.rpartition("/")[0]
+        start = self._path(head) if head else self.root
+        objects = []
+        for directory, dirnames, filenames in os.walk(start):
+            dirnames.sort()
+            for filename in filenames:
+                if filename.startswith(".upload-"):
+                    continue
+                path = os.path.join(directory, filename)
+                key = os.path.relpath(path, self.root).replace(os.sep, "/")
+                if not key.startswith(prefix):
+                    continue
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                objects.append({
+                    "Key": key,
+                    "Size": st.st_size,
+                    "LastModified": datetime.fromtimestamp(st.st_mtime, timezone.utc),
+                })
+        objects.sort(key=lambda obj: obj["Key"])
+        return objects
+
+    async def iter_object_pages(self, prefix: str = "") -> AsyncIterator[list[dict]]:
+        """Yield the listing page by page (<= 1000 objects: Key, Size, LastModified)."""
+        if not await self.ensure_ready():
+            raise RuntimeError("object storage is not available")
+        objects = await asyncio.to_thread(self._list, prefix)
+        for i in range(0, len(objects), _PAGE_SIZE):
+            yield objects[i:i + _PAGE_SIZE]
+
+    async def _delete_objects(self, keys: list[str]) -> int:
+        """Delete files. Returns the number of keys that failed."""
+        results = await asyncio.to_thread(lambda: [self._unlink(key) for key in keys])
+        return results.count(False)
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,202 @@
+# upload_queue.py
+"""
+Очередь догрузки медиа в облако (таблица upload_jobs).
+
+Бот при сохранении букета не ждёт медленное или недоступное хранилище: всё, что не
+успело загрузиться, сохраняется как file_id и ставится сюда. Отдельный воркер
+(upload_worker.py) забирает задачи, грузит файлы с повторами и дописывает URL в
+bouquets.photos / video_path. Воркеров можно запускать несколько: задачи букета
+захватываются вместе условным UPDATE, зависшие после падения воркера
+возвращаются в очередь по lease.
+"""
+import logging
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import select, update, func
+
+import config
+from database import get_db_session, Bouquet, UploadJob, merge_bouquet_photos
+
+JOB_PHOTO = "photo"
+JOB_VIDEO = "video"
+
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _is_url(value) -> bool:
+    return isinstance(value, str) and value.startswith("http")
+
+
+def missing_uploads(photos: list, video: Optional[str]) -> list[tuple[str, str]]:
+    """(kind, file_id) всего, что ещё лежит только в Telegram."""
+    jobs = []
+    for item in photos or []:
+        if isinstance(item, dict) and item.get("file_id") and not item.get("url"):
+            jobs.append((JOB_PHOTO, item["file_id"]))
+        elif isinstance(item, str) and not _is_url(item):
+            jobs.append((JOB_PHOTO, item))
+    if video and not _is_url(video):
+        jobs.append((JOB_VIDEO, video))
+    return jobs
+
+
+async def enqueue_missing(bouquet_id: str, photos: list, video: Optional[str]) -> int:
+    """Поставить в очередь недогруженные медиа букета. Возвращает число задач."""
+    jobs = missing_uploads(photos, video)
+    if not jobs:
+        return 0
+
+    now = _utcnow()
+    session = await get_db_session()
+    try:
+        session.add_all([
+            UploadJob(bouquet_id=bouquet_id, kind=kind, file_id=file_id,
+                      status=JOB_PENDING, next_attempt_at=now, created_at=now)
+            for kind, file_id in jobs
+        ])
+        await session.commit()
+    except Exception as e:
+        await session.rollback()
+        logging.error(f"upload_queue.enqueue_missing error: {e}", exc_info=True)
+        return 0
+    finally:
+        await session.close()
+
+    logging.info(f"upload_queue: {len(jobs)} задач для букета {bouquet_id}")
+    return len(jobs)
+
+
+async def release_stale() -> int:
+    """Вернуть в очередь задачи, которые воркер взял и не закончил за UPLOAD_JOB_LEASE."""
+    cutoff = _utcnow() - timedelta(seconds=config.UPLOAD_JOB_LEASE)
+    session = await get_db_session()
+    try:
+        res = await session.execute(
+            update(UploadJob)
+            .where(UploadJob.status == JOB_RUNNING, UploadJob.locked_at < cutoff)
+            .values(status=JOB_PENDING, locked_at=None, locked_by=None)
+        )
+        await session.commit()
+        return res.rowcount or 0
+    finally:
+        await session.close()
+
+
+async def claim_jobs(limit: int) -> dict[str, list[UploadJob]]:
+    """
+    Захватить готовые к запуску задачи (pending, next_attempt_at наступил) не более чем
+    limit букетов. Задачи одного букета берутся вместе; букет, у которого уже есть
+    running-задача, пропускается до её завершения. Это не строгая гарантия (между
+    двумя воркерами возможна гонка), но запись в photos от неё не зависит —
+    merge_bouquet_photos не теряет чужие изменения. Возвращает {bouquet_id: [задачи]}.
+    """
+    now = _utcnow()
+    token = uuid.uuid4().hex
+    running = select(UploadJob.bouquet_id).where(UploadJob.status == JOB_RUNNING)
+    due = (
+        UploadJob.status == JOB_PENDING,
+        UploadJob.next_attempt_at <= now,
+        UploadJob.bouquet_id.not_in(running),
+    )
+    session = await get_db_session()
+    try:
+        bouquet_ids = (await session.execute(
+            select(UploadJob.bouquet_id)
+            .where(*due)
+            .group_by(UploadJob.bouquet_id)
+            .order_by(func.min(UploadJob.next_attempt_at))
+            .limit(limit)
+        )).scalars().all()
+        if not bouquet_ids:
+            return {}
+
+        # условный UPDATE: из нескольких воркеров задачу получит только один
+        await session.execute(
+            update(UploadJob)
+            .where(UploadJob.bouquet_id.in_(bouquet_ids), *due)
+            .values(status=JOB_RUNNING, locked_at=now, locked_by=token, attempts=UploadJob.attempts + 1)
+        )
+        await session.commit()
+
+        jobs = (await session.execute(
+            select(UploadJob).where(UploadJob.locked_by == token, UploadJob.status == JOB_RUNNING)
+            .order_by(UploadJob.id)
+        )).scalars().all()
+    finally:
+        await session.close()
+
+    grouped: dict[str, list[UploadJob]] = {}
+    for job in jobs:
+        grouped.setdefault(job.bouquet_id, []).append(job)
+    return grouped
+
+
+async def finish_job(job_id: int) -> None:
+    await _set_status(job_id, status=JOB_DONE, locked_at=None, locked_by=None, last_error=None)
+
+
+async def retry_or_fail(job: UploadJob, error: str) -> str:
+    """Отложить задачу с экспоненциальной задержкой или пометить failed после UPLOAD_JOB_MAX_ATTEMPTS."""
+    if job.attempts >= config.UPLOAD_JOB_MAX_ATTEMPTS:
+        await _set_status(job.id, status=JOB_FAILED, locked_at=None, locked_by=None, last_error=error)
+        logging.error(f"upload_queue: задача {job.id} ({job.kind} {job.bouquet_id}) не выполнена: {error}")
+        return JOB_FAILED
+
+    delay = min(config.UPLOAD_JOB_BACKOFF * 2 ** (job.attempts - 1), config.UPLOAD_JOB_BACKOFF_MAX)
+    await _set_status(
+        job.id, status=JOB_PENDING, locked_at=None, locked_by=None, last_error=error,
+        next_attempt_at=_utcnow() + timedelta(seconds=delay),
+    )
+    return JOB_PENDING
+
+
+async def _set_status(job_id: int, **values) -> None:
+    session = await get_db_session()
+    try:
+        await session.execute(update(UploadJob).where(UploadJob.id == job_id).values(**values))
+        await session.commit()
+    finally:
+        await session.close()
+
+
+async def backfill_photo(bouquet_id: str, file_id: str, result: dict) -> bool:
+    """Дописать URL загруженного фото в bouquets.photos. False — букета/фото уже нет."""
+    def _merge(photos: list) -> Optional[list]:
+        changed = False
+        for i, item in enumerate(photos):
+            if isinstance(item, dict) and item.get("file_id") == file_id and not item.get("url"):
+                photos[i] = {**item, **result}
+                changed = True
+            elif item == file_id:
+                photos[i] = {"file_id": file_id, **result}
+                changed = True
+        return photos if changed else None
+
+    return bool(await merge_bouquet_photos(bouquet_id, _merge))
+
+
+async def backfill_video(bouquet_id: str, file_id: str, url: str) -> bool:
+    """Заменить file_id в bouquets.video_path на URL. False — видео уже заменили/удалили."""
+    session = await get_db_session()
+    try:
+        res = await session.execute(
+            update(Bouquet)
+            .where(Bouquet.bouquet_id == bouquet_id, Bouquet.video_path == file_id)
+            .values(video_path=url)
+        )
+        await session.commit()
+        return bool(res.rowcount)
+    except Exception:
+        await session.rollback()
+        raise
+    finally:
+        await session.close()
@@ -0,0 +1,154 @@
+# upload_worker.py
+"""
+Воркер очереди загрузки медиа (upload_queue).
+
+Запускается отдельно от бота и масштабируется независимо:
+
+    python upload_worker.py              # работать постоянно
+    python upload_worker.py --once       # разобрать то, что готово сейчас, и выйти
+
+Нужны те же BOT_TOKEN / DATABASE_URL / настройки хранилища, что и у бота.
+Постоянно работающий воркер раз в STORAGE_GC_INTERVAL_HOURS запускает storage_gc
+(на все воркеры — один проход за интервал): только он освобождает фото удалённых букетов.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import sys
+from datetime import timedelta
+
+from aiogram import Bot
+
+import config
+from cache import close_redis
+from database import init_db, UploadJob
+from media_pipeline import PhotoUploadPipeline
+from media_workers import shutdown_image_pool
+from storage import media_storage, upload_video_to_storage
+import storage_gc
+import upload_queue
+
+logger = logging.getLogger("upload_worker")
+
+
+async def _upload(bot: Bot, job: UploadJob, slots: asyncio.Semaphore):
+    async with slots:
+        if job.kind == upload_queue.JOB_PHOTO:
+            result = await PhotoUploadPipeline(bot, job.bouquet_id).upload_one(job.file_id, job.id)
+            if not result:
+                raise RuntimeError("photo upload failed")
+            return result
+        if job.kind == upload_queue.JOB_VIDEO:
+            url = await upload_video_to_storage(bot, job.file_id, job.bouquet_id)
+            if not url:
+                raise RuntimeError("video upload failed")
+            return url
+        raise ValueError(f"unknown job kind {job.kind!r}")
+
+
+async def process_bouquet(bot: Bot, jobs: list[UploadJob], slots: asyncio.Semaphore) -> None:
+    """Загрузить медиа букета параллельно, затем по очереди дописать URL в букет."""
+    results = await asyncio.gather(*(_upload(bot, job, slots) for job in jobs), return_exceptions=True)
+
+    for job, result in zip(jobs, results):
+        try:
+            if isinstance(result, BaseException):
+                raise result
+            if job.kind == upload_queue.JOB_PHOTO:
+                applied = await upload_queue.backfill_photo(job.bouquet_id, job.file_id, result)
+            else:
+                applied = await upload_queue.backfill_video(job.bouquet_id, job.file_id, result)
+        except Exception as e:
+            status = await upload_queue.retry_or_fail(job, str(e)[:500])
+            logger.warning(f"job {job.id} ({job.kind} {job.bouquet_id}) attempt {job.attempts}: {e} -> {status}")
+            continue
+
+        await upload_queue.finish_job(job.id)
+        if applied:
+            logger.info(f"job {job.id}: {job.kind} букета {job.bouquet_id} загружено")
+        else:
+            # букет удалили или медиа заменили — файл подберёт storage_gc
+            logger.info(f"job {job.id}: букет {job.bouquet_id} больше не ссылается на файл")
+
+
+async def run_worker(bot: Bot, stop: asyncio.Event, once: bool = False) -> None:
+    batch = config.UPLOAD_WORKER_BATCH
+    slots = asyncio.Semaphore(config.MEDIA_UPLOAD_CONCURRENCY)
+    while not stop.is_set():
+        released = await upload_queue.release_stale()
+        if released:
+            logger.warning(f"вернул в очередь {released} зависших задач")
+
+        claimed = await upload_queue.claim_jobs(batch)
+        if claimed:
+            await asyncio.gather(*(process_bouquet(bot, jobs, slots) for jobs in claimed.values()))
+            if len(claimed) == batch:
+                continue
+        if once:
+            return
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=config.UPLOAD_WORKER_POLL)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_gc_schedule(stop: asyncio.Event) -> None:
+    """Плановый storage_gc: метку проверяем чаще интервала, чтобы рестарт воркера не сдвигал проходы."""
+    interval = timedelta(hours=config.STORAGE_GC_INTERVAL_HOURS)
+    check_every = min(interval.total_seconds(), 600.0)
+    while not stop.is_set():
+        try:
+            report = await storage_gc.run_if_due(interval)
+            if report is not None:
+                logger.info(f"storage_gc: {report.summary(dry_run=False)}")
+        except Exception as e:
+            logger.error(f"storage_gc: плановый проход не удался: {e}", exc_info=True)
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=check_every)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def main(args) -> None:
+    await init_db()
+    if not await media_storage.ensure_ready():
+        logger.warning("хранилище пока недоступно, задачи будут откладываться")
+
+    bot = Bot(token=os.getenv("BOT_TOKEN"))
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    logger.info("upload worker запущен")
+    gc_task = None
+    if config.STORAGE_GC_INTERVAL_HOURS > 0 and not args.once:
+        gc_task = asyncio.create_task(run_gc_schedule(stop), name="storage-gc")
+    try:
+        await run_worker(bot, stop, once=args.once)
+    finally:
+        if gc_task is not None:
+            # прерванный проход безопасен: недоудалённое подберёт следующий
+            gc_task.cancel()
+            try:
+                await gc_task
+            except asyncio.CancelledError:
+                pass
+        await bot.session.close()
+        await media_storage.close()
+        await close_redis()
+        shutdown_image_pool()
+        logger.info("upload worker остановлен")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[logging.StreamHandler(sys.stdout)],
+    )
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--once", action="store_true", help="обработать готовые задачи и выйти")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,129 @@
+# user_cache.py
+"""
+Пользователь бота (telegram_id → строка users) без похода в БД на каждый апдейт.
+
+UserMiddleware (outer, на dp.update) один раз за апдейт находит пользователя и кладёт
+его в данные обработчика как user: CachedUser. Поиск идёт по двум уровням кэша:
+  - LRU в памяти процесса (USER_CACHE_SIZE записей, USER_CACHE_LOCAL_TTL сек);
+  - Redis-хэш user:{telegram_id} (USER_CACHE_TTL сек), общий для всех процессов;
+и только при промахе обоих — get_or_create_user. Кто меняет настройки пользователя
+(media_limit), вызывает invalidate(): запись удаляется из Redis и из своего LRU,
+LRU других процессов доживает не дольше USER_CACHE_LOCAL_TTL.
+"""
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from aiogram.dispatcher.middlewares.base import BaseMiddleware
+
+import config
+import metrics
+from cache import get_redis
+from database import get_db_session, get_or_create_user
+
+_USER_KEY = "user:{}"
+
+
+@dataclass(frozen=True)
+class CachedUser:
+    """Снимок строки users: живёт дольше сессии БД, поэтому не ORM-объект."""
+    id: int
+    telegram_id: int
+    media_limit: int
+
+
+_local: "OrderedDict[int, tuple[float, CachedUser]]" = OrderedDict()
+
+
+def _local_get(telegram_id: int) -> Optional[CachedUser]:
+    entry = _local.get(telegram_id)
+    if entry is None:
+        return None
+    expires, user = entry
+    if expires < time.monotonic():
+        del _local[telegram_id]
+        return None
+    _local.move_to_end(telegram_id)
+    return user
+
+
+def _local_put(user: CachedUser) -> None:
+    _local[user.telegram_id] = (time.monotonic() + config.USER_CACHE_LOCAL_TTL, user)
+    _local.move_to_end(user.telegram_id)
+    while len(_local) > config.USER_CACHE_SIZE:
+        _local.popitem(last=False)
+
+
+async def _redis_get(telegram_id: int) -> Optional[CachedUser]:
+    try:
+        raw = await get_redis().hgetall(_USER_KEY.format(telegram_id))
+    except Exception as e:
+        logging.debug(f"user_cache: redis hgetall failed: {e}")
+        return None
+    if not raw:
+        return None
+    try:
+        return CachedUser(id=int(raw["id"]), telegram_id=telegram_id, media_limit=int(raw["media_limit"]))
+    except (KeyError, ValueError):
+        return None
+
+
+async def _redis_put(user: CachedUser) -> None:
+    key = _USER_KEY.format(user.telegram_id)
+    try:
+        redis = get_redis()
+        await redis.hset(key, mapping={"id": user.id, "media_limit": user.media_limit})
+        await redis.expire(key, config.USER_CACHE_TTL)
+    except Exception as e:
+        logging.debug(f"user_cache: redis hset failed: {e}")
+
+
+async def resolve(telegram_id: int) -> CachedUser:
+    """Пользователь по telegram_id: LRU → Redis → БД (создаётся при первом обращении)."""
+    user = _local_get(telegram_id)
+    if user is not None:
+        metrics.inc("user_cache.hit.local")
+        return user
+
+    user = await _redis_get(telegram_id)
+    if user is not None:
+        metrics.inc("user_cache.hit.redis")
+        _local_put(user)
+        return user
+
+    metrics.inc("user_cache.miss")
+    session = await get_db_session()
+    try:
+        row = await get_or_create_user(session, telegram_id)
+        await session.commit()
+        user = CachedUser(id=row.id, telegram_id=row.telegram_id, media_limit=row.media_limit or 6)
+    finally:
+        await session.close()
+    _local_put(user)
+    await _redis_put(user)
+    return user
+
+
+async def invalidate(telegram_id: int) -> None:
+    """Сбросить запись после изменения строки users."""
+    _local.pop(telegram_id, None)
+    try:
+        await get_redis().delete(_USER_KEY.format(telegram_id))
+    except Exception as e:
+        logging.warning(f"user_cache: не удалось сбросить пользователя {telegram_id} в Redis: {e}")
+
+
+class UserMiddleware(BaseMiddleware):
+    """Кладёт в данные обработчика user: CachedUser отправителя апдейта."""
+
+    async def __call__(self, handler, event, data):
+        from_user = data.get("event_from_user")
+        if from_user is not None and "user" not in data:
+            try:
+                data["user"] = await resolve(from_user.id)
+            except Exception as e:
+                # обработчики без user работают дальше, остальные найдут его сами
+                logging.error(f"UserMiddleware: пользователь {from_user.id} не найден: {e}", exc_info=True)
+        return await handler(event, data)
@@ -1,10 +1,24 @@
 import io
 import re
-from PIL import Image
+from PIL import Image, ImageOps
 import pyheif
 
+from media_workers import run_in_image_pool
+
+# Бренды контейнера HEIF (байты 8..12 после "ftyp")
+_HEIF_BRANDS = {b"heic", b"heix", b"hevc", b"hevx", b"heim", b"heis", b"mif1", b"msf1"}
+
+
+def is_heif(data: bytes) -> bool:
+    return len(data) >= 12 and data[4:8] == b"ftyp" and data[8:12] in _HEIF_BRANDS
+
 
 async def convert_heic_to_jpeg(heic_data: bytes) -> bytes:
+    """HEIC -> JPEG в пуле процессов (не блокирует event loop)."""
+    return await run_in_image_pool(heic_to_jpeg_bytes, heic_data)
+
+
+def heic_to_jpeg_bytes(heic_data: bytes) -> bytes:
     heif_file = pyheif.read(heic_data)
     image = Image.frombytes(
         heif_file.mode,
@@ -20,6 +34,52 @@ async def convert_heic_to_jpeg(heic_data: bytes) -> bytes:
     return img_byte_arr.getvalue()
 
 
+def make_derivatives(image_data: bytes, thumb_edge: int, webp_edge: int, webp_quality: int) -> tuple[bytes, bytes]:
+    """Превью (JPEG, длинная сторона thumb_edge) и WebP-вариант (не больше webp_edge)."""
+    with Image.open(io.BytesIO(image_data)) as src:
+        # как в normalize_photo: превью ориентированы так же, как оригинал на экране
+        image = ImageOps.exif_transpose(src).convert("RGB")
+
+    webp = image.copy()
+    webp.thumbnail((webp_edge, webp_edge), Image.LANCZOS)
+    webp_buf = io.BytesIO()
+    webp.save(webp_buf, format="WEBP", quality=webp_quality, method=4)
+
+    image.thumbnail((thumb_edge, thumb_edge), Image.LANCZOS)
+    thumb_buf = io.BytesIO()
+    image.save(thumb_buf, format="JPEG", quality=80, optimize=True)
+    return thumb_buf.getvalue(), webp_buf.getvalue()
+
+
+def normalize_photo(image_data: bytes, max_edge: int, quality: int) -> bytes:
+    """
+    Нормализация перед загрузкой: поворот по EXIF, без метаданных, длинная сторона
+    не больше max_edge, прогрессивный JPEG. Если менять нечего (нет EXIF, размер в
+    пределах) и перекодирование не уменьшает файл — возвращает исходные байты.
+    """
+    with Image.open(io.BytesIO(image_data)) as src:
+        has_meta = bool(src.info.get("exif") or src.getexif())
+        oversize = max(src.size) > max_edge
+        image = ImageOps.exif_transpose(src)
+        if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+            # прозрачность в JPEG не сохранить — кладём на белый фон
+            rgba = image.convert("RGBA")
+            image = Image.new("RGB", rgba.size, (255, 255, 255))
+            image.paste(rgba, mask=rgba.getchannel("A"))
+        else:
+            image = image.convert("RGB")
+
+    if oversize:
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    out = io.BytesIO()
+    image.save(out, format="JPEG", quality=quality, optimize=True, progressive=True)
+    result = out.getvalue()
+
+    if not has_meta and not oversize and len(result) >= len(image_data) and image_data[:3] == b"\xff\xd8\xff":
+        return image_data
+    return result
+
+
 def parse_composition(text: str):
     composition = []
     color_keywords = ["бел", "розов", "красн", "кремов", "бордов", "лилов", "жёлт", "желт"]